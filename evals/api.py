@@ -3,6 +3,7 @@ This file provides common interfaces and utilities used by eval creators to
 sample from models and process the results.
 """
 
+import asyncio
 import logging
 from abc import ABC, abstractmethod
 from typing import Any, Callable, Optional, Protocol, Union, runtime_checkable
@@ -37,9 +38,42 @@ class CompletionFn(Protocol):
         =======
         The result of the API call.
         The prompt that was fed into the API call as a str.
+
+        Implementations may additionally define an awaitable
+        `acall(prompt, **kwargs) -> CompletionResult` with the same semantics,
+        which is used by the async engine (`EVALS_ENGINE=async`). See
+        `AsyncCompletionFn`.
+        """
+
+
+@runtime_checkable
+class AsyncCompletionFn(CompletionFn, Protocol):
+    async def acall(
+        self,
+        prompt: Union[str, OpenAICreateChatPrompt],
+        **kwargs,
+    ) -> CompletionResult:
+        """
+        Awaitable counterpart of `__call__`. Takes the same arguments and returns
+        the same result, without blocking the event loop while waiting on the API.
         """
 
 
+async def acall_completion_fn(
+    completion_fn: CompletionFn,
+    prompt: Union[str, OpenAICreateChatPrompt],
+    **kwargs,
+) -> CompletionResult:
+    """
+    Call `completion_fn` from a coroutine. Uses `acall` when the CompletionFn
+    provides it; otherwise runs the blocking `__call__` in a worker thread (with
+    the current context, so recording still goes to the right sample).
+    """
+    if isinstance(completion_fn, AsyncCompletionFn):
+        return await completion_fn.acall(prompt=prompt, **kwargs)
+    return await asyncio.to_thread(completion_fn, prompt=prompt, **kwargs)
+
+
 class DummyCompletionResult(CompletionResult):
     def get_completions(self) -> list[str]:
         return ["This is a dummy response."]
@@ -51,6 +85,25 @@ class DummyCompletionFn(CompletionFn):
     ) -> CompletionResult:
         return DummyCompletionResult()
 
+    async def acall(
+        self, prompt: Union[OpenAICreatePrompt, OpenAICreateChatPrompt, Prompt], **kwargs
+    ) -> CompletionResult:
+        return DummyCompletionResult()
+
+
+def is_match_decided(sampled: str, expected: Union[str, list[str], tuple[str]]) -> bool:
+    """
+    Whether `record_and_check_match` (without a separator) gives the same result for
+    every continuation of `sampled`, i.e. it already starts with an expected option, or
+    can no longer start with any of them. Evals can pass this as `abort_stream` to
+    streaming completion fns to stop generating once the result is known.
+    """
+    if not isinstance(expected, (list, tuple)):
+        expected = [expected]
+    return any(sampled.startswith(option) for option in expected) or not any(
+        option.startswith(sampled) for option in expected
+    )
+
 
 def record_and_check_match(
     prompt: Any,
@@ -3,16 +3,19 @@ This file defines the `oaieval` CLI for running evals.
 """
 import argparse
 import logging
+import re
 import shlex
 import sys
-from typing import Any, Mapping, Optional
+from typing import Any, Mapping, Optional, Tuple
 
 import openai
 
 import evals
 import evals.api
 import evals.base
+import evals.metrics
 import evals.record
+import evals.utils.completion_cache
 from evals.registry import Registry
 
 logger = logging.getLogger(__name__)
@@ -32,11 +35,28 @@ def get_parser() -> argparse.ArgumentParser:
     parser.add_argument("eval", type=str, help="Name of an eval. See registry.")
     parser.add_argument("--extra_eval_params", type=str, default="")
     parser.add_argument("--max_samples", type=int, default=None)
-    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        help="Only run shard i of N of the samples, given as i/N (0 <= i < N). Combine the logs of all shards with oaieval-merge",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Reuse completions of temperature-0 requests from the on-disk cache (see EVALS_CACHE_DIR). Off unless EVALS_CACHE=1",
+    )
     parser.add_argument("--visible", action=argparse.BooleanOptionalAction, default=None)
     parser.add_argument("--seed", type=int, default=20220722)
     parser.add_argument("--user", type=str, default="")
     parser.add_argument("--record_path", type=str, default=None)
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        help="Resume an interrupted run from its record log, skipping samples which already completed and appending to the same log",
+    )
     parser.add_argument(
         "--log_to_file", type=str, default=None, help="Log to a file instead of stdout"
     )
@@ -50,15 +70,80 @@ def get_parser() -> argparse.ArgumentParser:
     return parser
 
 
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse a shard of the form "i/N" into (i, N)."""
+    shard_index, num_shards = shard.split("/")
+    return int(shard_index), int(num_shards)
+
+
+def parse_extra_eval_params(param_str: Optional[str]) -> Mapping[str, Any]:
+    """Parse a string of the form "key1=value1,key2=value2" into a dict."""
+    if not param_str:
+        return {}
+
+    def to_number(x):
+        try:
+            return int(x)
+        except:
+            pass
+        try:
+            return float(x)
+        except:
+            pass
+        return x
+
+    str_dict = dict(kv.split("=") for kv in param_str.split(","))
+    return {k: to_number(v) for k, v in str_dict.items()}
+
+
+# Record paths with these extensions are SQLite databases rather than JSONL logs.
+SQLITE_EXTENSIONS = (".sqlite", ".db")
+
+# Settings which determine the samples evaluated, and so must match when resuming a run.
+RESUMED_SETTINGS = ("max_samples", "shard", "seed")
+
+
+def resume_args(args: argparse.Namespace, run_config: Mapping[str, Any]) -> argparse.Namespace:
+    """Return `args` with the `RESUMED_SETTINGS` of the run being resumed."""
+    resumed = argparse.Namespace(**vars(args))
+    parser = get_parser()
+    for key in RESUMED_SETTINGS:
+        if key not in run_config:
+            continue
+        value = getattr(args, key)
+        if value != parser.get_default(key) and value != run_config[key]:
+            logger.warning(
+                f"Ignoring --{key} {value}: resuming with {run_config[key]} from the original run"
+            )
+        setattr(resumed, key, run_config[key])
+    return resumed
+
+
 def run(args, registry: Optional[Registry] = None):
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    record_log = None
+    if args.resume:
+        assert not args.resume.endswith(SQLITE_EXTENSIONS), (
+            f"--resume needs a JSONL record log, but {args.resume} is a SQLite database; "
+            "runs recorded to SQLite can't be resumed"
+        )
+        record_log = evals.record.read_record_log(args.resume)
+        assert record_log.spec is not None, f"No run spec found in {args.resume}"
+        if record_log.final_report is not None:
+            logger.info(f"Run in {args.resume} already finished, nothing to resume")
+            return record_log.spec["run_id"]
+        args = resume_args(args, record_log.spec["run_config"])
+
     visible = args.visible if args.visible is not None else (args.max_samples is None)
 
     if args.max_samples is not None:
         evals.eval.set_max_samples(args.max_samples)
 
+    if args.shard is not None:
+        evals.eval.set_shard(*parse_shard(args.shard))
+
     registry = registry or Registry()
     if args.registry_path:
         registry.add_registry_paths(args.registry_path)
@@ -71,11 +156,15 @@ def run(args, registry: Optional[Registry] = None):
     completion_fns = args.completion_fn.split(",")
     completion_fn_instances = [registry.make_completion_fn(url) for url in completion_fns]
 
+    extra_eval_params = parse_extra_eval_params(args.extra_eval_params)
+
     run_config = {
         "completion_fns": completion_fns,
         "eval_spec": eval_spec,
         "seed": args.seed,
         "max_samples": args.max_samples,
+        "shard": args.shard,
+        "extra_eval_params": extra_eval_params,
         "command": " ".join(map(shlex.quote, sys.argv)),
         "initial_settings": {
             "visible": visible,
@@ -83,53 +172,49 @@ def run(args, registry: Optional[Registry] = None):
     }
 
     eval_name = eval_spec.key
-    run_spec = evals.base.RunSpec(
-        completion_fns=completion_fns,
-        eval_name=eval_name,
-        base_eval=eval_name.split(".")[0],
-        split=eval_name.split(".")[1],
-        run_config=run_config,
-        created_by=args.user,
-    )
-    if args.record_path is None:
-        record_path = f"/tmp/evallogs/{run_spec.run_id}_{args.completion_fn}_{args.eval}.jsonl"
+    if args.resume:
+        assert args.local_run and not args.dry_run, "--resume is only supported for local runs"
+        run_spec = evals.record.run_spec_from_dict(record_log.spec)
+        if (run_spec.eval_name, run_spec.completion_fns) != (eval_name, completion_fns):
+            logger.warning(
+                f"Resuming {run_spec.eval_name} with {run_spec.completion_fns}, "
+                f"but got {eval_name} with {completion_fns}"
+            )
+        record_path = args.resume
+        recorder = evals.record.LocalRecorder(record_path, run_spec=run_spec, resume=True)
+        completed = recorder.restore_completed_samples(record_log)
+        evals.eval.set_skip_indices({evals.record.sample_index(i) for i in completed})
+        logger.info(f"Resuming run {run_spec.run_id}: {len(completed)} samples already completed")
     else:
-        record_path = args.record_path
-    if args.dry_run:
-        recorder = evals.record.DummyRecorder(run_spec=run_spec, log=args.dry_run_logging)
-    elif args.local_run:
-        recorder = evals.record.LocalRecorder(record_path, run_spec=run_spec)
-    else:
-        recorder = evals.record.Recorder(record_path, run_spec=run_spec)
-
-    api_extra_options = {}
-    if not args.cache:
-        api_extra_options["cache_level"] = 0
+        run_spec = evals.base.RunSpec(
+            completion_fns=completion_fns,
+            eval_name=eval_name,
+            base_eval=eval_name.split(".")[0],
+            split=eval_name.split(".")[1],
+            run_config=run_config,
+            created_by=args.user,
+        )
+        if args.record_path is None:
+            # completion fn names may contain paths (e.g. replay:<path>)
+            completion_fn_name = re.sub(r"[^\w.,-]", "_", args.completion_fn)
+            record_path = f"/tmp/evallogs/{run_spec.run_id}_{completion_fn_name}_{args.eval}.jsonl"
+        else:
+            record_path = args.record_path
+        if args.dry_run:
+            recorder = evals.record.DummyRecorder(run_spec=run_spec, log=args.dry_run_logging)
+        elif args.local_run and record_path.endswith(SQLITE_EXTENSIONS):
+            recorder = evals.record.SQLiteRecorder(record_path, run_spec=run_spec)
+        elif args.local_run:
+            recorder = evals.record.LocalRecorder(record_path, run_spec=run_spec)
+        else:
+            recorder = evals.record.Recorder(record_path, run_spec=run_spec)
+
+    if args.cache is not None:
+        evals.utils.completion_cache.set_cache_enabled(args.cache)
 
     run_url = f"{run_spec.run_id}"
     logger.info(_purple(f"Run started: {run_url}"))
 
-    def parse_extra_eval_params(param_str: Optional[str]) -> Mapping[str, Any]:
-        """Parse a string of the form "key1=value1,key2=value2" into a dict."""
-        if not param_str:
-            return {}
-
-        def to_number(x):
-            try:
-                return int(x)
-            except:
-                pass
-            try:
-                return float(x)
-            except:
-                pass
-            return x
-
-        str_dict = dict(kv.split("=") for kv in param_str.split(","))
-        return {k: to_number(v) for k, v in str_dict.items()}
-
-    extra_eval_params = parse_extra_eval_params(args.extra_eval_params)
-
     eval_class = registry.get_class(eval_spec)
     eval = eval_class(
         completion_fns=completion_fn_instances,
@@ -139,6 +224,8 @@ def run(args, registry: Optional[Registry] = None):
         **extra_eval_params,
     )
     result = eval.run(recorder)
+    result.update(recorder.get_final_report_info())
+    result.update(evals.metrics.get_usage_summary(recorder.get_events("usage")))
     recorder.record_final_report(result)
 
     if not (args.dry_run or args.local_run):
@@ -0,0 +1,43 @@
+import argparse
+
+import pytest
+
+from evals.base import RunSpec
+from evals.cli.oaieval import get_parser, resume_args, run
+from evals.record import LocalRecorder
+
+
+def test_resume_args_come_from_the_original_run():
+    args = get_parser().parse_args(["gpt-3.5-turbo", "test-match", "--resume", "log.jsonl"])
+    run_config = {"max_samples": 10, "shard": "1/4", "seed": 42}
+    resumed = resume_args(args, run_config)
+    assert (resumed.max_samples, resumed.shard, resumed.seed) == (10, "1/4", 42)
+    assert args.seed != 42
+
+
+def test_resume_finished_run_is_a_noop(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    run_spec = RunSpec(
+        completion_fns=["dummy"],
+        eval_name="test.s1",
+        base_eval="test",
+        split="s1",
+        run_config={},
+        created_by="",
+    )
+    recorder = LocalRecorder(path, run_spec)
+    recorder.record_match(True, sample_id="test.s1.0")
+    recorder.record_final_report({"accuracy": 1.0})
+    with open(path) as f:
+        log = f.read()
+
+    args = argparse.Namespace(debug=False, resume=path)
+    assert run(args) == run_spec.run_id
+    with open(path) as f:
+        assert f.read() == log
+
+
+def test_resume_rejects_sqlite_paths(tmp_path):
+    args = argparse.Namespace(debug=False, resume=str(tmp_path / "evals.sqlite"))
+    with pytest.raises(AssertionError, match="JSONL record log"):
+        run(args)
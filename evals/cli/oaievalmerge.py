@@ -0,0 +1,167 @@
+"""
+This file defines the `oaieval-merge` CLI for combining the record logs of a
+sharded eval run (see `oaieval --shard`) and recomputing its final report.
+"""
+import argparse
+import logging
+import sys
+from typing import Optional
+
+import evals
+import evals.base
+import evals.eval
+import evals.metrics
+import evals.record
+from evals.api import DummyCompletionFn
+from evals.registry import Registry
+
+logger = logging.getLogger(__name__)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Merge the record logs of a sharded eval run")
+    parser.add_argument("record_paths", type=str, nargs="+", help="Record logs of each shard")
+    parser.add_argument("--output", type=str, required=True, help="Path of the merged log")
+    parser.add_argument(
+        "--registry_path", type=str, default=None, action="append", help="Path to the registry"
+    )
+    parser.add_argument(
+        "--allow-partial",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Merge even if some shards are missing",
+    )
+    parser.add_argument(
+        "--generic-aggregation",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Compute the final report from the merged match and metrics events instead of "
+        "with the eval's own aggregation, for evals which can't be loaded",
+    )
+    return parser
+
+
+def check_shards(specs: list[dict], allow_partial: bool = False) -> None:
+    """Check that `specs` are the run specs of every shard of a single eval run."""
+    eval_names = {spec["eval_name"] for spec in specs}
+    assert len(eval_names) == 1, f"Logs are from different evals: {sorted(eval_names)}"
+    completion_fns = {tuple(spec["completion_fns"]) for spec in specs}
+    assert len(completion_fns) == 1, f"Logs are from different completion fns: {completion_fns}"
+
+    shards = [spec["run_config"].get("shard") for spec in specs]
+    if None in shards:
+        assert len(shards) == 1, "Logs from unsharded runs can't be merged with other logs"
+        return
+    num_shards = {int(shard.split("/")[1]) for shard in shards}
+    assert len(num_shards) == 1, f"Logs have different shard counts: {shards}"
+    num_shards = num_shards.pop()
+    assert len(set(shards)) == len(shards), f"Duplicate shards: {sorted(shards)}"
+    expected = {f"{i}/{num_shards}" for i in range(num_shards)}
+    missing = expected - set(shards)
+    if missing and not allow_partial:
+        raise ValueError(f"Missing shards {sorted(missing)}; pass --allow-partial to merge anyway")
+
+
+def aggregate_events(recorder: evals.record.RecorderBase) -> dict:
+    """
+    Compute a final report from the recorded events alone: the accuracy of the `match`
+    events and the mean of each numeric field of the `metrics` events. This is a fallback
+    for evals which can't be loaded, as it misses any other keys of their final report.
+    """
+    result = {}
+    matches = recorder.get_events("match")
+    if matches:
+        result["accuracy"] = evals.metrics.get_accuracy(matches)
+    result.update(evals.metrics.get_metrics_means(recorder.get_events("metrics")))
+    return result
+
+
+def rerun_aggregation(
+    recorder: evals.record.RecorderBase, spec: dict, registry: Optional[Registry] = None
+) -> dict:
+    """
+    Run the eval with no samples, so that its `run` only aggregates the merged events
+    into the same final report as an unsharded run.
+    """
+    registry = registry or Registry()
+    eval_spec = registry.get_eval(spec["eval_name"])
+    assert eval_spec is not None, f"Eval {spec['eval_name']} not found"
+    eval_class = registry.get_class(eval_spec)
+    eval = eval_class(
+        completion_fns=[DummyCompletionFn() for _ in spec["completion_fns"]],
+        seed=spec["run_config"]["seed"],
+        name=eval_spec.key,
+        registry=registry,
+        **spec["run_config"].get("extra_eval_params", {}),
+    )
+    # the samples were evaluated by the shards, so don't load them
+    eval.get_samples = lambda: []
+    with evals.eval.no_samples():
+        return eval.run(recorder)
+
+
+def merge(
+    record_paths: list[str],
+    output_path: str,
+    registry: Optional[Registry] = None,
+    allow_partial: bool = False,
+    generic: bool = False,
+) -> dict:
+    record_logs = [evals.record.read_record_log(path) for path in record_paths]
+    for path, record_log in zip(record_paths, record_logs):
+        assert record_log.spec is not None, f"No run spec found in {path}"
+    specs = [record_log.spec for record_log in record_logs]
+    check_shards(specs, allow_partial=allow_partial)
+
+    spec = specs[0]
+    run_config = {
+        **spec["run_config"],
+        "shard": None,
+        "merged_from": [s["run_id"] for s in specs],
+    }
+    run_spec = evals.base.RunSpec(
+        completion_fns=spec["completion_fns"],
+        eval_name=spec["eval_name"],
+        base_eval=spec["base_eval"],
+        split=spec["split"],
+        run_config=run_config,
+        created_by=spec["created_by"],
+    )
+    recorder = evals.record.LocalRecorder(output_path, run_spec=run_spec)
+    for record_log in record_logs:
+        recorder.record_events(record_log.events)
+
+    if generic:
+        result = aggregate_events(recorder)
+    else:
+        result = rerun_aggregation(recorder, spec, registry=registry)
+    result.update(evals.metrics.get_usage_summary(recorder.get_events("usage")))
+    recorder.flush_events()
+    recorder.record_final_report(result)
+    return result
+
+
+def main() -> None:
+    parser = get_parser()
+    args = parser.parse_args(sys.argv[1:])
+    logging.basicConfig(
+        format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s",
+        level=logging.INFO,
+    )
+    registry = Registry()
+    if args.registry_path:
+        registry.add_registry_paths(args.registry_path)
+    result = merge(
+        args.record_paths,
+        args.output,
+        registry=registry,
+        allow_partial=args.allow_partial,
+        generic=args.generic_aggregation,
+    )
+    logger.info("Final report:")
+    for key, value in result.items():
+        logger.info(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
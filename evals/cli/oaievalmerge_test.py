@@ -0,0 +1,95 @@
+import pytest
+
+import evals
+import evals.metrics
+from evals.base import RunSpec
+from evals.cli.oaievalmerge import check_shards, merge
+from evals.record import LocalRecorder, read_record_log
+from evals.registry import Registry
+
+
+class CountingEval(evals.Eval):
+    """Reports its accuracy, and a count which a generic aggregation wouldn't know of."""
+
+    def eval_sample(self, sample, rng):
+        raise NotImplementedError()
+
+    def run(self, recorder):
+        self.eval_all_samples(recorder, self.get_samples())
+        matches = recorder.get_events("match")
+        return {
+            "accuracy": evals.metrics.get_accuracy(matches),
+            "counts/correct": sum(e.data["correct"] for e in matches),
+        }
+
+
+def make_registry(tmp_path):
+    (tmp_path / "registry" / "evals").mkdir(parents=True)
+    (tmp_path / "registry" / "evals" / "merge-test.yaml").write_text(
+        "merge-test:\n"
+        "  id: merge-test.s1.v0\n"
+        "merge-test.s1.v0:\n"
+        "  class: evals.cli.oaievalmerge_test:CountingEval\n"
+        "  args:\n"
+        "    samples_jsonl: missing.jsonl\n"
+    )
+    return Registry([tmp_path / "registry"])
+
+
+def make_shard_log(path, shard, correct):
+    run_spec = RunSpec(
+        completion_fns=["dummy"],
+        eval_name="merge-test.s1.v0",
+        base_eval="merge-test",
+        split="s1",
+        run_config={"seed": 20220722, "shard": shard},
+        created_by="",
+    )
+    recorder = LocalRecorder(str(path), run_spec)
+    for i, is_correct in enumerate(correct):
+        sample_id = f"merge-test.s1.{shard}.{i}"
+        recorder.record_match(is_correct, sample_id=sample_id)
+        recorder.record_event("metrics", {"score": float(is_correct)}, sample_id=sample_id)
+    recorder.record_final_report({"accuracy": sum(correct) / len(correct)})
+    return run_spec
+
+
+def test_check_shards():
+    def spec(shard, eval_name="test.s1"):
+        return {"eval_name": eval_name, "completion_fns": ["dummy"], "run_config": {"shard": shard}}
+
+    check_shards([spec("0/2"), spec("1/2")])
+    check_shards([spec(None)])
+    with pytest.raises(ValueError, match="Missing shards"):
+        check_shards([spec("0/2")])
+    check_shards([spec("0/2")], allow_partial=True)
+    with pytest.raises(AssertionError, match="Duplicate shards"):
+        check_shards([spec("0/2"), spec("0/2")])
+    with pytest.raises(AssertionError, match="different evals"):
+        check_shards([spec("0/2"), spec("1/2", eval_name="test.s2")])
+
+
+def test_merge_two_shards(tmp_path):
+    specs = [
+        make_shard_log(tmp_path / "shard-0.jsonl", "0/2", [True, True, False]),
+        make_shard_log(tmp_path / "shard-1.jsonl", "1/2", [True]),
+    ]
+    record_paths = [str(tmp_path / "shard-0.jsonl"), str(tmp_path / "shard-1.jsonl")]
+    output_path = str(tmp_path / "merged.jsonl")
+    result = merge(record_paths, output_path, registry=make_registry(tmp_path))
+    # the eval's own final report, without loading its samples
+    assert result == {"accuracy": 0.75, "counts/correct": 3}
+
+    merged = read_record_log(output_path)
+    assert merged.spec["run_config"]["shard"] is None
+    assert merged.spec["run_config"]["merged_from"] == [spec.run_id for spec in specs]
+    assert len([e for e in merged.events if e.type == "match"]) == 4
+    assert merged.final_report == result
+
+
+def test_merge_generic_aggregation(tmp_path):
+    make_shard_log(tmp_path / "shard-0.jsonl", "0/2", [True, False])
+    make_shard_log(tmp_path / "shard-1.jsonl", "1/2", [True, True])
+    record_paths = [str(tmp_path / "shard-0.jsonl"), str(tmp_path / "shard-1.jsonl")]
+    result = merge(record_paths, str(tmp_path / "merged.jsonl"), generic=True)
+    assert result == {"accuracy": 0.75, "score": 0.75}
@@ -0,0 +1,250 @@
+"""
+Load balancing requests across a pool of OpenAI-compatible endpoints and API keys
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Optional, Sequence
+
+import openai
+
+from evals.completion_fns.openai import OpenAIChatCompletionFn, OpenAICompletionFn
+from evals.utils.api_utils import (
+    on_request_retry,
+    on_request_success,
+    openai_acreate_streaming,
+    openai_create_streaming,
+)
+
+logger = logging.getLogger(__name__)
+
+# Errors which count against the health of the backend which raised them. Other
+# errors (e.g. invalid requests) are raised to the caller without a retry.
+BACKEND_FAILURE_EXCEPTIONS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+)
+
+
+class Backend:
+    """An endpoint and API key to send requests to, with its load and health."""
+
+    def __init__(
+        self,
+        name: str,
+        api_base: Optional[str] = None,
+        api_key: Optional[str] = None,
+        api_key_env: Optional[str] = None,
+        model: Optional[str] = None,
+        weight: float = 1.0,
+    ):
+        self.name = name
+        self.api_base = api_base
+        self.api_key = os.environ[api_key_env] if api_key_env else api_key
+        self.model = model
+        self.weight = weight
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.num_requests = 0
+        self.num_failures = 0
+        self.num_ejections = 0
+        self.num_tokens = 0
+
+    def request_kwargs(self) -> dict:
+        kwargs = {"api_base": self.api_base, "api_key": self.api_key}
+        if self.model is not None:
+            kwargs["model"] = self.model
+        return kwargs
+
+
+class BackendPool:
+    """
+    Routes each request to the least loaded (relative to its `weight`) healthy backend.
+    A backend which fails `failure_threshold` requests in a row is taken out of
+    rotation for `cooldown` seconds; after that, a single further failure takes it out
+    again.
+    """
+
+    def __init__(
+        self, backends: Sequence[Backend], failure_threshold: int = 3, cooldown: float = 30.0
+    ):
+        assert backends, "At least one backend is required"
+        self.backends = list(backends)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._start: Optional[float] = None
+
+    def acquire(self) -> tuple[Optional[Backend], float]:
+        """
+        Return a backend to send a request to, or None and the time to wait until one
+        is back in rotation.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._start is None:
+                self._start = now
+            healthy = [b for b in self.backends if b.unhealthy_until <= now]
+            if not healthy:
+                return None, min(b.unhealthy_until for b in self.backends) - now
+            backend = min(healthy, key=lambda b: b.in_flight / b.weight)
+            backend.in_flight += 1
+            return backend, 0.0
+
+    def release(self, backend: Backend, error: Optional[BaseException] = None, tokens: int = 0):
+        with self._lock:
+            backend.in_flight -= 1
+            if error is None:
+                backend.consecutive_failures = 0
+                backend.num_requests += 1
+                backend.num_tokens += tokens
+                return
+            if not isinstance(error, BACKEND_FAILURE_EXCEPTIONS):
+                return
+            backend.num_failures += 1
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.failure_threshold:
+                backend.unhealthy_until = time.monotonic() + self.cooldown
+                backend.num_ejections += 1
+                # on its return, the backend is ejected again by its next failure
+                backend.consecutive_failures = self.failure_threshold - 1
+                logger.warning(
+                    f"Taking backend {backend.name} out of rotation for {self.cooldown}s "
+                    f"after {type(error).__name__}: {error}"
+                )
+
+    def summary(self) -> dict[str, float]:
+        with self._lock:
+            elapsed = max(time.monotonic() - (self._start or time.monotonic()), 1e-9)
+            summary = {}
+            for b in self.backends:
+                prefix = f"load_balancer/{b.name}"
+                summary[f"{prefix}/requests"] = b.num_requests
+                summary[f"{prefix}/failures"] = b.num_failures
+                summary[f"{prefix}/ejections"] = b.num_ejections
+                summary[f"{prefix}/tokens"] = b.num_tokens
+                summary[f"{prefix}/requests_per_second"] = b.num_requests / elapsed
+                summary[f"{prefix}/tokens_per_second"] = b.num_tokens / elapsed
+            return summary
+
+
+class LoadBalancingMixin:
+    """
+    Sends the requests of an OpenAI completion fn to a pool of backends, each given as
+    a dict of `Backend` args: `name`, `api_base`, `api_key` (or `api_key_env`, the name
+    of an environment variable holding it), `model` (if it differs from `model`) and
+    `weight`. A failed request is retried on the next backend chosen, up to
+    `max_attempts` times; once it has failed on every backend, each further round of
+    retries waits a jittered delay, starting at up to `retry_backoff` seconds and
+    doubling up to `max_retry_backoff`. Per-backend throughput is added to the final
+    report under `load_balancer/<name>/...`.
+    """
+
+    def __init__(
+        self,
+        backends: Sequence[dict[str, Any]],
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        max_attempts: int = 20,
+        retry_backoff: float = 1.0,
+        max_retry_backoff: float = 60.0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.pool = BackendPool(
+            [Backend(**{"name": str(i), **backend}) for i, backend in enumerate(backends)],
+            failure_threshold=failure_threshold,
+            cooldown=cooldown,
+        )
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+
+    def final_report_info(self) -> dict[str, float]:
+        """Per-backend throughput, added to the final report once the samples are evaluated."""
+        return self.pool.summary()
+
+    def _release(self, backend: Backend, raw_data: Any = None, error: BaseException = None):
+        usage = (raw_data or {}).get("usage") or {}
+        self.pool.release(backend, error=error, tokens=usage.get("total_tokens", 0))
+
+    def _retry_delay(self, num_failures: int) -> float:
+        """Fail over straight away, but back off after every round of the backends."""
+        num_rounds, num_in_round = divmod(num_failures, len(self.pool.backends))
+        if num_in_round:
+            return 0.0
+        return random.uniform(
+            0, min(self.max_retry_backoff, self.retry_backoff * 2 ** (num_rounds - 1))
+        )
+
+    def _should_retry(self, error: BaseException, num_failures: int) -> bool:
+        return isinstance(error, BACKEND_FAILURE_EXCEPTIONS) and num_failures < self.max_attempts
+
+    def _create(self, request_kwargs: dict, abort_stream=None) -> Any:
+        num_failures = 0
+        while True:
+            backend, wait = self.pool.acquire()
+            if backend is None:
+                time.sleep(wait)
+                continue
+            kwargs = {**request_kwargs, **backend.request_kwargs()}
+            try:
+                if self.stream:
+                    raw_data = openai_create_streaming(
+                        self.api_resource, abort_stream=abort_stream, **kwargs
+                    )
+                else:
+                    raw_data = self.create_once(**kwargs)
+            except BaseException as e:
+                self._release(backend, error=e)
+                num_failures += 1
+                if not self._should_retry(e, num_failures):
+                    raise
+                on_request_retry(e)
+                time.sleep(self._retry_delay(num_failures))
+                continue
+            self._release(backend, raw_data=raw_data)
+            on_request_success()
+            return raw_data
+
+    async def _acreate(self, request_kwargs: dict, abort_stream=None) -> Any:
+        num_failures = 0
+        while True:
+            backend, wait = self.pool.acquire()
+            if backend is None:
+                await asyncio.sleep(wait)
+                continue
+            kwargs = {**request_kwargs, **backend.request_kwargs()}
+            try:
+                if self.stream:
+                    raw_data = await openai_acreate_streaming(
+                        self.api_resource, abort_stream=abort_stream, **kwargs
+                    )
+                else:
+                    raw_data = await self.acreate_once(**kwargs)
+            except BaseException as e:
+                self._release(backend, error=e)
+                num_failures += 1
+                if not self._should_retry(e, num_failures):
+                    raise
+                on_request_retry(e)
+                await asyncio.sleep(self._retry_delay(num_failures))
+                continue
+            self._release(backend, raw_data=raw_data)
+            on_request_success()
+            return raw_data
+
+
+class LoadBalancingChatCompletionFn(LoadBalancingMixin, OpenAIChatCompletionFn):
+    pass
+
+
+class LoadBalancingCompletionFn(LoadBalancingMixin, OpenAICompletionFn):
+    pass
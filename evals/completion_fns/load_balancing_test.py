@@ -0,0 +1,106 @@
+import openai
+import pytest
+
+from evals.completion_fns.load_balancing import Backend, BackendPool, LoadBalancingChatCompletionFn
+from evals.record import DummyRecorder
+
+
+def test_pool_routes_to_least_loaded_backend():
+    pool = BackendPool([Backend("a"), Backend("b", weight=2.0)])
+    picked = [pool.acquire()[0].name for _ in range(3)]
+    assert picked == ["a", "b", "b"]
+
+
+def test_pool_ejects_failing_backend():
+    a, b = Backend("a"), Backend("b")
+    pool = BackendPool([a, b], failure_threshold=2, cooldown=60.0)
+    for _ in range(2):
+        backend, _ = pool.acquire()
+        assert backend is a
+        pool.release(backend, error=openai.error.RateLimitError("slow down"))
+    assert a.num_ejections == 1
+    assert all(pool.acquire()[0] is b for _ in range(3))
+
+    pool.release(b, error=openai.error.APIError("server error"))
+    pool.release(b, error=openai.error.APIError("server error"))
+    backend, wait = pool.acquire()
+    assert backend is None and 0 < wait <= 60.0
+
+
+def test_pool_ignores_request_errors():
+    a = Backend("a")
+    pool = BackendPool([a], failure_threshold=1)
+    pool.acquire()
+    pool.release(a, error=openai.error.InvalidRequestError("bad prompt", None))
+    assert a.num_failures == 0 and a.unhealthy_until == 0
+
+
+def test_load_balancing_fails_over(monkeypatch):
+    monkeypatch.setenv("EVALS_CACHE", "0")
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs["api_key"])
+        if kwargs["api_key"] == "bad":
+            raise openai.error.RateLimitError("quota exceeded")
+        return {
+            "choices": [{"message": {"content": "hi"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4},
+        }
+
+    completion_fn = LoadBalancingChatCompletionFn(
+        model="gpt-3.5-turbo",
+        backends=[{"name": "bad", "api_key": "bad"}, {"name": "good", "api_key": "good"}],
+        failure_threshold=1,
+    )
+    monkeypatch.setattr(completion_fn, "create_once", create)
+    recorder = DummyRecorder(None)
+    with recorder.as_default_recorder("test.s1.0"):
+        for _ in range(3):
+            assert completion_fn("hello").get_completions() == ["hi"]
+    assert calls == ["bad", "good", "good", "good"]
+    # the summary is only recorded once, at the end of the run
+    assert recorder.get_final_report_info() == {}
+    report = completion_fn.final_report_info()
+    assert report["load_balancer/good/requests"] == 3
+    assert report["load_balancer/good/tokens"] == 12
+    assert report["load_balancer/bad/ejections"] == 1
+
+
+def test_load_balancing_gives_up(monkeypatch):
+    def create(**kwargs):
+        raise openai.error.ServiceUnavailableError("down")
+
+    completion_fn = LoadBalancingChatCompletionFn(
+        model="gpt-3.5-turbo",
+        backends=[{"api_key": "a"}],
+        cooldown=0.0,
+        max_attempts=3,
+        retry_backoff=0.01,
+    )
+    monkeypatch.setattr(completion_fn, "create_once", create)
+    delays = []
+    retry_delay = completion_fn._retry_delay
+    monkeypatch.setattr(
+        completion_fn, "_retry_delay", lambda n: delays.append(retry_delay(n)) or delays[-1]
+    )
+    with DummyRecorder(None).as_default_recorder("test.s1.0"):
+        with pytest.raises(openai.error.ServiceUnavailableError):
+            completion_fn("hello")
+    assert completion_fn.pool.backends[0].num_failures == 3
+    # a single backend is backed off from after each failure
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 0.01 and 0 <= delays[1] <= 0.02
+
+
+def test_load_balancing_retry_delay():
+    completion_fn = LoadBalancingChatCompletionFn(
+        model="gpt-3.5-turbo",
+        backends=[{"api_key": "a"}, {"api_key": "b"}],
+        retry_backoff=1.0,
+        max_retry_backoff=3.0,
+    )
+    assert completion_fn._retry_delay(1) == 0.0
+    assert 0 <= completion_fn._retry_delay(2) <= 1.0
+    assert completion_fn._retry_delay(3) == 0.0
+    assert all(0 <= completion_fn._retry_delay(10) <= 3.0 for _ in range(100))
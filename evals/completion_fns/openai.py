@@ -1,19 +1,43 @@
-from typing import Any, Optional, Union
-from evals.api import CompletionFn, CompletionResult
-from evals.base import CompletionFnSpec
+import logging
+import os
+import time
+from typing import Any, Callable, Optional, Union
+
+import openai
 
+from evals.api import CompletionFn, CompletionResult
 from evals.prompt.base import (
     ChatCompletionPrompt,
     CompletionPrompt,
     OpenAICreateChatPrompt,
-    OpenAICreatePrompt,
     Prompt,
+    num_tokens_from_prompt,
+    truncate_prompt,
 )
-from evals.record import record_sampling
+from evals.record import increment_final_report_info, record_event, record_sampling, record_usage
 from evals.utils.api_utils import (
+    count_retries,
+    openai_acreate_streaming_retrying,
+    openai_chat_completion_acreate,
+    openai_chat_completion_acreate_retrying,
+    openai_chat_completion_create,
     openai_chat_completion_create_retrying,
+    openai_completion_acreate,
+    openai_completion_acreate_retrying,
+    openai_completion_create,
     openai_completion_create_retrying,
+    openai_create_streaming_retrying,
 )
+from evals.utils.batching import CompletionBatcher, is_batchable
+from evals.utils.completion_cache import CompletionCache, get_completion_cache, is_cacheable
+from evals.utils.rate_limiter import configure_rate_limit
+from evals.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_OVERFLOW_POLICIES = ("off", "skip", "truncate_left", "truncate_right")
+
+_single_flight = SingleFlight()
 
 
 class OpenAIBaseCompletionResult(CompletionResult):
@@ -45,7 +69,22 @@ class OpenAICompletionResult(OpenAIBaseCompletionResult):
         return completions
 
 
-class OpenAICompletionFn(CompletionFn):
+class OpenAIBaseCompletionFn(CompletionFn):
+    """
+    Shared implementation of the OpenAI completion fns. Subclasses pick the prompt
+    and result classes, the name of the prompt argument, and the API helpers (with and
+    without retries).
+    """
+
+    prompt_class: type[Prompt]
+    result_class: type[OpenAIBaseCompletionResult]
+    prompt_arg: str
+    create_retrying: Callable[..., Any]
+    acreate_retrying: Callable[..., Any]
+    create_once: Callable[..., Any]
+    acreate_once: Callable[..., Any]
+    api_resource: Any
+
     def __init__(
         self,
         model: Optional[str] = None,
@@ -53,19 +92,47 @@ class OpenAICompletionFn(CompletionFn):
         api_key: Optional[str] = None,
         n_ctx: Optional[int] = None,
         extra_options: Optional[dict] = {},
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        stream: Optional[bool] = None,
+        context_overflow: Optional[str] = None,
+        name: Optional[str] = None,
         **kwargs,
     ):
+        """
+        `name` identifies this completion fn in its `usage` events (default: the
+        registry ID it was made from, or else `model`).
+
+        If `stream` (default `EVALS_STREAM`) is set, responses are streamed, recording
+        the time to first token and inter-token latency, and callers can pass an
+        `abort_stream` function of the text generated so far to stop a generation early.
+
+        If `n_ctx` is set, requests whose prompt and `max_tokens` don't fit in it are
+        handled according to `context_overflow` (default `EVALS_CONTEXT_OVERFLOW`):
+        "off" (the default) sends them to the API regardless, "skip" records a `skip`
+        event and returns an empty completion without calling the API, while
+        "truncate_left" and "truncate_right" truncate the prompt from its start or end
+        to fit.
+        """
         self.model = model
+        self.name = name
         self.api_base = api_base
         self.api_key = api_key
         self.n_ctx = n_ctx
         self.extra_options = extra_options
+        if requests_per_minute or tokens_per_minute:
+            configure_rate_limit(model, requests_per_minute, tokens_per_minute)
+        if stream is None:
+            stream = os.environ.get("EVALS_STREAM", "0") in {"1", "true", "yes"}
+        self.stream = stream
+        if context_overflow is None:
+            context_overflow = os.environ.get("EVALS_CONTEXT_OVERFLOW", "off")
+        assert (
+            context_overflow in CONTEXT_OVERFLOW_POLICIES
+        ), f"context_overflow must be one of {CONTEXT_OVERFLOW_POLICIES}, got {context_overflow}"
+        self.context_overflow = context_overflow
 
-    def __call__(
-        self,
-        prompt: Union[str, OpenAICreateChatPrompt],
-        **kwargs,
-    ) -> OpenAICompletionResult:
+    def _format_prompt(self, prompt: Union[str, OpenAICreateChatPrompt]) -> Any:
         if not isinstance(prompt, Prompt):
             assert (
                 isinstance(prompt, str)
@@ -74,66 +141,267 @@ class OpenAICompletionFn(CompletionFn):
                 or (isinstance(prompt, list) and all(isinstance(msg, dict) for msg in prompt))
             ), f"Got type {type(prompt)}, with val {type(prompt[0])} for prompt, expected str or list[int] or list[str] or list[dict[str, str]]"
 
-            prompt = CompletionPrompt(
+            prompt = self.prompt_class(
                 raw_prompt=prompt,
             )
 
-        openai_create_prompt: OpenAICreatePrompt = prompt.to_formatted_prompt()
+        return prompt.to_formatted_prompt()
+
+    def _preflight(self, openai_create_prompt: Any, kwargs: dict) -> Optional[Any]:
+        """
+        Check that the prompt and `max_tokens` fit in the context window, returning
+        the prompt to send (truncated if needed), or None if the request is skipped.
+        """
+        is_batch = self.prompt_arg == "prompt" and not is_batchable(openai_create_prompt)
+        if self.context_overflow == "off" or self.n_ctx is None or is_batch:
+            return openai_create_prompt
+        max_tokens = {**kwargs, **self.extra_options}.get("max_tokens")
+        if max_tokens is None:
+            # chat models default to using the rest of the context, but need some room
+            max_tokens = 16 if self.prompt_arg == "prompt" else 1
+        prompt_tokens = num_tokens_from_prompt(openai_create_prompt, self.model)
+        if prompt_tokens + max_tokens <= self.n_ctx:
+            return openai_create_prompt
+
+        if self.context_overflow == "skip" or max_tokens >= self.n_ctx:
+            logger.warning(
+                f"Skipping a request of {prompt_tokens} prompt tokens and {max_tokens} "
+                f"max_tokens, which don't fit in the context window of {self.n_ctx} tokens"
+            )
+            record_event(
+                "skip",
+                {
+                    "reason": "context_overflow",
+                    "prompt_tokens": prompt_tokens,
+                    "max_tokens": max_tokens,
+                    "n_ctx": self.n_ctx,
+                },
+            )
+            return None
+        side = self.context_overflow.split("_")[1]
+        return truncate_prompt(openai_create_prompt, self.n_ctx - max_tokens, self.model, side)
 
-        result = openai_completion_create_retrying(
+    def _make_skipped_result(self, openai_create_prompt: Any, kwargs: dict):
+        n = {**kwargs, **self.extra_options}.get("n", 1)
+        if self.prompt_arg == "messages":
+            choice = {"message": {"role": "assistant", "content": ""}}
+        else:
+            choice = {"text": ""}
+        raw_data = {
+            "choices": [
+                {"index": i, **choice, "finish_reason": "context_overflow"} for i in range(n)
+            ]
+        }
+        return self.result_class(raw_data=raw_data, prompt=openai_create_prompt)
+
+    def _request_kwargs(self, openai_create_prompt: Any, kwargs: dict) -> dict:
+        return {
+            "model": self.model,
+            "api_base": self.api_base,
+            "api_key": self.api_key,
+            self.prompt_arg: openai_create_prompt,
+            **kwargs,
+            **self.extra_options,
+        }
+
+    def _request_key(self, request_kwargs: dict) -> Optional[str]:
+        """Return a key identifying a deterministic request, or None for other requests."""
+        if not is_cacheable(request_kwargs):
+            return None
+        return CompletionCache.make_key(
+            endpoint=self.prompt_arg,
+            **{k: v for k, v in request_kwargs.items() if k != "api_key"},
+        )
+
+    def _make_result(
+        self, raw_data: Any, openai_create_prompt: Any, latency: float, retries: int, **extra
+    ):
+        result = self.result_class(raw_data=raw_data, prompt=openai_create_prompt)
+        record_sampling(prompt=result.prompt, sampled=result.get_completions(), **extra)
+        usage = (raw_data or {}).get("usage") or {}
+        if not extra and raw_data.get("stream_stats"):
+            stream_stats = raw_data["stream_stats"]
+            extra = {
+                "time_to_first_token": stream_stats["time_to_first_token"],
+                "inter_token_latency": stream_stats["inter_token_latency"],
+            }
+            if stream_stats["aborted"]:
+                extra["aborted"] = True
+        record_usage(
             model=self.model,
-            api_base=self.api_base,
-            api_key=self.api_key,
-            prompt=openai_create_prompt,
-            **{**kwargs, **self.extra_options},
+            latency=latency,
+            completion_fn=self.name or self.model,
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            retries=retries,
+            **extra,
         )
-        result = OpenAICompletionResult(raw_data=result, prompt=openai_create_prompt)
-        record_sampling(prompt=result.prompt, sampled=result.get_completions())
         return result
 
+    def _create(self, request_kwargs: dict, abort_stream=None) -> Any:
+        if self.stream:
+            return openai_create_streaming_retrying(
+                self.api_resource, abort_stream=abort_stream, **request_kwargs
+            )
+        return self.create_retrying(**request_kwargs)
 
-class OpenAIChatCompletionFn(CompletionFnSpec):
-    def __init__(
+    async def _acreate(self, request_kwargs: dict, abort_stream=None) -> Any:
+        if self.stream:
+            return await openai_acreate_streaming_retrying(
+                self.api_resource, abort_stream=abort_stream, **request_kwargs
+            )
+        return await self.acreate_retrying(**request_kwargs)
+
+    @staticmethod
+    def _cache_response(request_key: str, raw_data: Any):
+        cache = get_completion_cache()
+        if cache is not None:
+            cache.set(request_key, {k: v for k, v in raw_data.items() if k != "stream_stats"})
+
+    def _create_and_cache(self, request_key: str, request_kwargs: dict) -> Any:
+        raw_data = self._create(request_kwargs)
+        self._cache_response(request_key, raw_data)
+        return raw_data
+
+    async def _acreate_and_cache(self, request_key: str, request_kwargs: dict) -> Any:
+        raw_data = await self._acreate(request_kwargs)
+        self._cache_response(request_key, raw_data)
+        return raw_data
+
+    def _get_raw_data(self, request_kwargs: dict, abort_stream=None) -> tuple[Any, dict]:
+        """
+        Return the response to a request, and extra information about where it came
+        from (the completion cache, or a shared in-flight request) to record with it.
+        """
+        request_key = self._request_key(request_kwargs)
+        # a generation which may be aborted early can't be reused for other requests
+        if request_key is None or abort_stream is not None:
+            return self._create(request_kwargs, abort_stream), {}
+
+        cache = get_completion_cache()
+        raw_data = cache.get(request_key) if cache is not None else None
+        if raw_data is not None:
+            return raw_data, {"cached": True}
+        # identical requests in flight at the same time share one API call
+        raw_data, shared = _single_flight.do(
+            request_key, lambda: self._create_and_cache(request_key, request_kwargs)
+        )
+        if not shared:
+            return raw_data, {}
+        increment_final_report_info("single_flight/hits")
+        return raw_data, {"deduplicated": True}
+
+    async def _aget_raw_data(self, request_kwargs: dict, abort_stream=None) -> tuple[Any, dict]:
+        request_key = self._request_key(request_kwargs)
+        if request_key is None or abort_stream is not None:
+            return await self._acreate(request_kwargs, abort_stream), {}
+
+        cache = get_completion_cache()
+        raw_data = cache.get(request_key) if cache is not None else None
+        if raw_data is not None:
+            return raw_data, {"cached": True}
+        raw_data, shared = await _single_flight.ado(
+            request_key, lambda: self._acreate_and_cache(request_key, request_kwargs)
+        )
+        if not shared:
+            return raw_data, {}
+        increment_final_report_info("single_flight/hits")
+        return raw_data, {"deduplicated": True}
+
+    def __call__(
         self,
-        model: Optional[str] = None,
-        api_base: Optional[str] = None,
-        api_key: Optional[str] = None,
-        n_ctx: Optional[int] = None,
-        extra_options: Optional[dict] = {},
+        prompt: Union[str, OpenAICreateChatPrompt],
+        abort_stream: Optional[Callable[[str], bool]] = None,
         **kwargs,
-    ):
-        self.model = model
-        self.api_base = api_base
-        self.api_key = api_key
-        self.n_ctx = n_ctx
-        self.extra_options = extra_options
+    ) -> OpenAIBaseCompletionResult:
+        if not self.stream:
+            abort_stream = None
+        openai_create_prompt = self._format_prompt(prompt)
+        sent_prompt = self._preflight(openai_create_prompt, kwargs)
+        if sent_prompt is None:
+            return self._make_skipped_result(openai_create_prompt, kwargs)
+        openai_create_prompt = sent_prompt
+        request_kwargs = self._request_kwargs(openai_create_prompt, kwargs)
+        start = time.perf_counter()
+        with count_retries() as retries:
+            raw_data, extra = self._get_raw_data(request_kwargs, abort_stream)
+        latency = time.perf_counter() - start
+        return self._make_result(raw_data, openai_create_prompt, latency, retries[0], **extra)
 
-    def __call__(
+    async def acall(
         self,
         prompt: Union[str, OpenAICreateChatPrompt],
+        abort_stream: Optional[Callable[[str], bool]] = None,
         **kwargs,
-    ) -> OpenAIChatCompletionResult:
-        if not isinstance(prompt, Prompt):
-            assert (
-                isinstance(prompt, str)
-                or (isinstance(prompt, list) and all(isinstance(token, int) for token in prompt))
-                or (isinstance(prompt, list) and all(isinstance(token, str) for token in prompt))
-                or (isinstance(prompt, list) and all(isinstance(msg, dict) for msg in prompt))
-            ), f"Got type {type(prompt)}, with val {type(prompt[0])} for prompt, expected str or list[int] or list[str] or list[dict[str, str]]"
+    ) -> OpenAIBaseCompletionResult:
+        if not self.stream:
+            abort_stream = None
+        openai_create_prompt = self._format_prompt(prompt)
+        sent_prompt = self._preflight(openai_create_prompt, kwargs)
+        if sent_prompt is None:
+            return self._make_skipped_result(openai_create_prompt, kwargs)
+        openai_create_prompt = sent_prompt
+        request_kwargs = self._request_kwargs(openai_create_prompt, kwargs)
+        start = time.perf_counter()
+        with count_retries() as retries:
+            raw_data, extra = await self._aget_raw_data(request_kwargs, abort_stream)
+        latency = time.perf_counter() - start
+        return self._make_result(raw_data, openai_create_prompt, latency, retries[0], **extra)
 
-            prompt = ChatCompletionPrompt(
-                raw_prompt=prompt,
+
+class OpenAICompletionFn(OpenAIBaseCompletionFn):
+    prompt_class = CompletionPrompt
+    result_class = OpenAICompletionResult
+    prompt_arg = "prompt"
+    create_retrying = staticmethod(openai_completion_create_retrying)
+    acreate_retrying = staticmethod(openai_completion_acreate_retrying)
+    create_once = staticmethod(openai_completion_create)
+    acreate_once = staticmethod(openai_completion_acreate)
+    api_resource = openai.Completion
+
+    def __init__(
+        self,
+        *args,
+        max_batch_size: Optional[int] = None,
+        batch_wait: float = 0.005,
+        **kwargs,
+    ):
+        """
+        If `max_batch_size` (default `EVALS_BATCH_SIZE`) is set, concurrent calls with
+        the same sampling arguments are sent as one request of up to `max_batch_size`
+        prompts, waiting up to `batch_wait` seconds for a batch to fill.
+        """
+        super().__init__(*args, **kwargs)
+        if max_batch_size is None:
+            max_batch_size = int(os.environ.get("EVALS_BATCH_SIZE", 0))
+        self.batcher = None
+        if max_batch_size:
+            self.batcher = CompletionBatcher(
+                self.create_retrying,
+                self.acreate_retrying,
+                max_batch_size=max_batch_size,
+                max_wait=batch_wait,
             )
 
-        openai_create_prompt: OpenAICreateChatPrompt = prompt.to_formatted_prompt()
+    def _create(self, request_kwargs: dict, abort_stream=None) -> Any:
+        prompt = request_kwargs["prompt"]
+        if self.batcher is None or self.stream or not is_batchable(prompt):
+            return super()._create(request_kwargs, abort_stream)
+        return self.batcher(**request_kwargs)
 
-        result = openai_chat_completion_create_retrying(
-            model=self.model,
-            api_base=self.api_base,
-            api_key=self.api_key,
-            messages=openai_create_prompt,
-            **{**kwargs, **self.extra_options},
-        )
-        result = OpenAIChatCompletionResult(raw_data=result, prompt=openai_create_prompt)
-        record_sampling(prompt=result.prompt, sampled=result.get_completions())
-        return result
+    async def _acreate(self, request_kwargs: dict, abort_stream=None) -> Any:
+        prompt = request_kwargs["prompt"]
+        if self.batcher is None or self.stream or not is_batchable(prompt):
+            return await super()._acreate(request_kwargs, abort_stream)
+        return await self.batcher.acall(**request_kwargs)
+
+
+class OpenAIChatCompletionFn(OpenAIBaseCompletionFn):
+    prompt_class = ChatCompletionPrompt
+    result_class = OpenAIChatCompletionResult
+    prompt_arg = "messages"
+    create_retrying = staticmethod(openai_chat_completion_create_retrying)
+    acreate_retrying = staticmethod(openai_chat_completion_acreate_retrying)
+    create_once = staticmethod(openai_chat_completion_create)
+    acreate_once = staticmethod(openai_chat_completion_acreate)
+    api_resource = openai.ChatCompletion
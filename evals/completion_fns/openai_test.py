@@ -0,0 +1,81 @@
+import evals.completion_fns.openai
+from evals.base import RunSpec
+from evals.completion_fns.openai import OpenAIChatCompletionFn, OpenAICompletionFn
+from evals.record import DummyRecorder, RecorderBase
+from evals.registry import n_ctx_from_model_name
+
+
+def _completion_fn(monkeypatch, **kwargs):
+    monkeypatch.setenv("EVALS_CACHE", "0")
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return {"choices": [{"index": 0, "text": "ok"}]}
+
+    completion_fn = OpenAICompletionFn(model="text-davinci-003", n_ctx=10, **kwargs)
+    monkeypatch.setattr(completion_fn, "create_retrying", create)
+    return completion_fn, requests
+
+
+def test_preflight_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("EVALS_CONTEXT_OVERFLOW", raising=False)
+    completion_fn, requests = _completion_fn(monkeypatch)
+    with DummyRecorder(None).as_default_recorder("test.s1.0"):
+        assert completion_fn(list(range(8)), max_tokens=6).get_completions() == ["ok"]
+    assert [request["prompt"] for request in requests] == [list(range(8))]
+
+
+def test_preflight_skips_oversized_prompts(monkeypatch):
+    completion_fn, requests = _completion_fn(monkeypatch, context_overflow="skip")
+    run_spec = RunSpec(
+        completion_fns=["text-davinci-003"],
+        eval_name="test.s1",
+        base_eval="test",
+        split="s1",
+        run_config={},
+        created_by="",
+    )
+    recorder = RecorderBase(run_spec)
+    with recorder.as_default_recorder("test.s1.0"):
+        assert completion_fn(list(range(4)), max_tokens=6).get_completions() == ["ok"]
+        result = completion_fn(list(range(5)), max_tokens=6, n=2)
+    assert result.get_completions() == ["", ""]
+    assert len(requests) == 1
+    (skip,) = recorder.get_events("skip")
+    assert skip.data == {
+        "reason": "context_overflow",
+        "prompt_tokens": 5,
+        "max_tokens": 6,
+        "n_ctx": 10,
+    }
+
+
+def test_preflight_truncates_oversized_prompts(monkeypatch):
+    completion_fn, requests = _completion_fn(monkeypatch, context_overflow="truncate_left")
+    with DummyRecorder(None).as_default_recorder("test.s1.0"):
+        completion_fn(list(range(8)), max_tokens=6)
+        # a prompt with no room left for the completion is skipped
+        completion_fn(list(range(8)), max_tokens=10)
+    assert [request["prompt"] for request in requests] == [[4, 5, 6, 7]]
+
+
+def test_preflight_fits_32k_prompts(monkeypatch):
+    monkeypatch.setenv("EVALS_CACHE", "0")
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}}]}
+
+    n_ctx = n_ctx_from_model_name("gpt-4-32k-0613")
+    completion_fn = OpenAIChatCompletionFn(
+        model="gpt-4-32k-0613", n_ctx=n_ctx, context_overflow="skip"
+    )
+    monkeypatch.setattr(completion_fn, "create_retrying", create)
+    monkeypatch.setattr(
+        evals.completion_fns.openai, "num_tokens_from_prompt", lambda prompt, model: 20000
+    )
+    with DummyRecorder(None).as_default_recorder("test.s1.0"):
+        completion_fn([{"role": "user", "content": "a long prompt"}], max_tokens=1000)
+    assert len(requests) == 1
@@ -0,0 +1,110 @@
+"""
+Replaying completions stored in record logs, with no API calls
+"""
+import glob
+import itertools
+import json
+import logging
+import threading
+from typing import Any, Sequence, Union
+
+from evals.api import CompletionFn, CompletionResult
+from evals.prompt.base import ChatCompletionPrompt, CompletionPrompt, Prompt, is_chat_prompt
+from evals.record import read_record_log, record_sampling
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayCompletionResult(CompletionResult):
+    def __init__(self, completions: list[str]):
+        self.completions = completions
+
+    def get_completions(self) -> list[str]:
+        return self.completions
+
+
+def _prompt_key(prompt: Any) -> str:
+    return json.dumps(prompt, sort_keys=True, ensure_ascii=False)
+
+
+class ReplayCompletionFn(CompletionFn):
+    """
+    Serves the completions recorded in the `sampling` events of one or more record
+    logs (written by `LocalRecorder`), looked up by prompt. Prompts sampled several
+    times replay their recorded completions in turn.
+
+    On a miss, a strict replay raises a `KeyError`; otherwise it returns an empty
+    completion and logs a warning, so the sample is scored as if the model said nothing.
+
+    Like the original completion fns, it records the formatted prompt in its `sampling`
+    events, so that a replayed log can be diffed against the logs it replays.
+    """
+
+    def __init__(self, record_paths: Union[str, Sequence[str]], strict: bool = False, **kwargs):
+        if isinstance(record_paths, str):
+            record_paths = [record_paths]
+        paths = [
+            path for pattern in record_paths for path in sorted(glob.glob(pattern)) or [pattern]
+        ]
+        self.strict = strict
+        self._lock = threading.Lock()
+        recorded: dict[str, list[list[str]]] = {}
+        num_chat_prompts = 0
+        for path in paths:
+            for event in read_record_log(path).events:
+                if event.type != "sampling":
+                    continue
+                sampled = event.data["sampled"]
+                if isinstance(sampled, str):
+                    sampled = [sampled]
+                recorded.setdefault(_prompt_key(event.data["prompt"]), []).append(sampled)
+                num_chat_prompts += is_chat_prompt(event.data["prompt"])
+        # format prompts which miss like the completion fn which recorded the logs
+        self._prompt_class = ChatCompletionPrompt if num_chat_prompts else CompletionPrompt
+        self._completions = {key: itertools.cycle(values) for key, values in recorded.items()}
+        self.num_misses = 0
+        logger.info(f"Loaded completions for {len(recorded)} prompts from {len(paths)} logs")
+
+    @staticmethod
+    def _candidate_prompts(prompt: Any) -> list[Any]:
+        # the log holds the prompt as formatted by the completion fn which recorded it
+        if isinstance(prompt, Prompt):
+            return [prompt.to_formatted_prompt()]
+        candidates = [prompt]
+        for prompt_class in (ChatCompletionPrompt, CompletionPrompt):
+            try:
+                candidates.append(prompt_class(raw_prompt=prompt).to_formatted_prompt())
+            except AssertionError:
+                pass
+        return candidates
+
+    def _format_prompt(self, prompt: Any) -> Any:
+        if isinstance(prompt, Prompt):
+            return prompt.to_formatted_prompt()
+        try:
+            return self._prompt_class(raw_prompt=prompt).to_formatted_prompt()
+        except AssertionError:
+            return prompt
+
+    def _lookup(self, prompt: Any) -> tuple[Any, list[str]]:
+        """Return the prompt as formatted in the logs, and its next recorded completions."""
+        candidates = self._candidate_prompts(prompt)
+        with self._lock:
+            for candidate in candidates:
+                completions = self._completions.get(_prompt_key(candidate))
+                if completions is not None:
+                    return candidate, next(completions)
+            self.num_misses += 1
+        if self.strict:
+            raise KeyError(f"No recorded completion for prompt {prompt!r}")
+        logger.warning(f"No recorded completion for prompt {prompt!r}; returning an empty one")
+        return self._format_prompt(prompt), [""]
+
+    def __call__(self, prompt, **kwargs) -> ReplayCompletionResult:
+        formatted_prompt, completions = self._lookup(prompt)
+        result = ReplayCompletionResult(completions)
+        record_sampling(prompt=formatted_prompt, sampled=result.get_completions())
+        return result
+
+    async def acall(self, prompt, **kwargs) -> ReplayCompletionResult:
+        return self(prompt, **kwargs)
@@ -0,0 +1,62 @@
+import pytest
+
+from evals.base import RunSpec
+from evals.completion_fns.replay import ReplayCompletionFn
+from evals.prompt.base import ChatCompletionPrompt
+from evals.record import DummyRecorder, LocalRecorder, RecorderBase
+
+CHAT_PROMPT = [{"role": "user", "content": "What is 2 + 2?"}]
+
+
+def _run_spec():
+    return RunSpec(
+        completion_fns=["gpt-3.5-turbo"],
+        eval_name="test.s1",
+        base_eval="test",
+        split="s1",
+        run_config={},
+        created_by="",
+    )
+
+
+def _write_log(path):
+    recorder = LocalRecorder(str(path), _run_spec())
+    recorder.record_sampling(CHAT_PROMPT, ["4"], sample_id="test.s1.0")
+    recorder.record_sampling("repeated", ["a"], sample_id="test.s1.1")
+    recorder.record_sampling("repeated", "b", sample_id="test.s1.1")
+    recorder.flush_events()
+
+
+def test_replay(tmp_path):
+    _write_log(tmp_path / "log.jsonl")
+    completion_fn = ReplayCompletionFn(str(tmp_path / "*.jsonl"))
+    with DummyRecorder(None).as_default_recorder("test.s1.0"):
+        assert completion_fn(CHAT_PROMPT).get_completions() == ["4"]
+        assert completion_fn("repeated").get_completions() == ["a"]
+        assert completion_fn("repeated").get_completions() == ["b"]
+        assert completion_fn("repeated").get_completions() == ["a"]
+        assert completion_fn("missing").get_completions() == [""]
+    assert completion_fn.num_misses == 1
+
+
+def test_replay_strict(tmp_path):
+    _write_log(tmp_path / "log.jsonl")
+    completion_fn = ReplayCompletionFn([str(tmp_path / "log.jsonl")], strict=True)
+    with DummyRecorder(None).as_default_recorder("test.s1.0"):
+        assert completion_fn(CHAT_PROMPT).get_completions() == ["4"]
+        with pytest.raises(KeyError):
+            completion_fn("missing")
+
+
+def test_replay_records_formatted_prompts(tmp_path):
+    _write_log(tmp_path / "log.jsonl")
+    completion_fn = ReplayCompletionFn(str(tmp_path / "log.jsonl"))
+    recorder = RecorderBase(_run_spec())
+    with recorder.as_default_recorder("test.s1.0"):
+        completion_fn(ChatCompletionPrompt(CHAT_PROMPT))
+        completion_fn("missing")
+    # the prompts are recorded as a chat completion fn would send them
+    assert [e.data["prompt"] for e in recorder.get_events("sampling")] == [
+        CHAT_PROMPT,
+        ChatCompletionPrompt("missing").to_formatted_prompt(),
+    ]
@@ -9,6 +9,7 @@ import json
 import logging
 import os
 import urllib
+import zlib
 from collections.abc import Iterator
 from functools import partial
 from typing import Any, Sequence, Union
@@ -18,6 +19,11 @@ import lz4.frame
 import pydantic
 import pyzstd
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -43,6 +49,69 @@ def zstd_open(filename: str, mode: str = "rb", openhook: Any = open) -> pyzstd.Z
     return pyzstd.ZstdFile(openhook(filename, mode), mode=mode)
 
 
+COMPRESSED_FILE_EXTENSIONS = (".gz", ".lz4", ".zst")
+
+
+def compress_by_file_pattern(filename: str, data: bytes) -> bytes:
+    """
+    Compress `data` as a single gzip member, lz4 frame or zstd frame if `filename` ends
+    with .gz, .lz4 or .zst. Such frames can be appended to a file one after the other,
+    and are read back as one stream by `open_blob_by_file_pattern`.
+    """
+    if filename.endswith(".gz"):
+        return gzip.compress(data)
+    elif filename.endswith(".lz4"):
+        return lz4.frame.compress(data)
+    elif filename.endswith(".zst"):
+        return pyzstd.compress(data)
+    return data
+
+
+class StreamCompressor:
+    """
+    Compress the batches of data appended one after the other to `filename` (if it ends
+    with .gz, .lz4 or .zst), each as a complete gzip member, lz4 frame or zstd frame, so
+    the file can be read back after any batch, even if the writer never gets to the
+    next one. The lz4 and zstd compressors are reused from one batch to the next.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        if filename.endswith(".lz4"):
+            self._compressor = lz4.frame.LZ4FrameCompressor()
+        elif filename.endswith(".zst"):
+            self._compressor = pyzstd.ZstdCompressor()
+        else:
+            self._compressor = None
+
+    def compress(self, data: bytes) -> bytes:
+        if self.filename.endswith(".gz"):
+            return gzip.compress(data)
+        elif self.filename.endswith(".lz4"):
+            return (
+                self._compressor.begin()
+                + self._compressor.compress(data)
+                + self._compressor.flush()
+            )
+        elif self.filename.endswith(".zst"):
+            return self._compressor.compress(data, pyzstd.ZstdCompressor.FLUSH_FRAME)
+        return data
+
+
+def open_blob_by_file_pattern(filename: str, mode: str = "rb", **kwargs: Any) -> Any:
+    """Open a file on gcs/local with blobfile, compressing or decompressing it on the
+    fly if its name ends with .gz, .lz4 or .zst. Unlike `open_by_file_pattern`, relative
+    paths are not resolved against the registry data directory."""
+    open_fn = partial(bf.BlobFile, **kwargs)
+    if filename.endswith(".gz"):
+        return gzip_open(filename, openhook=open_fn, mode=mode)
+    elif filename.endswith(".lz4"):
+        return lz4_open(filename, openhook=open_fn, mode=mode)
+    elif filename.endswith(".zst"):
+        return zstd_open(filename, openhook=open_fn, mode=mode)
+    return open_fn(filename, mode=mode)
+
+
 def open_by_file_pattern(filename: str, mode: str = "r", **kwargs: Any) -> Any:
     """Can read/write to files on gcs/local with or without gzipping. If file
     is stored on gcs, streams with blobfile. Otherwise use vanilla python open. If
@@ -181,6 +250,39 @@ def jsondump(o: Any, fp: Any, ensure_ascii: bool = False, **kwargs: Any) -> None
     json.dump(o, fp, cls=EnhancedJSONEncoder, ensure_ascii=ensure_ascii, **kwargs)
 
 
+def _orjson_default(o: Any) -> Any:
+    if dataclasses.is_dataclass(o):
+        return {field.name: getattr(o, field.name) for field in dataclasses.fields(o)}
+    if isinstance(o, pydantic.BaseModel):
+        return o.model_dump(mode="json") if hasattr(o, "model_dump") else json.loads(o.json())
+    raise TypeError(f"Type is not JSON serializable: {type(o).__name__}")
+
+
+def _use_orjson() -> bool:
+    return orjson is not None and os.environ.get("EVALS_JSON_ENCODER", "json") == "orjson"
+
+
+def jsondumps_bytes(o: Any) -> bytes:
+    """
+    Serialize `o` to compact UTF-8 JSON, like `jsondumps`. With `EVALS_JSON_ENCODER=orjson`,
+    uses orjson if it is installed, which is faster and also handles numpy values, but
+    writes NaN and infinity as null. Falls back to `jsondumps` for anything orjson
+    can't serialize.
+    """
+    if _use_orjson():
+        try:
+            return orjson.dumps(
+                o,
+                default=_orjson_default,
+                option=orjson.OPT_PASSTHROUGH_DATACLASS
+                | orjson.OPT_SERIALIZE_NUMPY
+                | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            pass
+    return jsondumps(o, separators=(",", ":")).encode("utf-8")
+
+
 def jsonloads(s: str, **kwargs: Any) -> Any:
     return json.loads(s, **kwargs)
 
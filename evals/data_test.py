@@ -0,0 +1,36 @@
+import pytest
+
+from evals.data import StreamCompressor, jsondumps_bytes, open_blob_by_file_pattern
+
+
+def _read_lines(path):
+    with open_blob_by_file_pattern(path, "rb") as f:
+        return list(f)
+
+
+@pytest.mark.parametrize("extension", [".gz", ".lz4", ".zst"])
+def test_stream_compressor(tmp_path, extension):
+    path = str(tmp_path / f"log.jsonl{extension}")
+    batches = [
+        [
+            b'{"prompt": "What is the capital of France?", "id": %d}\n' % (10 * i + j)
+            for j in range(10)
+        ]
+        for i in range(5)
+    ]
+    compressor = StreamCompressor(path)
+    written = []
+    for batch in batches:
+        with open(path, "ab") as f:
+            f.write(compressor.compress(b"".join(batch)))
+        written += batch
+        # every batch ends a frame, so what has been written can always be read back
+        assert _read_lines(path) == written
+    with open(path, "rb") as f:
+        assert len(f.read()) < len(b"".join(written))
+
+
+def test_jsondumps_bytes_keeps_non_finite_floats(monkeypatch):
+    monkeypatch.delenv("EVALS_JSON_ENCODER", raising=False)
+    data = {"score": float("nan"), "max": float("inf")}
+    assert jsondumps_bytes(data) == b'{"score":NaN,"max":Infinity}'
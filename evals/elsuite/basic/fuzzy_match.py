@@ -1,7 +1,7 @@
 import numpy as np
 
 import evals
-from evals.api import CompletionFn
+from evals.api import CompletionFn, acall_completion_fn
 from evals.elsuite import utils
 from evals.record import RecorderBase
 
@@ -22,16 +22,27 @@ class FuzzyMatch(evals.Eval):
 
     def eval_sample(self, test_sample, rng):
         del rng
-        prompt, correct_answers = test_sample["input"], test_sample["ideal"]
-        if not isinstance(correct_answers, list):
-            correct_answers = [correct_answers]
-
         result = self.completion_fn(
-            prompt=prompt,
+            prompt=test_sample["input"],
             temperature=0.0,  # Q: why are these hardcoded?
             max_tokens=100,
         )
-        sampled = result.get_completions()[0]
+        self._check_sample(test_sample, result.get_completions()[0])
+
+    async def aeval_sample(self, test_sample, rng):
+        del rng
+        result = await acall_completion_fn(
+            self.completion_fn,
+            prompt=test_sample["input"],
+            temperature=0.0,
+            max_tokens=100,
+        )
+        self._check_sample(test_sample, result.get_completions()[0])
+
+    def _check_sample(self, test_sample, sampled: str):
+        correct_answers = test_sample["ideal"]
+        if not isinstance(correct_answers, list):
+            correct_answers = [correct_answers]
 
         matches = [utils.fuzzy_match(sampled, correct_answer) for correct_answer in correct_answers]
 
@@ -50,6 +61,6 @@ class FuzzyMatch(evals.Eval):
         self.eval_all_samples(recorder, samples)
 
         return {
-            "accuracy": np.mean(recorder.get_scores("accuracy")),
-            "f1_score": np.mean(recorder.get_scores("f1_score")),
+            "accuracy": np.mean(recorder.get_column("accuracy")),
+            "f1_score": np.mean(recorder.get_column("f1_score")),
         }
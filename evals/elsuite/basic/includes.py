@@ -1,8 +1,7 @@
 from typing import Any
 
 import evals
-import evals.metrics
-from evals.api import CompletionFn
+from evals.api import CompletionFn, acall_completion_fn
 from evals.elsuite import utils
 
 
@@ -25,8 +24,17 @@ class Includes(evals.Eval):
         result = self.completion_fn(
             prompt=prompt,
         )
-        sampled = result.get_completions()[0]
+        return self._check_sample(sample, result.get_completions()[0])
 
+    async def aeval_sample(self, sample: Any, *_):
+        prompt = sample["input"]
+        result = await acall_completion_fn(
+            self.completion_fn,
+            prompt=prompt,
+        )
+        return self._check_sample(sample, result.get_completions()[0])
+
+    def _check_sample(self, sample: Any, sampled: str) -> bool:
         ideal = sample["ideal"]
         if not isinstance(ideal, list):
             ideal = [ideal]
@@ -49,7 +57,7 @@ class Includes(evals.Eval):
     def run(self, recorder):
         samples = self.get_samples()
         self.eval_all_samples(recorder, samples)
-        events = recorder.get_events("match")
+        correct = recorder.get_column("correct")
         return {
-            "accuracy": evals.metrics.get_accuracy(events),
+            "accuracy": float(correct.mean()) if len(correct) else float("nan"),
         }
@@ -1,8 +1,9 @@
+import functools
 from typing import Any
 
 import evals
 import evals.metrics
-from evals.api import CompletionFn
+from evals.api import CompletionFn, acall_completion_fn, is_match_decided
 from evals.prompt.base import is_chat_prompt
 
 
@@ -27,7 +28,7 @@ class Match(evals.Eval):
             self.few_shot_jsonl = few_shot_jsonl
             self.few_shot = evals.get_jsonl(self.few_shot_jsonl)
 
-    def eval_sample(self, sample: Any, *_):
+    def _get_prompt(self, sample: Any):
         prompt = sample["input"]
         if self.num_few_shot > 0:
             assert is_chat_prompt(sample["input"]), "few shot requires chat prompt"
@@ -35,10 +36,35 @@ class Match(evals.Eval):
             for s in self.few_shot[: self.num_few_shot]:
                 prompt += s["sample"]
             prompt += sample["input"][-1:]
+        return prompt
+
+    def _get_completion_kwargs(self, sample: Any) -> dict:
+        kwargs = {"temperature": 0.0}
+        if getattr(self.completion_fn, "stream", False):
+            # stop streaming once the output has matched, or can no longer match
+            kwargs["abort_stream"] = functools.partial(is_match_decided, expected=sample["ideal"])
+        return kwargs
 
+    def eval_sample(self, sample: Any, *_):
+        prompt = self._get_prompt(sample)
         result = self.completion_fn(
             prompt=prompt,
-            temperature=0.0,
+            **self._get_completion_kwargs(sample),
+        )
+        sampled = result.get_completions()[0]
+
+        return evals.record_and_check_match(
+            prompt=prompt,
+            sampled=sampled,
+            expected=sample["ideal"],
+        )
+
+    async def aeval_sample(self, sample: Any, *_):
+        prompt = self._get_prompt(sample)
+        result = await acall_completion_fn(
+            self.completion_fn,
+            prompt=prompt,
+            **self._get_completion_kwargs(sample),
         )
         sampled = result.get_completions()[0]
 
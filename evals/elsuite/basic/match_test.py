@@ -0,0 +1,46 @@
+from mock import patch
+
+from evals.api import DummyCompletionFn
+from evals.base import RunSpec
+from evals.elsuite.basic.match import Match
+from evals.record import RecorderBase
+
+
+def _run_match(engine: str):
+    eval = Match(
+        completion_fns=[DummyCompletionFn()],
+        samples_jsonl="",
+        name="match.test",
+    )
+    samples = [
+        dict(input="Hello", ideal="This is a dummy"),
+        dict(input="Hello", ideal="world"),
+    ]
+
+    run_spec = RunSpec(
+        completion_fns=["dummy"],
+        eval_name="match.test",
+        base_eval="match",
+        split="test",
+        run_config={},
+        created_by="",
+    )
+    recorder = RecorderBase(run_spec)
+    with patch.dict("os.environ", {"EVALS_ENGINE": engine}):
+        results = eval.eval_all_samples(recorder, samples, show_progress=False)
+    return results, recorder.get_events("match")
+
+
+def test_eval_all_samples_async():
+    results, events = _run_match("async")
+    assert results == ["This is a dummy", None]
+    assert sorted(e.sample_id for e in events) == ["match.test.0", "match.test.1"]
+
+
+def test_eval_all_samples_async_matches_threaded():
+    async_results, async_events = _run_match("async")
+    threaded_results, threaded_events = _run_match("threaded")
+    assert async_results == threaded_results
+    assert sorted((e.sample_id, e.data["correct"]) for e in async_events) == sorted(
+        (e.sample_id, e.data["correct"]) for e in threaded_events
+    )
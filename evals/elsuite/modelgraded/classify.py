@@ -7,7 +7,12 @@ from typing import Any, Optional, Union
 
 import evals
 import evals.record
-from evals.elsuite.modelgraded.classify_utils import classify, sample_and_concat_n_completions
+from evals.elsuite.modelgraded.classify_utils import (
+    aclassify,
+    asample_and_concat_n_completions,
+    classify,
+    sample_and_concat_n_completions,
+)
 from evals.elsuite.utils import PromptFn, scrub_formatting_from_prompt
 
 
@@ -78,7 +83,6 @@ class ModelBasedClassify(evals.Eval):
             completions[v] = completion
 
         # run modelgraded eval
-        metrics = {}
         choice, info = classify(
             mg=self.mg,
             completion_fn=self.eval_completion_fn,
@@ -87,6 +91,44 @@ class ModelBasedClassify(evals.Eval):
             n=self.multicomp_n,
             format_kwargs={**completions, **test_sample, **self.modelgraded_spec_args},
         )
+        return self._record_choice(test_sample, choice, info)
+
+    async def aeval_sample(self, test_sample: dict, rng: Random) -> None:
+        """Async counterpart of `eval_sample`."""
+        for k in self.mg.input_outputs:
+            test_sample[k] = scrub_formatting_from_prompt(test_sample[k])
+
+        completions = {}
+        for k, v in self.mg.input_outputs.items():
+            if v in test_sample:  # test_sample already has completion, skip.
+                continue
+            if self.multicomp_n > 1:
+                completion = await asample_and_concat_n_completions(
+                    self.completion_fns,
+                    prompt=test_sample[k],
+                    template_i=self.mg.output_template,
+                    sample_kwargs=self.sample_kwargs,
+                    n=self.multicomp_n,
+                )
+            else:
+                get_input_completion = PromptFn(
+                    test_sample[k], completion_fn=self.completion_fn, **self.sample_kwargs
+                )
+                completion, _ = await get_input_completion.acall()
+            completions[v] = completion
+
+        choice, info = await aclassify(
+            mg=self.mg,
+            completion_fn=self.eval_completion_fn,
+            completion_kwargs=self.eval_kwargs,
+            eval_type=self.eval_type,
+            n=self.multicomp_n,
+            format_kwargs={**completions, **test_sample, **self.modelgraded_spec_args},
+        )
+        return self._record_choice(test_sample, choice, info)
+
+    def _record_choice(self, test_sample: dict, choice: str, info: dict) -> str:
+        metrics = {}
         metrics.update(dict(choice=choice, score=info["score"]))
 
         # run metaeval if requested
@@ -114,9 +156,9 @@ class ModelBasedClassify(evals.Eval):
         record_metrics.update({f"counts/{k}": v for k, v in counts.items()})
 
         # record the scores
-        scores = [m["score"] for m in all_sample_metrics if m["score"] is not None]
-        if scores:
-            record_metrics[f"score"] = sum(scores) / len(scores)
+        scores = recorder.get_column("score")
+        if len(scores):
+            record_metrics[f"score"] = float(scores.mean())
         metascores = [m["metascore"] for m in all_sample_metrics if "metascore" in m]
         if metascores:
             record_metrics[f"metascore"] = sum(metascores) / len(metascores)
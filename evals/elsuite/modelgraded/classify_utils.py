@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import string
 from typing import Any, Callable, Iterable, Optional, Union
@@ -48,21 +49,9 @@ def get_choice_strings(choice_strings: Union[list[str], str], n: Optional[int] =
     return choice_strings
 
 
-def classify(
-    mg: ModelGradedSpec,
-    completion_fn: CompletionFn,
-    completion_kwargs: Optional[dict[str, Any]] = None,
-    format_kwargs: Optional[dict[str, Any]] = None,
-    eval_type: Optional[str] = None,
-    n: Optional[int] = None,
-    match_fn: str = "starts_or_endswith",
-) -> str:
-    completion_kwargs = completion_kwargs or {}
-    format_kwargs = format_kwargs or {}
-
-    # get choice strings
-    choice_strings = get_choice_strings(mg.choice_strings, n=n)
-
+def _get_classify_prompt(
+    mg: ModelGradedSpec, eval_type: Optional[str], choice_strings: list[str]
+) -> OpenAICreateChatPrompt:
     # append answer prompt
     prompt = mg.prompt
     if isinstance(prompt, str):
@@ -73,9 +62,17 @@ def classify(
             eval_type=eval_type,
             choice_strings=choice_strings,
         )
+    return prompt
 
-    evaluate = PromptFn(prompt, completion_fn=completion_fn, **completion_kwargs)
-    evaluation, prompt = evaluate(n=n, **format_kwargs)
+
+def _get_classify_result(
+    mg: ModelGradedSpec,
+    evaluation: str,
+    prompt: OpenAICreateChatPrompt,
+    eval_type: Optional[str],
+    match_fn: str,
+    choice_strings: list[str],
+) -> tuple[str, dict[str, Any]]:
     choice = get_choice(evaluation, mg.eval_type or eval_type, match_fn, choice_strings)
     score = get_choice_score(choice, choice_strings, mg.choice_scores)
     return choice, dict(
@@ -86,6 +83,48 @@ def classify(
     )
 
 
+def classify(
+    mg: ModelGradedSpec,
+    completion_fn: CompletionFn,
+    completion_kwargs: Optional[dict[str, Any]] = None,
+    format_kwargs: Optional[dict[str, Any]] = None,
+    eval_type: Optional[str] = None,
+    n: Optional[int] = None,
+    match_fn: str = "starts_or_endswith",
+) -> str:
+    completion_kwargs = completion_kwargs or {}
+    format_kwargs = format_kwargs or {}
+
+    # get choice strings
+    choice_strings = get_choice_strings(mg.choice_strings, n=n)
+    prompt = _get_classify_prompt(mg, eval_type, choice_strings)
+
+    evaluate = PromptFn(prompt, completion_fn=completion_fn, **completion_kwargs)
+    evaluation, prompt = evaluate(n=n, **format_kwargs)
+    return _get_classify_result(mg, evaluation, prompt, eval_type, match_fn, choice_strings)
+
+
+async def aclassify(
+    mg: ModelGradedSpec,
+    completion_fn: CompletionFn,
+    completion_kwargs: Optional[dict[str, Any]] = None,
+    format_kwargs: Optional[dict[str, Any]] = None,
+    eval_type: Optional[str] = None,
+    n: Optional[int] = None,
+    match_fn: str = "starts_or_endswith",
+) -> str:
+    """Async counterpart of `classify`."""
+    completion_kwargs = completion_kwargs or {}
+    format_kwargs = format_kwargs or {}
+
+    choice_strings = get_choice_strings(mg.choice_strings, n=n)
+    prompt = _get_classify_prompt(mg, eval_type, choice_strings)
+
+    evaluate = PromptFn(prompt, completion_fn=completion_fn, **completion_kwargs)
+    evaluation, prompt = await evaluate.acall(n=n, **format_kwargs)
+    return _get_classify_result(mg, evaluation, prompt, eval_type, match_fn, choice_strings)
+
+
 def get_choice_score(
     choice: str,
     choice_strings: Iterable[str],
@@ -148,6 +187,15 @@ def append_answer_prompt(
     return prompt
 
 
+def _get_nth_completion_fn(completion_fns: list[CompletionFn], i: int, n: int) -> CompletionFn:
+    if len(completion_fns) > 1:
+        # use a separate model for each completion
+        assert len(completion_fns) == n
+        return completion_fns[i]
+    # use the single model for all completions
+    return completion_fns[0]
+
+
 def sample_and_concat_n_completions(
     completion_fns: list[CompletionFn],
     prompt: OpenAICreateChatPrompt,
@@ -158,19 +206,34 @@ def sample_and_concat_n_completions(
     assert template_i
     completion_i_s = []
     for i in range(n):
-        if len(completion_fns) > 1:
-            # use a separate model for each completion
-            assert len(completion_fns) == n
-            completion_fn = completion_fns[i]
-        else:
-            # use the single model for all completions
-            completion_fn = completion_fns[0]
+        completion_fn = _get_nth_completion_fn(completion_fns, i, n)
         get_input_completion = PromptFn(prompt, completion_fn=completion_fn, **sample_kwargs)
         completion_i, _ = get_input_completion()
         completion_i_s.append(completion_i)
     return concat_n_completions(completion_i_s, template_i=template_i)
 
 
+async def asample_and_concat_n_completions(
+    completion_fns: list[CompletionFn],
+    prompt: OpenAICreateChatPrompt,
+    n: int,
+    template_i: str,
+    sample_kwargs: dict,
+):
+    """Async counterpart of `sample_and_concat_n_completions`; samples concurrently."""
+    assert template_i
+    results = await asyncio.gather(
+        *[
+            PromptFn(
+                prompt, completion_fn=_get_nth_completion_fn(completion_fns, i, n), **sample_kwargs
+            ).acall()
+            for i in range(n)
+        ]
+    )
+    completion_i_s = [completion_i for completion_i, _ in results]
+    return concat_n_completions(completion_i_s, template_i=template_i)
+
+
 def concat_n_completions(completions: Iterable[str], template_i: str) -> str:
     """Concatenate n completions into a single text string."""
     completion = ""
@@ -5,6 +5,7 @@ from collections import Counter, defaultdict
 from typing import Optional, Union
 
 from evals import CompletionFn
+from evals.api import acall_completion_fn
 from evals.prompt.base import (
     OpenAICreateChatPrompt,
     OpenAICreatePrompt,
@@ -22,7 +23,7 @@ def get_answer(text, answer_prompt, ignore_case=False):
 
     if idx == -1:
         return None
-    return text[idx:idx + len(answer_prompt)]
+    return text[idx : idx + len(answer_prompt)]
 
 
 def get_consensus(answers):
@@ -164,7 +165,7 @@ class PromptFn:
         self.completion_kwargs = completion_kwargs
         self.n_samples = n_samples
 
-    def __call__(self, **kwargs):
+    def _format(self, **kwargs):
         # if any input kwargs is chat prompt, convert to text prompt
         kwargs = {
             k: chat_prompt_to_text_prompt(v, for_completion=False) if is_chat_prompt(v) else v
@@ -180,9 +181,10 @@ class PromptFn:
         else:
             # Prompt is a string
             prompt = format_necessary(self.prompt, **kwargs)
+        return prompt
 
-        result = self.completion_fn(
-            prompt=prompt,
+    def _completion_fn_kwargs(self) -> dict:
+        return dict(
             max_tokens=self.max_tokens,
             temperature=self.temperature,
             top_p=1,
@@ -191,5 +193,17 @@ class PromptFn:
             n=(1 if self.n_samples is None else self.n_samples),
             **self.completion_kwargs,
         )
+
+    def __call__(self, **kwargs):
+        prompt = self._format(**kwargs)
+        result = self.completion_fn(prompt=prompt, **self._completion_fn_kwargs())
+        sampled = result.get_completions()[0]
+        return sampled, prompt
+
+    async def acall(self, **kwargs):
+        prompt = self._format(**kwargs)
+        result = await acall_completion_fn(
+            self.completion_fn, prompt=prompt, **self._completion_fn_kwargs()
+        )
         sampled = result.get_completions()[0]
         return sampled, prompt
@@ -3,25 +3,36 @@ This file defines the base class for evals.
 """
 import abc
 import asyncio
+import contextlib
+import contextvars
 import logging
 import os
 import random
+import threading
 from multiprocessing.pool import ThreadPool
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from tqdm import tqdm
 
 from evals.api import CompletionFn
+from evals.utils import api_utils
+from evals.utils.api_utils import openai_aiosession
+from evals.utils.concurrency import make_concurrency_controller
 
 from .data import get_jsonl
-from .record import RecorderBase
+from .metrics import compute_accuracy_interval
+from .record import RecorderBase, record_error
 from .registry import Registry
 
 logger = logging.getLogger(__name__)
 
 
 SHUFFLE_SEED = 123
+# Result of samples which were not evaluated because the run stopped early.
+_SKIPPED = object()
 _MAX_SAMPLES = None
+_SKIP_INDICES: Set[int] = set()
+_SHARD: Optional[Tuple[int, int]] = None
 
 
 def _index_samples(samples: List[Any]) -> List[Tuple[Any, int]]:
@@ -30,16 +41,211 @@ def _index_samples(samples: List[Any]) -> List[Tuple[Any, int]]:
     random.Random(SHUFFLE_SEED).shuffle(indices)
     if _MAX_SAMPLES is not None:
         indices = indices[:_MAX_SAMPLES]
+    if _SHARD is not None:
+        shard_index, num_shards = _SHARD
+        indices = indices[shard_index::num_shards]
+        logger.info(f"Evaluating shard {shard_index}/{num_shards}")
+    if _SKIP_INDICES:
+        num_indices = len(indices)
+        indices = [i for i in indices if i not in _SKIP_INDICES]
+        logger.info(f"Skipping {num_indices - len(indices)} samples completed in a previous run")
     logger.info(f"Evaluating {len(indices)} samples")
     work_items = [(samples[i], i) for i in indices]
     return work_items
 
 
+@contextlib.contextmanager
+def no_samples():
+    """Evaluate no samples within the context, e.g. to only rerun an eval's aggregation."""
+    global _MAX_SAMPLES
+    max_samples = _MAX_SAMPLES
+    _MAX_SAMPLES = 0
+    try:
+        yield
+    finally:
+        _MAX_SAMPLES = max_samples
+
+
+@contextlib.asynccontextmanager
+async def _null_async_context():
+    yield
+
+
+def _report_hedging(recorder: RecorderBase):
+    policy = api_utils.hedging_policy
+    if policy is not None:
+        policy.log_summary()
+        recorder.record_final_report_info(**policy.summary())
+
+
+def _report_completion_fns(recorder: RecorderBase, completion_fns: List[CompletionFn]):
+    """Add the run-level stats of completion fns which keep any to the final report."""
+    for completion_fn in completion_fns:
+        final_report_info = getattr(completion_fn, "final_report_info", None)
+        if final_report_info is not None:
+            recorder.record_final_report_info(**final_report_info())
+
+
+def _get_sample_timeout() -> Optional[float]:
+    sample_timeout = os.environ.get("EVALS_SAMPLE_TIMEOUT")
+    return float(sample_timeout) if sample_timeout else None
+
+
+def _record_sample_timeout(recorder: RecorderBase, timeout: float):
+    """
+    Record that the current sample missed its deadline, and pause it so that anything
+    it records after being abandoned is dropped.
+    """
+    sample_id = recorder.current_sample_id()
+    logger.warning(f"Sample {sample_id} did not finish within {timeout}s, moving on")
+    record_error("Sample timed out", TimeoutError(f"Sample did not finish within {timeout}s"))
+    recorder.pause()
+
+
+def _call_with_deadline(recorder: RecorderBase, timeout: float, fn: Callable, *args: Any) -> Any:
+    """
+    Call `fn(*args)` in a separate thread, in the current context, and wait at most
+    `timeout` seconds for it. If it doesn't finish, the thread is abandoned and the
+    sample is recorded as timed out. The API requests the thread makes share the
+    deadline, so an abandoned thread fails its next request and exits soon after.
+    """
+    result, error = [], []
+
+    def target():
+        try:
+            with api_utils.sample_deadline(timeout):
+                result.append(fn(*args))
+        except BaseException as e:
+            error.append(e)
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        _record_sample_timeout(recorder, timeout)
+        return None
+    if error:
+        raise error[0]
+    return result[0]
+
+
 def set_max_samples(max_samples: int):
     global _MAX_SAMPLES
     _MAX_SAMPLES = max_samples
 
 
+def set_shard(shard_index: int, num_shards: int):
+    """
+    Only evaluate every `num_shards`-th of the shuffled samples, starting at
+    `shard_index`. Since the shuffle is seeded, shards are disjoint and stable
+    across processes and machines.
+    """
+    global _SHARD
+    assert 0 <= shard_index < num_shards, f"Invalid shard {shard_index}/{num_shards}"
+    _SHARD = (shard_index, num_shards)
+
+
+def set_skip_indices(indices: Set[int]):
+    global _SKIP_INDICES
+    _SKIP_INDICES = set(indices)
+
+
+class _EarlyStopping:
+    """
+    Stops evaluating new samples once the confidence interval of the running accuracy
+    (over `match` events) is tight enough. Configured by:
+    - `EVALS_EARLY_STOP_CI_WIDTH`: stop once the interval is at most this wide.
+    - `EVALS_EARLY_STOP_BASELINE` and `EVALS_EARLY_STOP_MARGIN`: stop once the interval
+        lies entirely within, or entirely outside, baseline +/- margin.
+    - `EVALS_EARLY_STOP_CONFIDENCE` (default 0.95) and `EVALS_EARLY_STOP_MIN_SAMPLES`
+        (default 30, the number of matches needed before stopping is considered).
+    The interval is checked after every sample, so the effective confidence of a
+    stopped run is somewhat lower than nominal; raise the confidence to compensate.
+    """
+
+    def __init__(
+        self,
+        recorder: RecorderBase,
+        ci_width: Optional[float] = None,
+        baseline: Optional[float] = None,
+        margin: Optional[float] = None,
+        confidence: float = 0.95,
+        min_samples: int = 30,
+    ):
+        assert ci_width is not None or (
+            baseline is not None and margin is not None
+        ), "Early stopping needs a CI width, or a baseline and margin"
+        self.recorder = recorder
+        self.ci_width = ci_width
+        self.baseline = baseline
+        self.margin = margin
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    @classmethod
+    def from_env(cls, recorder: RecorderBase) -> Optional["_EarlyStopping"]:
+        def get_float(name: str) -> Optional[float]:
+            value = os.environ.get(name)
+            return float(value) if value else None
+
+        ci_width = get_float("EVALS_EARLY_STOP_CI_WIDTH")
+        baseline = get_float("EVALS_EARLY_STOP_BASELINE")
+        if ci_width is None and baseline is None:
+            return None
+        return cls(
+            recorder,
+            ci_width=ci_width,
+            baseline=baseline,
+            margin=get_float("EVALS_EARLY_STOP_MARGIN"),
+            confidence=get_float("EVALS_EARLY_STOP_CONFIDENCE") or 0.95,
+            min_samples=int(os.environ.get("EVALS_EARLY_STOP_MIN_SAMPLES", "30")),
+        )
+
+    def _stop_reason(self, low: float, high: float) -> Optional[str]:
+        if self.ci_width is not None and high - low <= self.ci_width:
+            return "ci_width"
+        if self.baseline is not None:
+            if self.baseline - self.margin <= low and high <= self.baseline + self.margin:
+                return "within_baseline_margin"
+            if high < self.baseline - self.margin or low > self.baseline + self.margin:
+                return "outside_baseline_margin"
+        return None
+
+    def should_stop(self) -> bool:
+        with self._lock:
+            if self._stopped:
+                return True
+            num_correct, num_total = self.recorder.get_match_counts()
+            if num_total < self.min_samples:
+                return False
+            low, high = compute_accuracy_interval(num_correct, num_total, self.confidence)
+            reason = self._stop_reason(low, high)
+            if reason is None:
+                return False
+            self._stopped = True
+        logger.info(
+            f"Stopping early after {num_total} matches ({reason}): accuracy "
+            f"{num_correct / num_total:.4f}, {self.confidence:.0%} CI [{low:.4f}, {high:.4f}]"
+        )
+        return True
+
+    def record_summary(self, num_samples_total: int):
+        num_correct, num_total = self.recorder.get_match_counts()
+        low, high = compute_accuracy_interval(num_correct, num_total, self.confidence)
+        self.recorder.record_final_report_info(
+            **{
+                "early_stop/stopped": self._stopped,
+                "early_stop/num_matches": num_total,
+                "early_stop/num_samples_total": num_samples_total,
+                "early_stop/ci_low": low,
+                "early_stop/ci_high": high,
+                "early_stop/confidence": self.confidence,
+            }
+        )
+
+
 class Eval(abc.ABC):
     """
     Evaluation classes generally should override two methods:
@@ -71,6 +277,17 @@ class Eval(abc.ABC):
     def eval_sample(self, sample: Any, rng: random.Random):
         raise NotImplementedError()
 
+    async def aeval_sample(self, sample: Any, rng: random.Random):
+        """
+        Async counterpart of `eval_sample`. Evals which implement it can be run on a
+        single event loop by setting `EVALS_ENGINE=async`.
+        """
+        raise NotImplementedError()
+
+    @property
+    def supports_async(self) -> bool:
+        return type(self).aeval_sample is not Eval.aeval_sample
+
     @property
     def completion_fn(self) -> CompletionFn:
         """Helper for more ergonomic access to a single CompletionFn."""
@@ -81,27 +298,71 @@ class Eval(abc.ABC):
         """Run the evaluation with the corresponding recorder."""
         raise NotImplementedError()
 
+    def _sample_id(self, idx: int) -> str:
+        base_name, split = self.name.split(".")[0:2]
+        return f"{base_name}.{split}.{idx}"
+
+    def _sample_rng(self, sample_id: str) -> random.Random:
+        seed = f"{sample_id}:{self.seed}".encode("utf-8")
+        return random.Random(seed)
+
     async def async_eval_all_samples(
         self,
-        eval_fn: Callable[[Tuple[Any, int]], Awaitable[Tuple[int, Any]]],
-        samples: List[Any],
-        concurrency: int = 32,
-        show_progress: bool = True,
+        recorder: RecorderBase,
+        samples,
+        show_progress=True,
+        concurrency: Optional[int] = None,
         **_kwargs: Any,
     ):
+        """
+        Evaluate all provided samples concurrently on the running event loop, using
+        `aeval_sample`. At most `concurrency` samples are in flight at once.
+        """
         work_items = _index_samples(samples)
+        if concurrency is None:
+            concurrency = int(os.environ.get("EVALS_ASYNC_CONCURRENCY", "1000"))
         semaphore = asyncio.Semaphore(concurrency)
+        controller = make_concurrency_controller(max_limit=concurrency)
+        sample_timeout = _get_sample_timeout()
+        early_stopping = _EarlyStopping.from_env(recorder)
 
-        async def eval_fn_with_semaphore(args):
-            async with semaphore:
-                return await eval_fn(args)
-
-        futures = [asyncio.ensure_future(eval_fn_with_semaphore(args)) for args in work_items]
+        async def eval_sample(args):
+            """
+            Evaluate a single sample.
+            """
+            sample, idx = args
+            sample_id = self._sample_id(idx)
+            async with semaphore, controller.aslot() if controller else _null_async_context():
+                if early_stopping is not None and early_stopping.should_stop():
+                    return idx, _SKIPPED
+                with recorder.as_default_recorder(sample_id):
+                    try:
+                        return idx, await asyncio.wait_for(
+                            self.aeval_sample(sample, self._sample_rng(sample_id)),
+                            timeout=sample_timeout,
+                        )
+                    except asyncio.TimeoutError:
+                        _record_sample_timeout(recorder, sample_timeout)
+                        return idx, None
 
-        for future in tqdm(
-            asyncio.as_completed(futures), total=len(samples), disable=not show_progress
-        ):
-            await future
+        logger.info(f"Running in async mode with concurrency {concurrency}!")
+        async with openai_aiosession(limit=concurrency):
+            futures = [asyncio.ensure_future(eval_sample(args)) for args in work_items]
+            idx_and_result = [
+                await future
+                for future in tqdm(
+                    asyncio.as_completed(futures),
+                    total=len(work_items),
+                    disable=not show_progress,
+                )
+            ]
+        if controller is not None:
+            controller.log_summary()
+        _report_hedging(recorder)
+        _report_completion_fns(recorder, self.completion_fns)
+        if early_stopping is not None:
+            early_stopping.record_summary(len(work_items))
+        return [r for _, r in sorted(idx_and_result) if r is not _SKIPPED]
 
     def eval_all_samples(
         self,
@@ -114,21 +375,39 @@ class Eval(abc.ABC):
         """
         Evaluate all provided samples in parallel.
         """
+        show_progress = bool(os.environ.get("EVALS_SHOW_EVAL_PROGRESS", show_progress))
+        if os.environ.get("EVALS_ENGINE", "threaded") == "async":
+            if self.supports_async:
+                return asyncio.run(
+                    self.async_eval_all_samples(recorder, samples, show_progress=show_progress)
+                )
+            logger.warning(
+                f"{type(self).__name__} does not implement `aeval_sample`, "
+                "falling back to the threaded engine"
+            )
+
         work_items = _index_samples(samples)
         threads = int(os.environ.get("EVALS_THREADS", "10"))
-        show_progress = bool(os.environ.get("EVALS_SHOW_EVAL_PROGRESS", show_progress))
+        controller = make_concurrency_controller(max_limit=threads)
+        sample_timeout = _get_sample_timeout()
+        early_stopping = _EarlyStopping.from_env(recorder)
 
         def eval_sample(args):
             """
             Evaluate a single sample.
             """
             sample, idx = args
-            base_name, split = self.name.split(".")[0:2]
-            sample_id = f"{base_name}.{split}.{idx}"
-            with recorder.as_default_recorder(sample_id):
-                seed = f"{sample_id}:{self.seed}".encode("utf-8")
-                rng = random.Random(seed)
-                return idx, self.eval_sample(sample, rng)
+            sample_id = self._sample_id(idx)
+            with controller.slot() if controller else contextlib.nullcontext():
+                if early_stopping is not None and early_stopping.should_stop():
+                    return idx, _SKIPPED
+                with recorder.as_default_recorder(sample_id):
+                    rng = self._sample_rng(sample_id)
+                    if sample_timeout is None:
+                        return idx, self.eval_sample(sample, rng)
+                    return idx, _call_with_deadline(
+                        recorder, sample_timeout, self.eval_sample, sample, rng
+                    )
 
         with ThreadPool(threads) as pool:
             if os.environ.get("EVALS_SEQUENTIAL", "0") in {"1", "true", "yes"}:
@@ -138,7 +417,13 @@ class Eval(abc.ABC):
                 logger.info(f"Running in threaded mode with {threads} threads!")
                 iter = pool.imap_unordered(eval_sample, work_items)
             idx_and_result = list(tqdm(iter, total=len(work_items), disable=not show_progress))
-        return [r for _, r in sorted(idx_and_result)]
+        if controller is not None:
+            controller.log_summary()
+        _report_hedging(recorder)
+        _report_completion_fns(recorder, self.completion_fns)
+        if early_stopping is not None:
+            early_stopping.record_summary(len(work_items))
+        return [r for _, r in sorted(idx_and_result) if r is not _SKIPPED]
 
     def get_samples(self):
         if self.samples_jsonl is None:
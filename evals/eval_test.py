@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import evals.eval
+from evals.api import DummyCompletionFn
+from evals.base import RunSpec
+from evals.eval import Eval, _index_samples, no_samples
+from evals.record import RecorderBase, record_match
+from evals.utils import api_utils
+
+
+def test_shards_partition_the_samples(monkeypatch):
+    samples = list(range(10))
+    monkeypatch.setattr(evals.eval, "_MAX_SAMPLES", 7)
+    everything = [i for _, i in _index_samples(samples)]
+
+    shards = []
+    for shard_index in range(3):
+        monkeypatch.setattr(evals.eval, "_SHARD", (shard_index, 3))
+        shards.append([i for _, i in _index_samples(samples)])
+    assert sorted(i for shard in shards for i in shard) == sorted(everything)
+    assert sum(len(shard) for shard in shards) == len(everything) == 7
+    assert [len(shard) for shard in shards] == [3, 2, 2]
+
+
+def test_no_samples_restores_max_samples(monkeypatch):
+    monkeypatch.setattr(evals.eval, "_MAX_SAMPLES", 5)
+    with no_samples():
+        assert _index_samples(list(range(10))) == []
+    assert evals.eval._MAX_SAMPLES == 5
+
+
+class SlowEval(Eval):
+    """Samples marked `slow` block until `release` is set, then try to make a request."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release = threading.Event()
+        self.request_errors = []
+
+    def eval_sample(self, sample, rng):
+        if sample["slow"]:
+            self.release.wait(5)
+            try:
+                api_utils.request_with_timeout(lambda: "response")
+            except Exception as e:
+                self.request_errors.append(e)
+        record_match(True)
+        return sample["id"]
+
+    async def aeval_sample(self, sample, rng):
+        if sample["slow"]:
+            await asyncio.sleep(5)
+        record_match(True)
+        return sample["id"]
+
+    def run(self, recorder):
+        raise NotImplementedError()
+
+
+def make_recorder():
+    return RecorderBase(
+        RunSpec(
+            completion_fns=["dummy"],
+            eval_name="test.s1",
+            base_eval="test",
+            split="s1",
+            run_config={},
+            created_by="",
+        )
+    )
+
+
+@pytest.mark.parametrize("engine", ["threaded", "async"])
+def test_sample_deadline(monkeypatch, engine):
+    monkeypatch.setenv("EVALS_SAMPLE_TIMEOUT", "0.2")
+    monkeypatch.setenv("EVALS_ENGINE", engine)
+    recorder = make_recorder()
+    eval = SlowEval(completion_fns=[DummyCompletionFn()], name="test.s1", registry=object())
+    samples = [{"id": 0, "slow": True}, {"id": 1, "slow": False}]
+    try:
+        results = eval.eval_all_samples(recorder, samples, show_progress=False)
+    finally:
+        eval.release.set()
+    assert sorted(results, key=str) == [1, None]
+    assert [e.sample_id for e in recorder.get_events("match")] == ["test.s1.1"]
+    assert [e.sample_id for e in recorder.get_events("error")] == ["test.s1.0"]
+
+
+def test_abandoned_sample_stops_making_requests(monkeypatch):
+    monkeypatch.setenv("EVALS_SAMPLE_TIMEOUT", "0.1")
+    recorder = make_recorder()
+    eval = SlowEval(completion_fns=[DummyCompletionFn()], name="test.s1", registry=object())
+    eval.eval_all_samples(recorder, [{"id": 0, "slow": True}], show_progress=False)
+    eval.release.set()
+    for _ in range(100):
+        if eval.request_errors:
+            break
+        time.sleep(0.01)
+    assert [type(e) for e in eval.request_errors] == [api_utils.SampleDeadlineExceeded]
+    # the abandoned sample's match was dropped
+    assert recorder.get_events("match") == []
+
+
+def test_early_stopping_once_the_interval_is_decided(monkeypatch):
+    monkeypatch.setenv("EVALS_EARLY_STOP_CI_WIDTH", "0.2")
+    monkeypatch.setenv("EVALS_SEQUENTIAL", "1")
+    recorder = make_recorder()
+    eval = SlowEval(completion_fns=[DummyCompletionFn()], name="test.s1", registry=object())
+    samples = [{"id": i, "slow": False} for i in range(100)]
+    results = eval.eval_all_samples(recorder, samples, show_progress=False)
+    # every sample is correct, so the interval is narrow enough after the minimum 30
+    assert len(results) == len(recorder.get_events("match")) == 30
+    info = recorder.get_final_report_info()
+    assert info["early_stop/stopped"]
+    assert info["early_stop/num_matches"] == 30
+    assert info["early_stop/num_samples_total"] == 100
+    assert info["early_stop/ci_high"] - info["early_stop/ci_low"] <= 0.2
+
+
+def test_no_early_stopping_by_default(monkeypatch):
+    monkeypatch.delenv("EVALS_EARLY_STOP_CI_WIDTH", raising=False)
+    monkeypatch.delenv("EVALS_EARLY_STOP_BASELINE", raising=False)
+    recorder = make_recorder()
+    eval = SlowEval(completion_fns=[DummyCompletionFn()], name="test.s1", registry=object())
+    samples = [{"id": i, "slow": False} for i in range(50)]
+    assert len(eval.eval_all_samples(recorder, samples, show_progress=False)) == 50
+    assert not any(key.startswith("early_stop/") for key in recorder.get_final_report_info())
+
+
+def test_completion_fn_stats_are_reported_once(monkeypatch):
+    monkeypatch.setenv("EVALS_SEQUENTIAL", "1")
+    calls = []
+
+    class StatsCompletionFn(DummyCompletionFn):
+        def final_report_info(self):
+            calls.append(1)
+            return {"stats/requests": 2}
+
+    recorder = make_recorder()
+    eval = SlowEval(completion_fns=[StatsCompletionFn()], name="test.s1", registry=object())
+    eval.eval_all_samples(recorder, [{"id": i, "slow": False} for i in range(2)], False)
+    assert len(calls) == 1
+    assert recorder.get_final_report_info()["stats/requests"] == 2
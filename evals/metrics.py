@@ -1,8 +1,10 @@
 """
 This file defines various common metrics of interest.
 """
+import math
 import random
-from typing import Optional, Sequence, Set
+from statistics import NormalDist
+from typing import Any, Optional, Sequence, Set, Tuple
 
 import numpy as np
 
@@ -21,6 +23,22 @@ def get_accuracy(events: Sequence[Event]) -> float:
         return num_correct / num_total
 
 
+def compute_accuracy_interval(
+    num_correct: int, num_total: int, confidence: float = 0.95
+) -> Tuple[float, float]:
+    """Wilson score interval for an accuracy of `num_correct` out of `num_total`."""
+    if num_total == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    p = num_correct / num_total
+    denominator = 1 + z**2 / num_total
+    center = (p + z**2 / (2 * num_total)) / denominator
+    half_width = (
+        z * math.sqrt(p * (1 - p) / num_total + z**2 / (4 * num_total**2)) / denominator
+    )
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
 def get_bootstrap_accuracy_std(events: Sequence[Event], num_samples: int = 1000):
     vals = [m.data["correct"] for m in events]
     return np.std([np.mean(random.sample(vals, len(vals) // 2)) for _ in range(1000)])
@@ -74,3 +92,64 @@ def compute_averaged_f_score(confusion_matrix, beta=1.0, average="macro"):
     for i in range(confusion_matrix.shape[0]):
         f_scores.append(compute_f_score(confusion_matrix, idx=i, beta=beta))
     return np.array(f_scores).mean()
+
+
+def get_metrics_means(events: Sequence[Event]) -> dict[str, float]:
+    """Average each numeric field of the `metrics` events over the events which have it."""
+    values: dict[str, list[float]] = {}
+    for event in events:
+        for key, value in event.data.items():
+            if isinstance(value, (bool, int, float)):
+                values.setdefault(key, []).append(float(value))
+    return {key: float(np.mean(key_values)) for key, key_values in values.items()}
+
+
+def get_usage_summary(events: Sequence[Event]) -> dict[str, Any]:
+    """
+    Summarize the `usage` events of each completion fn: the model(s) it called, the
+    number of calls and retries, and over calls which reached the API (i.e. weren't
+    served from the completion cache or shared with another call), the latency
+    percentiles and token counts, and for streamed calls, the time to first token and
+    inter-token latency.
+    """
+    # events recorded before usage events named their completion fn fall back to the model
+    by_fn: dict[str, list[Event]] = {}
+    for event in events:
+        fn_name = event.data.get("completion_fn") or event.data["model"]
+        by_fn.setdefault(fn_name, []).append(event)
+
+    summary = {}
+    for fn_name, fn_events in by_fn.items():
+        api_calls = [
+            e.data for e in fn_events if not (e.data.get("cached") or e.data.get("deduplicated"))
+        ]
+        latencies = np.array([call["latency"] for call in api_calls], dtype=float)
+        prompt_tokens = sum(call["prompt_tokens"] or 0 for call in api_calls)
+        completion_tokens = sum(call["completion_tokens"] or 0 for call in api_calls)
+        prefix = f"usage/{fn_name}"
+        summary[f"{prefix}/model"] = ",".join(sorted({str(e.data["model"]) for e in fn_events}))
+        summary[f"{prefix}/num_calls"] = len(fn_events)
+        summary[f"{prefix}/num_api_calls"] = len(api_calls)
+        summary[f"{prefix}/retries"] = sum(e.data.get("retries", 0) for e in fn_events)
+        summary[f"{prefix}/prompt_tokens"] = prompt_tokens
+        summary[f"{prefix}/completion_tokens"] = completion_tokens
+        summary[f"{prefix}/total_tokens"] = prompt_tokens + completion_tokens
+        if len(latencies):
+            for q in (50, 95, 99):
+                summary[f"{prefix}/latency_p{q}"] = float(np.percentile(latencies, q))
+            if completion_tokens:
+                summary[f"{prefix}/completion_tokens_per_second"] = completion_tokens / max(
+                    float(latencies.sum()), 1e-9
+                )
+        # streamed calls also record their time to first token and inter-token latency
+        ttfts = [c["time_to_first_token"] for c in api_calls if c.get("time_to_first_token")]
+        if ttfts:
+            for q in (50, 95, 99):
+                summary[f"{prefix}/time_to_first_token_p{q}"] = float(np.percentile(ttfts, q))
+        itls = [c["inter_token_latency"] for c in api_calls if c.get("inter_token_latency")]
+        if itls:
+            summary[f"{prefix}/inter_token_latency_mean"] = float(np.mean(itls))
+        num_aborted = sum(1 for call in api_calls if call.get("aborted"))
+        if num_aborted:
+            summary[f"{prefix}/num_aborted"] = num_aborted
+    return summary
@@ -0,0 +1,65 @@
+import pytest
+
+from evals.metrics import compute_accuracy_interval, get_usage_summary
+from evals.record import Event
+
+
+def _usage_event(latency, prompt_tokens, completion_tokens, retries=0, **extra):
+    data = {
+        "model": "gpt-3.5-turbo",
+        "completion_fn": "gpt-3.5-turbo",
+        "latency": latency,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "retries": retries,
+        **extra,
+    }
+    return Event("run", 0, "test.s1.0", "usage", data, "", "")
+
+
+def test_get_usage_summary():
+    events = [_usage_event(float(i), 10, 5) for i in range(1, 101)]
+    events.append(_usage_event(1.0, 10, 5, retries=2))
+    events.append(_usage_event(0.0, 10, 5, cached=True))
+    summary = get_usage_summary(events)
+    prefix = "usage/gpt-3.5-turbo"
+    assert summary[f"{prefix}/model"] == "gpt-3.5-turbo"
+    assert summary[f"{prefix}/num_calls"] == 102
+    assert summary[f"{prefix}/num_api_calls"] == 101
+    assert summary[f"{prefix}/retries"] == 2
+    assert summary[f"{prefix}/total_tokens"] == 101 * 15
+    assert summary[f"{prefix}/latency_p50"] == 50.0
+    assert summary[f"{prefix}/latency_p99"] > 98
+    assert summary[f"{prefix}/completion_tokens_per_second"] == 101 * 5 / (5050 + 1)
+
+
+def test_get_usage_summary_per_completion_fn():
+    events = [
+        _usage_event(1.0, 10, 5),
+        _usage_event(2.0, 20, 5, completion_fn="cot/gpt-3.5-turbo"),
+        _usage_event(3.0, 30, 5, completion_fn="cot/gpt-3.5-turbo"),
+    ]
+    summary = get_usage_summary(events)
+    assert summary["usage/gpt-3.5-turbo/num_calls"] == 1
+    assert summary["usage/cot/gpt-3.5-turbo/num_calls"] == 2
+    assert summary["usage/cot/gpt-3.5-turbo/model"] == "gpt-3.5-turbo"
+    assert summary["usage/cot/gpt-3.5-turbo/prompt_tokens"] == 50
+
+
+def test_get_usage_summary_without_events():
+    assert get_usage_summary([]) == {}
+
+
+@pytest.mark.parametrize(
+    "num_correct, num_total, confidence, expected",
+    [
+        (8, 10, 0.95, (0.4902, 0.9433)),
+        (0, 10, 0.95, (0.0, 0.2775)),
+        (50, 100, 0.95, (0.4038, 0.5962)),
+        (8, 10, 0.99, (0.4008, 0.9599)),
+        (0, 0, 0.95, (0.0, 1.0)),
+    ],
+)
+def test_compute_accuracy_interval(num_correct, num_total, confidence, expected):
+    low, high = compute_accuracy_interval(num_correct, num_total, confidence)
+    assert (low, high) == pytest.approx(expected, abs=1e-4)
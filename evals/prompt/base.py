@@ -2,14 +2,18 @@
 This file defines the classes for how to manage prompts for different types of
 models, i.e., "chat models" vs. "non chat models".
 """
+import functools
 import logging
 import threading
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
+
+import tiktoken
 
 logger = logging.getLogger(__name__)
 ENCODER_LOCK = threading.Lock()
+DEFAULT_ENCODING = "cl100k_base"
 
 # This is an approximation to the type accepted as the `prompt` field to `openai.Completion.create` calls
 OpenAICreatePrompt = Union[str, list[str], list[int], list[list[int]]]
@@ -49,6 +53,92 @@ def chat_prompt_to_text_prompt(prompt: OpenAICreateChatPrompt, for_completion: b
     return text.lstrip()
 
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: Optional[str] = None) -> tiktoken.Encoding:
+    """
+    Return the (cached) tiktoken encoding for `model`, falling back to
+    `DEFAULT_ENCODING` for models tiktoken does not know about.
+    """
+    with ENCODER_LOCK:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def num_tokens_from_prompt(
+    prompt: Union[OpenAICreatePrompt, OpenAICreateChatPrompt], model: Optional[str] = None
+) -> int:
+    """
+    Count the tokens `prompt` will use when sent to `model`. Chat prompts include
+    the per-message formatting overhead, following the OpenAI cookbook.
+    """
+    if is_chat_prompt(prompt):
+        encoding = get_encoding(model)
+        # the reply is primed with 3 tokens, and each message adds 3 formatting tokens
+        num_tokens = 3
+        for msg in prompt:
+            num_tokens += 3
+            for key, value in msg.items():
+                num_tokens += len(encoding.encode(value, disallowed_special=()))
+                if key == "name":
+                    num_tokens += 1
+        return num_tokens
+    if isinstance(prompt, str):
+        return len(get_encoding(model).encode(prompt, disallowed_special=()))
+    if all(isinstance(token, int) for token in prompt):
+        return len(prompt)
+    return sum(num_tokens_from_prompt(p, model) for p in prompt)
+
+
+def _truncate_text(text: str, max_tokens: int, model: Optional[str], side: str) -> str:
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    tokens = tokens[len(tokens) - max_tokens :] if side == "left" else tokens[:max_tokens]
+    return encoding.decode(tokens)
+
+
+def truncate_prompt(
+    prompt: Union[OpenAICreatePrompt, OpenAICreateChatPrompt],
+    max_tokens: int,
+    model: Optional[str] = None,
+    side: str = "left",
+) -> Union[OpenAICreatePrompt, OpenAICreateChatPrompt]:
+    """
+    Truncate a single `prompt` to at most `max_tokens` tokens, removing tokens from
+    its start (`side="left"`) or end (`side="right"`). Chat prompts first drop their
+    oldest non-system messages, keeping the last one, then truncate the content of
+    their longest message.
+    """
+    assert side in ("left", "right"), f"Expected side 'left' or 'right', got {side}"
+    if isinstance(prompt, str):
+        return _truncate_text(prompt, max_tokens, model, side)
+    if not is_chat_prompt(prompt):
+        assert all(isinstance(token, int) for token in prompt), "Can't truncate a batch of prompts"
+        return prompt[len(prompt) - max_tokens :] if side == "left" else prompt[:max_tokens]
+
+    messages = list(prompt)
+    while num_tokens_from_prompt(messages, model) > max_tokens:
+        droppable = [i for i, msg in enumerate(messages[:-1]) if msg["role"] != "system"]
+        if not droppable:
+            break
+        del messages[droppable[0]]
+    excess = num_tokens_from_prompt(messages, model) - max_tokens
+    if excess > 0:
+        encoding = get_encoding(model)
+        i = max(
+            range(len(messages)),
+            key=lambda i: len(encoding.encode(messages[i]["content"], disallowed_special=())),
+        )
+        content = messages[i]["content"]
+        content_tokens = len(encoding.encode(content, disallowed_special=()))
+        truncated = _truncate_text(content, max(content_tokens - excess, 0), model, side)
+        messages[i] = {**messages[i], "content": truncated}
+    return messages
+
+
 def text_prompt_to_chat_prompt(prompt: str, role: str = "system") -> OpenAICreateChatPrompt:
     assert isinstance(prompt, str), f"Expected a text prompt, got {prompt}"
     return [
@@ -0,0 +1,44 @@
+import pytest
+
+from evals.prompt import base
+from evals.prompt.base import num_tokens_from_prompt, truncate_prompt
+
+
+class CharEncoding:
+    """Encodes each character as a token, so tests don't need tiktoken's data files."""
+
+    def encode(self, text, disallowed_special=()):
+        return [ord(c) for c in text]
+
+    def decode(self, tokens):
+        return "".join(chr(t) for t in tokens)
+
+
+@pytest.fixture(autouse=True)
+def char_encoding(monkeypatch):
+    monkeypatch.setattr(base, "get_encoding", lambda model=None: CharEncoding())
+
+
+def test_truncate_text_prompt():
+    assert truncate_prompt("abcdef", 4) == "cdef"
+    assert truncate_prompt("abcdef", 4, side="right") == "abcd"
+    assert truncate_prompt("abc", 4) == "abc"
+    assert truncate_prompt([1, 2, 3, 4], 2) == [3, 4]
+
+
+def test_truncate_chat_prompt():
+    prompt = [
+        {"role": "system", "content": "sys"},
+        {"role": "user", "content": "old question"},
+        {"role": "assistant", "content": "old answer"},
+        {"role": "user", "content": "new question"},
+    ]
+    # each message costs 3 tokens plus its role and content, and the reply 3 more
+    assert num_tokens_from_prompt(prompt) == 75
+    truncated = truncate_prompt(prompt, 40)
+    assert truncated == [prompt[0], prompt[3]]
+    assert num_tokens_from_prompt(truncated) == 34
+
+    truncated = truncate_prompt(prompt, 30)
+    assert truncated[-1]["content"] == "question"
+    assert num_tokens_from_prompt(truncated) == 30
@@ -1,34 +1,75 @@
 """
 This file defines the recorder classes which log eval results in different ways,
-such as to a local JSON file or to a remote Snowflake database.
+such as to a local JSON file, a local SQLite database or a remote Snowflake database.
 
 If you would like to implement a custom recorder, you can see how the
 `LocalRecorder` and `Recorder` classes inherit from the `RecorderBase` class and
 override certain methods.
 """
 import atexit
+import collections
 import contextlib
 import dataclasses
+import gzip
 import logging
+import numbers
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
 import threading
 import time
 from contextvars import ContextVar
 from datetime import datetime, timezone
-from typing import Any, List, Optional, Sequence
+from typing import Any, Iterator, List, Optional, Sequence
 
 import blobfile as bf
+import numpy as np
 
 import evals
 from evals.base import RunSpec
-from evals.data import jsondumps
+from evals.data import (
+    COMPRESSED_FILE_EXTENSIONS,
+    StreamCompressor,
+    compress_by_file_pattern,
+    jsondumps,
+    jsondumps_bytes,
+    jsonloads,
+    open_blob_by_file_pattern,
+)
 from evals.utils.misc import t
-from evals.utils.snowflake import SnowflakeConnection
+from evals.utils.snowflake import SnowflakeConnection, SnowflakeUploader, bulk_load_json
 
 logger = logging.getLogger(__name__)
 
 MIN_FLUSH_EVENTS = 100
 MAX_SNOWFLAKE_BYTES = 16 * 10**6
 MIN_FLUSH_SECONDS = 10
+MAX_PENDING_SNOWFLAKE_UPLOADS = 100
+SNOWFLAKE_DRAIN_SECONDS = 60
+MAX_FINAL_REPORT_TRIALS = 5
+MAX_QUEUED_EVENTS = 10_000
+MAX_WRITE_BATCH_EVENTS = 1000
+SEGMENT_POLL_SECONDS = 0.05
+
+# Numeric fields of events which are also accumulated in arrays, by event type (see
+# `RecorderBase.get_column`).
+COLUMN_KEYS = {
+    "match": ("correct",),
+    "metrics": ("accuracy", "f1_score", "score"),
+}
+
+# Columns of the Snowflake `events` table, and their types.
+SNOWFLAKE_EVENT_COLUMNS = {
+    "run_id": "string",
+    "event_id": "number",
+    "sample_id": "string",
+    "type": "string",
+    "data": "variant",
+    "created_by": "string",
+    "created_at": "string",
+}
 
 _default_recorder: ContextVar[Optional["RecorderBase"]] = ContextVar(
     "default_recorder", default=None
@@ -39,6 +80,23 @@ def default_recorder() -> Optional["RecorderBase"]:
     return _default_recorder.get()
 
 
+class _Column:
+    """A float64 array which grows as values are appended."""
+
+    def __init__(self, capacity: int = 1024):
+        self._values = np.empty(capacity, dtype=np.float64)
+        self._size = 0
+
+    def append(self, value: float):
+        if self._size == len(self._values):
+            self._values = np.resize(self._values, 2 * len(self._values))
+        self._values[self._size] = value
+        self._size += 1
+
+    def to_array(self) -> np.ndarray:
+        return self._values[: self._size].copy()
+
+
 @dataclasses.dataclass
 class Event:
     run_id: str
@@ -49,6 +107,23 @@ class Event:
     created_by: str
     created_at: str
 
+    def cache_data_json(self):
+        """Serialize `data` now, raising if it can't be, and keep it for `to_json`."""
+        self._data_json = jsondumps_bytes(self.data)
+
+    def data_json(self) -> bytes:
+        data_json = self.__dict__.get("_data_json")
+        return data_json if data_json is not None else jsondumps_bytes(self.data)
+
+    def to_json(self) -> bytes:
+        """Serialize the event as a line of a record log."""
+        fields = {
+            field.name: getattr(self, field.name)
+            for field in dataclasses.fields(self)
+            if field.name != "data"
+        }
+        return jsondumps_bytes(fields)[:-1] + b',"data":' + self.data_json() + b"}\n"
+
 
 class RecorderBase:
     """
@@ -64,6 +139,7 @@ class RecorderBase:
     - `raw`: A raw sample specified by the `data`.
     - `metrics`: A set of metrics specified by the `kwargs`.
     - `error`: An `error` along with an accompanying `msg`.
+    - `usage`: The `latency`, token counts and `retries` of a completion fn call.
     - `extra`: Any extra `data` of interest to be recorded.
     For these events, helper methods are defined at the bottom of this file.
     More generally, you can record any event by calling `record_event` with the
@@ -78,6 +154,14 @@ class RecorderBase:
         self._sample_id: ContextVar[Optional[int]] = ContextVar("_sample_id", default=None)
         self.run_spec = run_spec
         self._events: List[Event] = []
+        self._events_by_type: dict[str, List[Event]] = collections.defaultdict(list)
+        self._columns: dict[str, _Column] = collections.defaultdict(_Column)
+        self._event_id_offset = 0
+        # when set, flushed events are only kept in the log, and not indexed by type
+        self._evict_written_events = False
+        self._num_matches = 0
+        self._num_correct = 0
+        self._final_report_info: dict[str, Any] = {}
         self._last_flush_time = time.time()
         self._flushes_done = 0
         self._written_events = 0
@@ -116,8 +200,27 @@ class RecorderBase:
             return sample_id in self._paused_ids
 
     def get_events(self, type: str) -> Sequence[Event]:
+        return list(self.iter_events(type))
+
+    def iter_events(self, type: str) -> Iterator[Event]:
         with self._event_lock:
-            return [event for event in self._events if event.type == type]
+            return iter(list(self._events_by_type.get(type, ())))
+
+    def get_column(self, key: str) -> np.ndarray:
+        """
+        Return the values of `key` over the events of the type it belongs to in
+        `COLUMN_KEYS` (e.g. `correct` over `match` events, `f1_score` over `metrics`
+        events), in the order they were recorded. Events where it is missing or not a
+        number are left out.
+        """
+        with self._event_lock:
+            column = self._columns.get(key)
+            return column.to_array() if column is not None else np.empty(0)
+
+    def get_match_counts(self) -> tuple[int, int]:
+        """Return the running (number correct, total) over all `match` events so far."""
+        with self._event_lock:
+            return self._num_correct, self._num_matches
 
     def get_metrics(self):
         return list(map(lambda x: x.data, self.get_events("metrics")))
@@ -125,6 +228,57 @@ class RecorderBase:
     def get_scores(self, key: str):
         return list(map(lambda e: e.data[key], self.get_events("metrics")))
 
+    def _next_event_id(self) -> int:
+        return self._event_id_offset + len(self._events)
+
+    def _append_event(self, event: Event):
+        """Append `event`, keeping running tallies up to date. Call with `_event_lock` held."""
+        self._events.append(event)
+        if not self._evict_written_events:
+            self._events_by_type[event.type].append(event)
+        if event.type == "match":
+            self._num_matches += 1
+            self._num_correct += int(bool(event.data.get("correct")))
+        if event.type in COLUMN_KEYS and isinstance(event.data, dict):
+            for key in COLUMN_KEYS[event.type]:
+                value = event.data.get(key)
+                if isinstance(value, (numbers.Real, np.bool_)):
+                    self._columns[key].append(float(value))
+
+    def restore_completed_samples(self, record_log: "RecordLog") -> set[str]:
+        """
+        Load the events of the samples completed in a previous, interrupted run (see
+        `read_record_log`) so they are included in `get_events` and the final report.
+        They are not written again. Returns the ids of the completed samples.
+        """
+        completed = completed_sample_ids(record_log.events)
+        with self._event_lock:
+            assert not self._events, "Events must be restored before any are recorded"
+            for event in record_log.events:
+                if event.sample_id in completed:
+                    self._append_event(event)
+            self._written_events = len(self._events)
+            # continue numbering after every event in the log, completed or not
+            max_event_id = max((e.event_id for e in record_log.events), default=-1)
+            self._event_id_offset = max_event_id + 1 - len(self._events)
+            if self._evict_written_events:
+                self._evict_events()
+        return completed
+
+    def record_events(self, events: Sequence[Event]):
+        """
+        Record events taken from other runs (e.g. the logs of several shards) as
+        events of this run.
+        """
+        with self._event_lock:
+            for event in events:
+                self._append_event(
+                    dataclasses.replace(
+                        event, run_id=self.run_spec.run_id, event_id=self._next_event_id()
+                    )
+                )
+        self.flush_events()
+
     def _create_event(self, type, data=None, sample_id=None):
         if sample_id is None:
             sample_id = self.current_sample_id()
@@ -133,7 +287,7 @@ class RecorderBase:
 
         return Event(
             run_id=self.run_spec.run_id,
-            event_id=len(self._events),
+            event_id=self._next_event_id(),
             type=type,
             sample_id=sample_id,
             data=data,
@@ -141,6 +295,32 @@ class RecorderBase:
             created_at=str(datetime.now(timezone.utc)),
         )
 
+    def _should_flush(self) -> bool:
+        """Whether `record_event` should flush unwritten events. Call with `_event_lock` held."""
+        return (
+            self._flushes_done == self._flushes_started
+            and len(self._events) >= self._written_events + MIN_FLUSH_EVENTS
+            and time.time() >= self._last_flush_time + MIN_FLUSH_SECONDS
+        )
+
+    def _take_unwritten_events(self) -> List[Event]:
+        """Mark the unflushed events as flushed and return them. Call with `_event_lock` held."""
+        events_to_write = self._events[self._written_events :]
+        self._written_events = len(self._events)
+        self._flushes_started += 1
+        if self._evict_written_events:
+            self._evict_events()
+        return events_to_write
+
+    def _evict_events(self):
+        """
+        Drop the flushed events from memory, keeping the running tallies and columns.
+        Call with `_event_lock` held.
+        """
+        self._event_id_offset += self._written_events
+        del self._events[: self._written_events]
+        self._written_events = 0
+
     def _flush_events_internal(self, events_to_write: Sequence[Event]):
         pass
 
@@ -148,9 +328,7 @@ class RecorderBase:
         with self._event_lock:
             if len(self._events) == self._written_events:
                 return
-            events_to_write = self._events[self._written_events :]
-            self._written_events = len(self._events)
-            self._flushes_started += 1
+            events_to_write = self._take_unwritten_events()
         self._flush_events_internal(events_to_write)
 
     def record_event(self, type, data=None, sample_id=None):
@@ -162,26 +340,11 @@ class RecorderBase:
         if self.is_paused(sample_id):
             return
         with self._event_lock:
-            event = Event(
-                run_id=self.run_spec.run_id,
-                event_id=len(self._events),
-                type=type,
-                sample_id=sample_id,
-                data=data,
-                created_by=self.run_spec.created_by,
-                created_at=str(datetime.now(timezone.utc)),
-            )
-            self._events.append(event)
-            if (
-                self._flushes_done < self._flushes_started
-                or len(self._events) < self._written_events + MIN_FLUSH_EVENTS
-                or time.time() < self._last_flush_time + MIN_FLUSH_SECONDS
-            ):
+            event = self._create_event(type, data, sample_id)
+            self._append_event(event)
+            if not self._should_flush():
                 return
-            events_to_write = self._events[self._written_events :]
-            self._written_events = len(self._events)
-            self._flushes_started += 1
-            self._flush_events_internal(events_to_write)
+            self._flush_events_internal(self._take_unwritten_events())
 
     def record_match(self, correct: bool, *, expected=None, picked=None, sample_id=None, **extra):
         assert isinstance(
@@ -214,6 +377,26 @@ class RecorderBase:
         }
         self.record_event("sampling", data, sample_id=sample_id)
 
+    def record_usage(
+        self,
+        model,
+        latency,
+        prompt_tokens=None,
+        completion_tokens=None,
+        retries=0,
+        sample_id=None,
+        **extra,
+    ):
+        data = {
+            "model": model,
+            "latency": latency,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "retries": retries,
+            **extra,
+        }
+        self.record_event("usage", data, sample_id=sample_id)
+
     def record_cond_logp(self, prompt, completion, logp, sample_id=None, **extra):
         data = {
             "prompt": prompt,
@@ -249,6 +432,23 @@ class RecorderBase:
     def record_extra(self, data, sample_id=None):
         self.record_event("extra", data, sample_id=sample_id)
 
+    def record_final_report_info(self, **info):
+        """
+        Record run-level information (e.g. about how the samples were evaluated) to be
+        added to the eval's final report.
+        """
+        with self._event_lock:
+            self._final_report_info.update(info)
+
+    def increment_final_report_info(self, key: str, amount: int = 1):
+        """Add `amount` to a counter in the final report information."""
+        with self._event_lock:
+            self._final_report_info[key] = self._final_report_info.get(key, 0) + amount
+
+    def get_final_report_info(self) -> dict[str, Any]:
+        with self._event_lock:
+            return dict(self._final_report_info)
+
     def record_final_report(self, final_report: Any):
         logging.info(f"Final report: {final_report}. Not writing anywhere.")
 
@@ -285,7 +485,7 @@ class DummyRecorder(RecorderBase):
 
         with self._event_lock:
             event = self._create_event(type, data)
-            self._events.append(event)
+            self._append_event(event)
 
         msg = f"Not recording event: {event}"
 
@@ -307,44 +507,218 @@ class LocalRecorder(RecorderBase):
     """
     A recorder which logs events to the specified JSON file.
     This is the default recorder used by `oaieval`.
+
+    Events are handed to a background writer thread, which serializes and appends them
+    to the file in batches, so recording an event doesn't wait on disk or blob I/O. If
+    the writer falls `MAX_QUEUED_EVENTS` events behind, recording blocks until it
+    catches up. `flush_events` waits until every recorded event has been written.
+
+    With `spill` (default `EVALS_RECORD_SPILL`), written events are dropped from memory,
+    keeping only the running match tallies and the `COLUMN_KEYS` columns, and
+    `get_events` reads them back from the log.
+
+    Appending to an object in cloud storage (e.g. a `gs://` or `az://` path) re-uploads
+    all of it, so with `segmented` (the default for such paths) each batch of events is
+    instead written as a new part file next to the log, and the parts are concatenated
+    into the log when the final report is recorded. `read_record_log` reads the parts of
+    an unfinished log as part of it.
     """
 
-    def __init__(self, log_path: Optional[str], run_spec: RunSpec):
+    def __init__(
+        self,
+        log_path: Optional[str],
+        run_spec: RunSpec,
+        resume: bool = False,
+        spill: Optional[bool] = None,
+        segmented: Optional[bool] = None,
+    ):
         super().__init__(run_spec)
         self.event_file_path = log_path
-        if log_path is not None:
+        if spill is None:
+            spill = os.environ.get("EVALS_RECORD_SPILL", "0") in {"1", "true", "yes"}
+        assert not spill or log_path is not None, "Spilling events requires a log path"
+        self._evict_written_events = spill
+        self._write_queue: queue.Queue[Event] = queue.Queue(maxsize=MAX_QUEUED_EVENTS)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_error: Optional[BaseException] = None
+        self._flush_requested = threading.Event()
+        if segmented is None:
+            segmented = log_path is not None and _is_remote_path(log_path)
+        self._segmented = segmented
+        self._num_segments = 0
+        self._log_file: Optional[Any] = None
+        self._log_compressor = StreamCompressor(log_path or "")
+        # when resuming, the log already starts with the spec and we append to it
+        if log_path is not None and not resume:
             with bf.BlobFile(log_path, "wb") as f:
-                f.write((jsondumps({"spec": dataclasses.asdict(run_spec)}) + "\n").encode("utf-8"))
+                f.write(_encode_log_lines(log_path, [{"spec": dataclasses.asdict(run_spec)}]))
+            if bf.isdir(_segments_dir(log_path)):
+                bf.rmtree(_segments_dir(log_path))
+        elif log_path is not None:
+            self._num_segments = len(_segment_paths(log_path))
+
+    def _should_flush(self) -> bool:
+        # the writer thread does the batching
+        return True
 
     def _flush_events_internal(self, events_to_write: Sequence[Event]):
+        self._raise_writer_error()
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_events, daemon=True)
+            self._writer.start()
+        for event in events_to_write:
+            self._write_queue.put(event)
+
+    def _next_batch(self) -> List[Event]:
+        events_to_write = [self._write_queue.get()]
+        # each segment is a separate file, so wait a while for more events to write with it
+        deadline = time.time() + (MIN_FLUSH_SECONDS if self._segmented else 0)
+        while len(events_to_write) < MAX_WRITE_BATCH_EVENTS:
+            try:
+                events_to_write.append(self._write_queue.get_nowait())
+            except queue.Empty:
+                if time.time() >= deadline or self._flush_requested.is_set():
+                    break
+                self._flush_requested.wait(SEGMENT_POLL_SECONDS)
+        return events_to_write
+
+    def _write_events(self):
+        while True:
+            events_to_write = self._next_batch()
+            try:
+                self._write_batch(events_to_write)
+            except BaseException as e:
+                self._writer_error = e
+            finally:
+                for _ in events_to_write:
+                    self._write_queue.task_done()
+
+    def _write_batch(self, events_to_write: Sequence[Event]):
         start = time.time()
         try:
-            lines = [jsondumps(event) + "\n" for event in events_to_write]
+            lines = [event.to_json() for event in events_to_write]
         except TypeError as e:
             logger.error(f"Failed to serialize events: {events_to_write}")
             raise e
 
-        with bf.BlobFile(self.event_file_path, "ab") as f:
-            f.write(b"".join([l.encode("utf-8") for l in lines]))
+        data = b"".join(lines)
+        if self._segmented:
+            path = _segment_path(self.event_file_path, self._num_segments)
+            self._num_segments += 1
+            with bf.BlobFile(path, "wb") as f:
+                f.write(compress_by_file_pattern(self.event_file_path, data))
+        else:
+            path = self.event_file_path
+            self._append_to_log(data)
 
         logger.info(
-            f"Logged {len(lines)} rows of events to {self.event_file_path}: insert_time={t(time.time()-start)}"
+            f"Logged {len(lines)} rows of events to {path}: insert_time={t(time.time()-start)}"
         )
 
         self._last_flush_time = time.time()
-        self._flushes_done += 1
+
+    def _append_to_log(self, data: bytes):
+        """Append `data` to the log, as one complete frame if the log is compressed."""
+        data = self._log_compressor.compress(data)
+        if _is_remote_path(self.event_file_path):
+            with bf.BlobFile(self.event_file_path, "ab") as f:
+                f.write(data)
+            return
+        # keep local logs open rather than reopening them for every batch
+        if self._log_file is None:
+            self._log_file = bf.BlobFile(self.event_file_path, "ab")
+        self._log_file.write(data)
+        self._log_file.flush()
+
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            error, self._writer_error = self._writer_error, None
+            raise error
+
+    def flush_events(self):
+        with self._event_lock:
+            # queue the events under the lock, so they are written in the order recorded
+            if len(self._events) > self._written_events:
+                self._flush_events_internal(self._take_unwritten_events())
+        self._flush_requested.set()
+        try:
+            self._write_queue.join()
+        finally:
+            self._flush_requested.clear()
+        self._raise_writer_error()
+
+    def restore_completed_samples(self, record_log: "RecordLog") -> set[str]:
+        """
+        Like `RecorderBase.restore_completed_samples`, but also rewrites the log without
+        the events of incomplete samples, since they are evaluated again.
+        """
+        completed = super().restore_completed_samples(record_log)
+        rows = [{"spec": record_log.spec}]
+        rows += [e for e in record_log.events if e.sample_id in completed]
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        with bf.BlobFile(self.event_file_path, "wb") as f:
+            f.write(_encode_log_lines(self.event_file_path, rows))
+        if bf.isdir(_segments_dir(self.event_file_path)):
+            bf.rmtree(_segments_dir(self.event_file_path))
+        self._num_segments = 0
+        return completed
+
+    def iter_events(self, type: str) -> Iterator[Event]:
+        if not self._evict_written_events:
+            return super().iter_events(type)
+        self.flush_events()
+        return (
+            event for event in iter_record_log_events(self.event_file_path) if event.type == type
+        )
 
     def record_final_report(self, final_report: Any):
-        with bf.BlobFile(self.event_file_path, "ab") as f:
-            f.write((jsondumps({"final_report": final_report}) + "\n").encode("utf-8"))
+        # write the remaining events first, so the final report is the last line
+        self.flush_events()
+        if self._segmented:
+            self._compact_segments(
+                _encode_log_lines(self.event_file_path, [{"final_report": final_report}])
+            )
+        else:
+            self._append_to_log(jsondumps_bytes({"final_report": final_report}) + b"\n")
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
 
         logging.info(f"Final report: {final_report}. Logged to {self.event_file_path}")
 
+    def _compact_segments(self, final_report_data: bytes):
+        """Concatenate the log, its segments and `final_report_data` into the log."""
+        start = time.time()
+        segments_dir = _segments_dir(self.event_file_path)
+        compacted_path = bf.join(
+            segments_dir, "compacted.jsonl" + _compression_extension(self.event_file_path)
+        )
+        segment_paths = _segment_paths(self.event_file_path)
+        with bf.BlobFile(compacted_path, "wb") as out:
+            for path in [self.event_file_path, *segment_paths]:
+                with bf.BlobFile(path, "rb", streaming=True) as f:
+                    shutil.copyfileobj(f, out)
+            out.write(final_report_data)
+        bf.copy(compacted_path, self.event_file_path, overwrite=True)
+        bf.rmtree(segments_dir)
+        logger.info(
+            f"Compacted {len(segment_paths)} segments into {self.event_file_path}: "
+            f"time={t(time.time()-start)}"
+        )
+
 
 class Recorder(RecorderBase):
     """
     A recorder which logs events to Snowflake.
     Can be used by passing `--no-local-run` when invoking `oaieval`.
+
+    Events are appended to the local log as they are flushed, and uploaded to Snowflake
+    in the background (see `SnowflakeUploader`), so an unavailable Snowflake doesn't
+    hold up the eval. With `bulk_load` (default `EVALS_SNOWFLAKE_BULK_LOAD`), each
+    batch is loaded from a staged file with a single COPY rather than inserted. The
+    final report records whether every batch reached Snowflake under `snowflake/...`.
     """
 
     def __init__(
@@ -352,10 +726,17 @@ class Recorder(RecorderBase):
         log_path: Optional[str],
         run_spec: RunSpec,
         snowflake_connection: Optional[SnowflakeConnection] = None,
+        bulk_load: Optional[bool] = None,
     ) -> None:
         super().__init__(run_spec)
         self.event_file_path = log_path
         self._writing_lock = threading.Lock()
+        self._log_compressor = StreamCompressor(log_path or "")
+        if bulk_load is None:
+            bulk_load = os.environ.get("EVALS_SNOWFLAKE_BULK_LOAD", "0") in {"1", "true", "yes"}
+        self._bulk_load = bulk_load
+        # rows of each events file already inserted, so a retried load picks up after them
+        self._inserted_rows: dict[str, int] = {}
 
         if snowflake_connection is None:
             snowflake_connection = SnowflakeConnection()
@@ -363,7 +744,7 @@ class Recorder(RecorderBase):
 
         if log_path is not None:
             with bf.BlobFile(log_path, "wb") as f:
-                f.write((jsondumps({"spec": dataclasses.asdict(run_spec)}) + "\n").encode("utf-8"))
+                f.write(_encode_log_lines(log_path, [{"spec": dataclasses.asdict(run_spec)}]))
 
         query = """
             INSERT ALL INTO runs (run_id, model_name, eval_name, base_eval, split, run_config, settings, created_by, created_at)
@@ -385,76 +766,330 @@ class Recorder(RecorderBase):
                 "created_at": run_spec.created_at,
             },
         )
+        self._uploader = SnowflakeUploader(
+            self._load_events_file,
+            spool_dir=os.path.join(tempfile.gettempdir(), "evals_snowflake_spool", run_spec.run_id),
+            max_pending=MAX_PENDING_SNOWFLAKE_UPLOADS,
+        )
         atexit.register(self.flush_events)
 
+    def _append_to_log(self, lines: Sequence[bytes]):
+        """Like `LocalRecorder._append_to_log`, appending one compressed frame per batch."""
+        data = self._log_compressor.compress(b"".join(lines))
+        with bf.BlobFile(self.event_file_path, "ab") as f:
+            f.write(data)
+
+    def _load_events_file(self, path: str):
+        """Load a gzipped JSONL file of events into Snowflake. Runs on the uploader thread."""
+        start = time.time()
+        if self._bulk_load:
+            bulk_load_json(
+                self._conn, "events", SNOWFLAKE_EVENT_COLUMNS, path, stage_dir=self.run_spec.run_id
+            )
+            logger.info(f"Loaded {path} to Snowflake: load_time={t(time.time()-start)}")
+            return
+
+        with gzip.open(path) as f:
+            rows = [
+                (
+                    row["run_id"],
+                    row["event_id"],
+                    row["sample_id"],
+                    row["type"],
+                    jsondumps(row["data"]),
+                    row["created_by"],
+                    row["created_at"],
+                )
+                for row in map(jsonloads, f)
+            ]
+        idx_l = self._inserted_rows.get(path, 0)
+        while idx_l < len(rows):
+            total_bytes = 0
+            idx_r = idx_l
+            while idx_r < len(rows) and total_bytes + len(rows[idx_r][4]) < MAX_SNOWFLAKE_BYTES:
+                total_bytes += len(rows[idx_r][4])
+                idx_r += 1
+            assert idx_r > idx_l
+            start = time.time()
+            query = """
+            INSERT INTO events (run_id, event_id, sample_id, type, data, created_by, created_at)
+            SELECT Column1 AS run_id, Column2 as event_id, Column3 AS sample_id, Column4 AS type, PARSE_JSON(Column5) AS data, Column6 AS created_by, Column7 AS created_at
+            FROM VALUES(%s, %s, %s, %s, %s, %s, %s)
+            """
+            self._conn.robust_query(command=query, seqparams=rows[idx_l:idx_r], many=True)
+            logger.info(
+                f"Logged {idx_r - idx_l} rows of events to Snowflake: insert_time={t(time.time()-start)}"
+            )
+            idx_l = idx_r
+            self._inserted_rows[path] = idx_l
+        self._inserted_rows.pop(path, None)
+
     def _flush_events_internal(self, events_to_write: Sequence[Event]):
+        try:
+            lines = [event.to_json() for event in events_to_write]
+        except TypeError as e:
+            logger.error(f"Failed to serialize events: {events_to_write}")
+            raise e
         with self._writing_lock:
-            try:
-                lines = [jsondumps(event) + "\n" for event in events_to_write]
-            except TypeError as e:
-                logger.error(f"Failed to serialize events: {events_to_write}")
-                raise e
-            idx_l = 0
-            while idx_l < len(events_to_write):
-                total_bytes = 0
-                idx_r = idx_l
-                while (
-                    idx_r < len(events_to_write)
-                    and total_bytes + len(lines[idx_r]) < MAX_SNOWFLAKE_BYTES
-                ):
-                    total_bytes += len(lines[idx_r])
-                    idx_r += 1
-                assert idx_r > idx_l
-                start = time.time()
-                buffer = [
-                    (
-                        event.run_id,
-                        event.event_id,
-                        event.sample_id,
-                        event.type,
-                        jsondumps(event.data),
-                        event.created_by,
-                        event.created_at,
-                    )
-                    for event in events_to_write[idx_l:idx_r]
-                ]
-                query = """
-                INSERT INTO events (run_id, event_id, sample_id, type, data, created_by, created_at)
-                SELECT Column1 AS run_id, Column2 as event_id, Column3 AS sample_id, Column4 AS type, PARSE_JSON(Column5) AS data, Column6 AS created_by, Column7 AS created_at
-                FROM VALUES(%s, %s, %s, %s, %s, %s, %s)
-                """
-                self._conn.robust_query(command=query, seqparams=buffer, many=True)
-                logger.info(
-                    f"Logged {len(buffer)} rows of events to Snowflake: insert_time={t(time.time()-start)}"
+            self._append_to_log(lines)
+            if not self._uploader.submit(gzip.compress(b"".join(lines)), suffix=".jsonl.gz"):
+                logger.warning(
+                    f"Snowflake uploads are falling behind, so {len(lines)} events were only "
+                    f"logged to {self.event_file_path}"
                 )
-                idx_l = idx_r
-
-            with bf.BlobFile(self.event_file_path, "ab") as f:
-                f.write(b"".join([l.encode("utf-8") for l in lines]))
             self._last_flush_time = time.time()
             self._flushes_done += 1
 
     def record_final_report(self, final_report: Any):
+        """
+        Record `final_report`, once the pending uploads have finished or after
+        `SNOWFLAKE_DRAIN_SECONDS`. If it is a dict, the ingest status is added to it.
+        """
+        # submit the remaining events first, so they are waited for too
+        self.flush_events()
+        if not self._uploader.drain(SNOWFLAKE_DRAIN_SECONDS):
+            logger.warning(
+                f"Snowflake ingest is lagging: {self._uploader.num_pending} batches of events "
+                f"are still waiting in {self._uploader.spool_dir}"
+            )
+        if isinstance(final_report, dict):
+            final_report.update(self._uploader.summary())
         with self._writing_lock:
-            with bf.BlobFile(self.event_file_path, "ab") as f:
-                f.write((jsondumps({"final_report": final_report}) + "\n").encode("utf-8"))
-            query = """
-                UPDATE runs
-                SET final_report = PARSE_JSON(%(final_report)s)
-                WHERE run_id = %(run_id)s
+            self._append_to_log([jsondumps_bytes({"final_report": final_report}) + b"\n"])
+        query = """
+            UPDATE runs
+            SET final_report = PARSE_JSON(%(final_report)s)
+            WHERE run_id = %(run_id)s
+        """
+        self._conn.robust_query(
+            MAX_FINAL_REPORT_TRIALS,
+            command=query,
+            params={
+                "run_id": self.run_spec.run_id,
+                "final_report": jsondumps(final_report),
+            },
+        )
+
+    def _create_event(self, type, data=None, sample_id=None):
+        event = super()._create_event(type, data, sample_id)
+        # serialize data now so we fail early, and keep the result for the flush
+        event.cache_data_json()
+        return event
+
+
+class SQLiteRecorder(RecorderBase):
+    """
+    A recorder which logs runs and events to `runs` and `events` tables in a SQLite
+    database at `db_path`. Several runs (and processes) can share the same database.
+    Each flush inserts its events in a single transaction. Flushed events aren't kept in
+    memory: `get_events` and `get_metrics` query the database instead.
+    """
+
+    def __init__(self, db_path: str, run_spec: RunSpec) -> None:
+        super().__init__(run_spec)
+        self.db_path = db_path
+        self._local = threading.local()
+        self._evict_written_events = True
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                completion_fns TEXT NOT NULL,
+                eval_name TEXT NOT NULL,
+                base_eval TEXT NOT NULL,
+                split TEXT NOT NULL,
+                run_config TEXT NOT NULL,
+                created_by TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                final_report TEXT
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                run_id TEXT NOT NULL,
+                event_id INTEGER NOT NULL,
+                sample_id TEXT,
+                type TEXT NOT NULL,
+                data TEXT,
+                created_by TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (run_id, event_id)
+            );
+            CREATE INDEX IF NOT EXISTS events_run_id_type ON events (run_id, type);
+            CREATE INDEX IF NOT EXISTS events_sample_id ON events (sample_id);
             """
-            self._conn.robust_query(
-                command=query,
-                params={
-                    "run_id": self.run_spec.run_id,
-                    "final_report": jsondumps(final_report),
-                },
+        )
+        conn.execute(
+            "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+            (
+                run_spec.run_id,
+                jsondumps(run_spec.completion_fns),
+                run_spec.eval_name,
+                run_spec.base_eval,
+                run_spec.split,
+                jsondumps(run_spec.run_config),
+                run_spec.created_by,
+                run_spec.created_at,
+            ),
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _flush_events_internal(self, events_to_write: Sequence[Event]):
+        start = time.time()
+        rows = [
+            (
+                event.run_id,
+                event.event_id,
+                event.sample_id,
+                event.type,
+                event.data_json().decode("utf-8"),
+                event.created_by,
+                event.created_at,
             )
+            for event in events_to_write
+        ]
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        logger.info(
+            f"Logged {len(rows)} rows of events to {self.db_path}: insert_time={t(time.time()-start)}"
+        )
+        self._last_flush_time = time.time()
+        self._flushes_done += 1
 
-    def record_event(self, type, data=None, sample_id=None):
-        # try to serialize data so we fail early!
-        _ = jsondumps(data)
-        return super().record_event(type, data, sample_id)
+    def _query_events(self, columns: str, type: str) -> Iterator[tuple]:
+        self.flush_events()
+        return self._conn().execute(
+            f"SELECT {columns} FROM events WHERE run_id = ? AND type = ? ORDER BY event_id",
+            (self.run_spec.run_id, type),
+        )
+
+    def iter_events(self, type: str) -> Iterator[Event]:
+        for row in self._query_events(
+            "run_id, event_id, sample_id, type, data, created_by, created_at", type
+        ):
+            yield Event(*row[:4], jsonloads(row[4]), *row[5:])
+
+    def get_metrics(self):
+        return [jsonloads(data) for data, in self._query_events("data", "metrics")]
+
+    def record_final_report(self, final_report: Any):
+        self.flush_events()
+        self._conn().execute(
+            "UPDATE runs SET final_report = ? WHERE run_id = ?",
+            (jsondumps(final_report), self.run_spec.run_id),
+        )
+        logging.info(f"Final report: {final_report}. Logged to {self.db_path}")
+
+
+@dataclasses.dataclass
+class RecordLog:
+    spec: Optional[dict]
+    events: List[Event]
+    final_report: Optional[Any]
+
+
+# Event types which are recorded once a sample has been fully evaluated.
+SAMPLE_COMPLETION_EVENT_TYPES = ("match", "metrics")
+
+
+def read_record_log(path: str) -> RecordLog:
+    """
+    Read a JSONL log written by `LocalRecorder` or `Recorder`.
+    """
+    spec, events, final_report = None, [], None
+    for row in _iter_record_log_rows(path):
+        if "spec" in row:
+            spec = row["spec"]
+        elif "final_report" in row:
+            final_report = row["final_report"]
+        else:
+            events.append(Event(**row))
+    return RecordLog(spec=spec, events=events, final_report=final_report)
+
+
+def iter_record_log_events(path: str) -> Iterator[Event]:
+    """Stream the events of a JSONL log written by `LocalRecorder` or `Recorder`."""
+    for row in _iter_record_log_rows(path):
+        if "spec" not in row and "final_report" not in row:
+            yield Event(**row)
+
+
+def _iter_record_log_rows(path: str) -> Iterator[dict]:
+    finished = False
+    for segment_path in [path, *_segment_paths(path)]:
+        # a finished log already includes its segments, if any are left over
+        if finished:
+            break
+        with open_blob_by_file_pattern(segment_path, "rb", streaming=True) as f:
+            for line in f:
+                if line.strip():
+                    row = jsonloads(line)
+                    finished = finished or "final_report" in row
+                    yield row
+
+
+def _is_remote_path(path: str) -> bool:
+    return "://" in path
+
+
+def _compression_extension(path: str) -> str:
+    return next((ext for ext in COMPRESSED_FILE_EXTENSIONS if path.endswith(ext)), "")
+
+
+def _encode_log_lines(path: str, rows: Sequence[Any]) -> bytes:
+    """Serialize `rows` as JSONL for the log at `path`, compressed as its extension says."""
+    data = b"".join(jsondumps_bytes(row) + b"\n" for row in rows)
+    return compress_by_file_pattern(path, data)
+
+
+def _segments_dir(path: str) -> str:
+    return path + ".parts"
+
+
+def _segment_path(path: str, index: int) -> str:
+    return bf.join(_segments_dir(path), f"part-{index:08d}.jsonl{_compression_extension(path)}")
+
+
+def _segment_paths(path: str) -> List[str]:
+    """Return the paths of the segments written for the log at `path`, in order."""
+    segments_dir = _segments_dir(path)
+    if not bf.isdir(segments_dir):
+        return []
+    names = sorted(name for name in bf.listdir(segments_dir) if name.startswith("part-"))
+    return [bf.join(segments_dir, name) for name in names]
+
+
+def run_spec_from_dict(spec: dict) -> RunSpec:
+    """Rebuild the `RunSpec` stored in a record log, keeping its original run id."""
+    run_spec = RunSpec(**spec)
+    run_spec.run_id = spec["run_id"]
+    run_spec.created_at = spec["created_at"]
+    return run_spec
+
+
+def completed_sample_ids(events: Sequence[Event]) -> set[str]:
+    """Return the ids of samples which have a completion (`match` or `metrics`) event."""
+    return {event.sample_id for event in events if event.type in SAMPLE_COMPLETION_EVENT_TYPES}
+
+
+def sample_index(sample_id: str) -> int:
+    """Return the sample index from a `<base_eval>.<split>.<index>` sample id."""
+    return int(sample_id.rsplit(".", 1)[1])
 
 
 #########################################################################
@@ -478,6 +1113,17 @@ def record_sampling(prompt, sampled, **extra):
     return default_recorder().record_sampling(prompt, sampled, **extra)
 
 
+def record_usage(model, latency, prompt_tokens=None, completion_tokens=None, retries=0, **extra):
+    return default_recorder().record_usage(
+        model,
+        latency,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        retries=retries,
+        **extra,
+    )
+
+
 def record_cond_logp(prompt, completion, logp, **extra):
     return default_recorder().record_cond_logp(prompt, completion, logp, **extra)
 
@@ -506,6 +1152,14 @@ def record_event(type, data=None, sample_id=None):
     return default_recorder().record_event(type, data, sample_id)
 
 
+def record_final_report_info(**info):
+    return default_recorder().record_final_report_info(**info)
+
+
+def increment_final_report_info(key: str, amount: int = 1):
+    return default_recorder().increment_final_report_info(key, amount)
+
+
 def pause():
     return default_recorder().pause()
 
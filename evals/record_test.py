@@ -0,0 +1,358 @@
+import dataclasses
+import gzip
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+
+import evals.record
+import evals.utils.snowflake
+from evals.base import RunSpec
+from evals.data import jsondumps, open_by_file_pattern
+from evals.record import (
+    Event,
+    LocalRecorder,
+    Recorder,
+    RecorderBase,
+    SQLiteRecorder,
+    completed_sample_ids,
+    read_record_log,
+    run_spec_from_dict,
+)
+
+
+def _run_spec():
+    return RunSpec(
+        completion_fns=["dummy"],
+        eval_name="test.s1",
+        base_eval="test",
+        split="s1",
+        run_config={},
+        created_by="",
+    )
+
+
+def test_resume_from_record_log(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    run_spec = _run_spec()
+    recorder = LocalRecorder(path, run_spec)
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+    recorder.record_match(True, sample_id="test.s1.0")
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.1")
+    recorder.flush_events()
+
+    record_log = read_record_log(path)
+    assert record_log.spec == dataclasses.asdict(run_spec)
+    completed = completed_sample_ids(record_log.events)
+    assert completed == {"test.s1.0"}
+
+    resumed_spec = run_spec_from_dict(record_log.spec)
+    assert resumed_spec.run_id == run_spec.run_id
+    resumed = LocalRecorder(path, resumed_spec, resume=True)
+    assert resumed.restore_completed_samples(record_log) == completed
+    resumed.record_match(False, sample_id="test.s1.1")
+    resumed.flush_events()
+
+    assert [e.data["correct"] for e in resumed.get_events("match")] == [True, False]
+    record_log = read_record_log(path)
+    assert record_log.spec is not None
+    # the sampling event of the incomplete sample is dropped, as it was evaluated again
+    assert [e.event_id for e in record_log.events] == [0, 1, 3]
+    assert completed_sample_ids(record_log.events) == {"test.s1.0", "test.s1.1"}
+
+
+def test_local_recorder_writes_in_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(evals.record, "MAX_QUEUED_EVENTS", 2)
+    monkeypatch.setattr(evals.record, "MAX_WRITE_BATCH_EVENTS", 1)
+    path = str(tmp_path / "log.jsonl")
+    recorder = LocalRecorder(path, _run_spec())
+    unblock = threading.Event()
+    write_batch = recorder._write_batch
+
+    def slow_write_batch(events):
+        unblock.wait()
+        write_batch(events)
+
+    recorder._write_batch = slow_write_batch
+    for i in range(3):
+        recorder.record_sampling("prompt", "sampled", sample_id=f"test.s1.{i}")
+    # the writer is stuck on the first event and the queue holds the next two
+    done = threading.Event()
+    threading.Thread(
+        target=lambda: (recorder.record_match(True, sample_id="test.s1.0"), done.set())
+    ).start()
+    try:
+        assert not done.wait(0.1)
+        assert read_record_log(path).events == []
+    finally:
+        unblock.set()
+    assert done.wait(5)
+    recorder.record_final_report({"accuracy": 1.0})
+    record_log = read_record_log(path)
+    assert [e.event_id for e in record_log.events] == [0, 1, 2, 3]
+    assert record_log.final_report == {"accuracy": 1.0}
+
+
+def test_local_recorder_raises_write_errors(tmp_path):
+    recorder = LocalRecorder(str(tmp_path / "log.jsonl"), _run_spec())
+
+    def failing_write_batch(events):
+        raise OSError("disk full")
+
+    recorder._write_batch = failing_write_batch
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+    with pytest.raises(OSError):
+        recorder.flush_events()
+    # the error is raised once, and the writer keeps going
+    recorder.flush_events()
+
+
+def test_events_are_indexed_by_type_and_column():
+    recorder = RecorderBase(_run_spec())
+    for i, correct in enumerate([True, False, True]):
+        recorder.record_sampling("prompt", "sampled", sample_id=f"test.s1.{i}")
+        recorder.record_match(correct, sample_id=f"test.s1.{i}")
+        recorder.record_event("metrics", {"score": None if i == 1 else i / 2}, f"test.s1.{i}")
+
+    assert [e.sample_id for e in recorder.get_events("match")] == [
+        "test.s1.0",
+        "test.s1.1",
+        "test.s1.2",
+    ]
+    assert recorder.get_events("embedding") == []
+    assert recorder.get_column("correct").tolist() == [1.0, 0.0, 1.0]
+    assert recorder.get_column("score").tolist() == [0.0, 1.0]
+    assert recorder.get_column("f1_score").tolist() == []
+
+
+def test_local_recorder_spills_events_to_log(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    recorder = LocalRecorder(path, _run_spec(), spill=True)
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+    recorder.record_match(True, sample_id="test.s1.0")
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.1")
+    recorder.flush_events()
+    assert recorder._events == []
+
+    resumed = LocalRecorder(path, run_spec_from_dict(read_record_log(path).spec), True, True)
+    resumed.restore_completed_samples(read_record_log(path))
+    resumed.record_sampling("prompt", "resampled", sample_id="test.s1.1")
+    resumed.record_match(False, sample_id="test.s1.1")
+
+    sampled = [(e.event_id, e.data["sampled"]) for e in resumed.get_events("sampling")]
+    assert sampled == [(0, "sampled"), (3, "resampled")]
+    assert [e.data["correct"] for e in resumed.get_events("match")] == [True, False]
+    assert resumed.get_column("correct").tolist() == [1.0, 0.0]
+    assert resumed.get_match_counts() == (1, 2)
+
+
+def test_segmented_local_recorder(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    recorder = LocalRecorder(path, _run_spec(), segmented=True)
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+    recorder.record_match(True, sample_id="test.s1.0")
+    recorder.flush_events()
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.1")
+    recorder.flush_events()
+
+    assert sorted(os.listdir(path + ".parts")) == ["part-00000000.jsonl", "part-00000001.jsonl"]
+    record_log = read_record_log(path)
+    assert [e.event_id for e in record_log.events] == [0, 1, 2]
+
+    resumed = LocalRecorder(path, run_spec_from_dict(record_log.spec), resume=True, segmented=True)
+    resumed.restore_completed_samples(record_log)
+    resumed.record_match(False, sample_id="test.s1.1")
+    resumed.record_final_report({"accuracy": 0.5})
+
+    assert not os.path.exists(path + ".parts")
+    record_log = read_record_log(path)
+    assert [e.event_id for e in record_log.events] == [0, 1, 3]
+    assert record_log.final_report == {"accuracy": 0.5}
+
+
+@pytest.mark.parametrize("extension", [".gz", ".lz4", ".zst"])
+@pytest.mark.parametrize("segmented", [False, True])
+def test_compressed_record_log(tmp_path, extension, segmented):
+    path = str(tmp_path / f"log.jsonl{extension}")
+    recorder = LocalRecorder(path, _run_spec(), segmented=segmented)
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+    recorder.flush_events()
+    recorder.record_match(True, sample_id="test.s1.0")
+    recorder.flush_events()
+    assert [e.event_id for e in read_record_log(path).events] == [0, 1]
+
+    recorder.record_final_report({"accuracy": 1.0})
+    with open_by_file_pattern(path, "rb") as f:
+        assert len(f.read().splitlines()) == 4
+    record_log = read_record_log(path)
+    assert [e.type for e in record_log.events] == ["sampling", "match"]
+    assert record_log.final_report == {"accuracy": 1.0}
+
+
+@pytest.mark.parametrize("encoder", ["orjson", "json"])
+def test_event_to_json(monkeypatch, encoder):
+    monkeypatch.setenv("EVALS_JSON_ENCODER", encoder)
+    event = Event(
+        run_id="run",
+        event_id=0,
+        sample_id="test.s1.0",
+        type="metrics",
+        data={"score": np.float64(0.5), "spec": _run_spec(), "text": "naïve"},
+        created_by="",
+        created_at="now",
+    )
+    expected = {**dataclasses.asdict(event), "data": json.loads(jsondumps(event.data))}
+    assert json.loads(event.to_json()) == expected
+
+    event.cache_data_json()
+    event.data = None
+    assert json.loads(event.to_json()) == expected
+
+
+class FakeSnowflakeConnection:
+    """Stands in for `SnowflakeConnection`, loading staged files into an events list."""
+
+    def __init__(self):
+        self.commands = []
+        self.staged = {}
+        self.staged_paths = []
+        self.events = []
+        self.failures = 0
+
+    def robust_query(self, max_trials=None, command="", params=None, seqparams=None, many=False):
+        command = command.strip()
+        if command.startswith(("PUT", "INSERT INTO events")) and self.failures:
+            self.failures -= 1
+            raise ConnectionError("Snowflake is down")
+        self.commands.append(command.split()[0])
+        if command.startswith("PUT"):
+            path, stage = re.search(r"'file://(.*?)' (\S+)", command).groups()
+            self.staged_paths.append(stage + os.path.basename(path))
+            with gzip.open(path) as f:
+                self.staged[stage + os.path.basename(path)] = [json.loads(line) for line in f]
+        elif command.startswith("COPY INTO events"):
+            stage = re.search(r"FROM \(SELECT .* FROM (\S+)\)", command).group(1)
+            name = re.search(r"FILES = \('(.*?)'\)", command).group(1)
+            self.events.extend(self.staged.pop(stage + name))
+        elif command.startswith("INSERT INTO events"):
+            self.events.extend({"run_id": row[0], "event_id": row[1]} for row in seqparams)
+
+
+def test_snowflake_bulk_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(evals.utils.snowflake, "backoff_delay", lambda attempt: 0.01)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    path = str(tmp_path / "log.jsonl")
+    conn = FakeSnowflakeConnection()
+    conn.failures = 2
+    recorder = Recorder(path, _run_spec(), snowflake_connection=conn, bulk_load=True)
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+    recorder.record_match(True, sample_id="test.s1.0")
+    # the final report submits the remaining events, and waits for them to be uploaded
+    final_report = {"accuracy": 1.0}
+    recorder.record_final_report(final_report)
+
+    assert conn.commands == ["INSERT", "PUT", "COPY", "UPDATE"]
+    assert [(e["event_id"], e["type"]) for e in conn.events] == [(0, "sampling"), (1, "match")]
+    assert conn.events[1]["data"]["correct"] is True
+    assert final_report["snowflake/ingest_complete"] is True
+    assert final_report["snowflake/upload_failures"] == 2
+    record_log = read_record_log(path)
+    assert [e.event_id for e in record_log.events] == [0, 1]
+    assert record_log.final_report == final_report
+
+
+def test_snowflake_bulk_load_stages_files_per_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    conn = FakeSnowflakeConnection()
+    recorders = [
+        Recorder(
+            str(tmp_path / f"log{i}.jsonl"), _run_spec(), snowflake_connection=conn, bulk_load=True
+        )
+        for i in range(2)
+    ]
+    for recorder in recorders:
+        recorder.record_match(True, sample_id="test.s1.0")
+        recorder.record_final_report({})
+
+    # both runs spool their first batch as 00000000.jsonl.gz, but stage it under their run ID
+    run_ids = [recorder.run_spec.run_id for recorder in recorders]
+    assert conn.staged_paths == [f"@%events/{run_id}/00000000.jsonl.gz" for run_id in run_ids]
+    assert [e["run_id"] for e in conn.events] == run_ids
+
+
+def test_snowflake_insert_retries_skip_inserted_rows(tmp_path, monkeypatch):
+    # one row per insert
+    monkeypatch.setattr(evals.record, "MAX_SNOWFLAKE_BYTES", 80)
+    monkeypatch.setattr(evals.utils.snowflake, "backoff_delay", lambda attempt: 0.01)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    conn = FakeSnowflakeConnection()
+    recorder = Recorder(str(tmp_path / "log.jsonl"), _run_spec(), snowflake_connection=conn)
+    inserted = []
+
+    def robust_query(max_trials=None, command="", **kwargs):
+        # fail the insert of the second row once, after the first was inserted
+        if command.strip().startswith("INSERT INTO events"):
+            inserted.append(kwargs["seqparams"][0][1])
+            if inserted == [0, 1]:
+                raise ConnectionError("Snowflake is down")
+        FakeSnowflakeConnection.robust_query(conn, max_trials, command, **kwargs)
+
+    conn.robust_query = robust_query
+    recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+    recorder.record_match(True, sample_id="test.s1.0")
+    final_report = {}
+    recorder.record_final_report(final_report)
+
+    assert inserted == [0, 1, 1]
+    assert [e["event_id"] for e in conn.events] == [0, 1]
+    assert final_report["snowflake/upload_failures"] == 1
+
+
+def test_snowflake_uploads_fall_back_to_local_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(evals.record, "MAX_PENDING_SNOWFLAKE_UPLOADS", 1)
+    monkeypatch.setattr(evals.record, "SNOWFLAKE_DRAIN_SECONDS", 0.1)
+    monkeypatch.setattr(evals.utils.snowflake, "backoff_delay", lambda attempt: 3600)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    path = str(tmp_path / "log.jsonl")
+    conn = FakeSnowflakeConnection()
+    conn.failures = 10**6
+    recorder = Recorder(path, _run_spec(), snowflake_connection=conn, bulk_load=True)
+    for i in range(3):
+        recorder.record_match(True, sample_id=f"test.s1.{i}")
+        recorder.flush_events()
+    final_report = {}
+    recorder.record_final_report(final_report)
+
+    assert conn.events == []
+    assert final_report["snowflake/ingest_complete"] is False
+    assert final_report["snowflake/pending_batches"] == 1
+    assert final_report["snowflake/dropped_batches"] == 2
+    assert [e.event_id for e in read_record_log(path).events] == [0, 1, 2]
+
+
+def test_sqlite_recorder(tmp_path):
+    db_path = str(tmp_path / "evals.sqlite")
+    recorders = [SQLiteRecorder(db_path, _run_spec()) for _ in range(2)]
+    for i, recorder in enumerate(recorders):
+        recorder.record_sampling("prompt", "sampled", sample_id="test.s1.0")
+        recorder.record_match(i == 0, sample_id="test.s1.0")
+        recorder.record_event("metrics", {"score": i}, sample_id="test.s1.0")
+
+    recorder = recorders[1]
+    matches = recorder.get_events("match")
+    assert [(e.event_id, e.data["correct"]) for e in matches] == [(1, False)]
+    assert matches[0].run_id == recorder.run_spec.run_id
+    assert recorder.get_metrics() == [{"score": 1}]
+    assert recorder.get_match_counts() == (0, 1)
+    recorder.record_final_report({"accuracy": 0.0})
+    recorders[0].flush_events()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM events").fetchone() == (6,)
+    final_reports = conn.execute("SELECT final_report FROM runs ORDER BY final_report").fetchall()
+    assert final_reports == [(None,), ('{"accuracy": 0.0}',)]
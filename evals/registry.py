@@ -20,6 +20,8 @@ import yaml
 from evals import OpenAIChatCompletionFn, OpenAICompletionFn
 from evals.api import CompletionFn, DummyCompletionFn
 from evals.base import BaseEvalSpec, CompletionFnSpec, EvalSetSpec, EvalSpec
+from evals.completion_fns.openai import OpenAIBaseCompletionFn
+from evals.completion_fns.replay import ReplayCompletionFn
 from evals.elsuite.modelgraded.base import ModelGradedSpec
 from evals.utils.misc import make_object
 
@@ -29,12 +31,15 @@ DEFAULT_PATHS = [Path(__file__).parents[0].resolve() / "registry", Path.home() /
 
 
 def n_ctx_from_model_name(model_name: str) -> Optional[int]:
-    """Returns n_ctx for a given API model name. Model list last updated 2023-03-14."""
+    """Returns n_ctx for a given API model name, or None if it isn't known."""
     # note that for most models, the max tokens is n_ctx + 1
     DICT_OF_N_CTX_BY_MODEL_NAME_PREFIX: dict[str, int] = {
+        "gpt-3.5-turbo-16k-": 16384,
         "gpt-3.5-turbo-": 4096,
-        "gpt-4-": 8192,
         "gpt-4-32k-": 32768,
+        "gpt-4-turbo-": 128000,
+        "gpt-4o-": 128000,
+        "gpt-4-": 8192,
     }
     DICT_OF_N_CTX_BY_MODEL_NAME: dict[str, int] = {
         "ada": 2048,
@@ -50,17 +55,29 @@ def n_ctx_from_model_name(model_name: str) -> Optional[int]:
         "text-davinci-003": 4096,
         "gpt-3.5-turbo": 4096,
         "gpt-3.5-turbo-0301": 4096,
+        "gpt-3.5-turbo-0613": 4096,
+        "gpt-3.5-turbo-16k": 16384,
+        "gpt-3.5-turbo-1106": 16385,
+        "gpt-3.5-turbo-0125": 16385,
         "gpt-4": 8192,
         "gpt-4-0314": 8192,
+        "gpt-4-0613": 8192,
         "gpt-4-32k": 32768,
         "gpt-4-32k-0314": 32768,
+        "gpt-4-32k-0613": 32768,
+        "gpt-4-1106-preview": 128000,
+        "gpt-4-0125-preview": 128000,
+        "gpt-4-turbo": 128000,
+        "gpt-4o": 128000,
     }
-    # first, look for a prefix match
-    for model_prefix, n_ctx in DICT_OF_N_CTX_BY_MODEL_NAME_PREFIX.items():
+    # first, look for an exact match
+    if model_name in DICT_OF_N_CTX_BY_MODEL_NAME:
+        return DICT_OF_N_CTX_BY_MODEL_NAME[model_name]
+    # otherwise, look for the longest prefix match and return None if not found
+    for model_prefix in sorted(DICT_OF_N_CTX_BY_MODEL_NAME_PREFIX, key=len, reverse=True):
         if model_name.startswith(model_prefix):
-            return n_ctx
-    # otherwise, look for an exact match and return None if not found
-    return DICT_OF_N_CTX_BY_MODEL_NAME.get(model_name, None)
+            return DICT_OF_N_CTX_BY_MODEL_NAME_PREFIX[model_prefix]
+    return None
 
 
 class Registry:
@@ -79,11 +96,17 @@ class Registry:
         Create a CompletionFn. The name can be one of the following formats:
         1. openai-model-id (e.g. "gpt-3.5-turbo")
         2. completion-fn-id (from the registry)
+        3. "replay:" or "replay-strict:" followed by the path (or glob) of record logs
+           to replay completions from (e.g. "replay:/tmp/evallogs/*.jsonl")
         """
 
         if name == "dummy":
             return DummyCompletionFn()
 
+        if name.startswith(("replay:", "replay-strict:")):
+            kind, record_paths = name.split(":", 1)
+            return ReplayCompletionFn(record_paths, strict=kind == "replay-strict")
+
         n_ctx = n_ctx_from_model_name(name)
 
         CHAT_MODELS = {
@@ -110,6 +133,8 @@ class Registry:
         spec.args["registry"] = self
         instance = make_object(spec.cls)(**spec.args or {})
         assert isinstance(instance, CompletionFn), f"{name} must be a CompletionFn"
+        if isinstance(instance, OpenAIBaseCompletionFn) and instance.name is None:
+            instance.name = name
         return instance
 
     def get_class(self, spec: dict) -> Any:
@@ -0,0 +1,14 @@
+from evals.registry import n_ctx_from_model_name
+
+
+def test_n_ctx_from_model_name():
+    assert n_ctx_from_model_name("gpt-3.5-turbo") == 4096
+    assert n_ctx_from_model_name("gpt-3.5-turbo-0613") == 4096
+    assert n_ctx_from_model_name("gpt-3.5-turbo-16k") == 16384
+    assert n_ctx_from_model_name("gpt-3.5-turbo-16k-0613") == 16384
+    assert n_ctx_from_model_name("gpt-4-0613") == 8192
+    assert n_ctx_from_model_name("gpt-4-32k-0314") == 32768
+    assert n_ctx_from_model_name("gpt-4-32k-0613") == 32768
+    assert n_ctx_from_model_name("gpt-4-1106-preview") == 128000
+    assert n_ctx_from_model_name("text-davinci-003") == 4096
+    assert n_ctx_from_model_name("unknown-model") is None
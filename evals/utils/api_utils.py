@@ -1,73 +1,519 @@
 """
 This file defines various helper functions for interacting with the OpenAI API.
 """
-import concurrent
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
 import logging
 import os
+import time
+from typing import Any, Callable, Optional
 
 import backoff
 import openai
 
+from evals.utils.concurrency import active_concurrency_controller
+from evals.utils.hedging import HedgingPolicy
+from evals.utils.rate_limiter import estimate_request_tokens, get_rate_limiter
+
 EVALS_THREAD_TIMEOUT = float(os.environ.get("EVALS_THREAD_TIMEOUT", "40"))
+EVALS_MAX_TIMEOUT_RETRIES = int(os.environ.get("EVALS_MAX_TIMEOUT_RETRIES", "5"))
+EVALS_REQUEST_WORKERS = int(os.environ.get("EVALS_REQUEST_WORKERS", "256"))
+
+OPENAI_RETRY_EXCEPTIONS = (
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.RateLimitError,
+    openai.error.APIConnectionError,
+)
+
+# Errors which indicate we are sending requests faster than the API can serve them.
+OPENAI_CONGESTION_EXCEPTIONS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+)
+
+
+# The retry counter of the completion fn call in progress, if it's counting them.
+_retry_counter: contextvars.ContextVar[Optional[list[int]]] = contextvars.ContextVar(
+    "retry_counter", default=None
+)
+
+
+# The `time.perf_counter()` deadline of the sample being evaluated, if it has one.
+_sample_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "sample_deadline", default=None
+)
+
+
+class SampleDeadlineExceeded(Exception):
+    """Raised instead of making a request for a sample which has missed its deadline."""
+
+
+@contextlib.contextmanager
+def sample_deadline(timeout: float):
+    """
+    Give the requests made within this context `timeout` seconds in total. Once that
+    has passed, they raise `SampleDeadlineExceeded`, which isn't retried, so that an
+    abandoned sample stops making requests.
+    """
+    token = _sample_deadline.set(time.perf_counter() + timeout)
+    try:
+        yield
+    finally:
+        _sample_deadline.reset(token)
+
+
+def _bound_by_sample_deadline(timeout: float) -> float:
+    deadline = _sample_deadline.get()
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        raise SampleDeadlineExceeded("The sample missed its deadline")
+    return min(timeout, remaining)
+
+
+@contextlib.contextmanager
+def count_retries():
+    """Count the API request retries made within this context, in `counter[0]`."""
+    counter = [0]
+    token = _retry_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _retry_counter.reset(token)
+
+
+def on_request_retry(exception: Optional[BaseException]):
+    """
+    Note that a request is being retried after `exception`: count it, and report
+    congestion to the active concurrency controller. Called for the retries made by the
+    helpers below, and by callers which retry requests themselves.
+    """
+    counter = _retry_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    controller = active_concurrency_controller()
+    if controller is not None and isinstance(exception, OPENAI_CONGESTION_EXCEPTIONS):
+        controller.on_congestion(type(exception).__name__)
+
+
+def on_request_success():
+    controller = active_concurrency_controller()
+    if controller is not None:
+        controller.on_success()
+
+
+def _on_backoff(details):
+    on_request_retry(details.get("exception"))
+
+
+def _on_success(details):
+    on_request_success()
+
 
+# Other API errors are retried indefinitely, with exponential backoff.
+_retry_on_api_error = backoff.on_exception(
+    wait_gen=backoff.expo,
+    exception=OPENAI_RETRY_EXCEPTIONS,
+    max_value=60,
+    factor=1.5,
+    on_backoff=_on_backoff,
+    on_success=_on_success,
+)
 
-@backoff.on_exception(
+# Timeouts are only retried `EVALS_MAX_TIMEOUT_RETRIES` times, so a request which
+# keeps hanging fails its sample instead of holding up the run.
+_retry_on_timeout = backoff.on_exception(
     wait_gen=backoff.expo,
-    exception=(
-        openai.error.ServiceUnavailableError,
-        openai.error.APIError,
-        openai.error.RateLimitError,
-        openai.error.APIConnectionError,
-        openai.error.Timeout,
-    ),
+    exception=openai.error.Timeout,
+    max_tries=EVALS_MAX_TIMEOUT_RETRIES + 1,
     max_value=60,
     factor=1.5,
+    on_backoff=_on_backoff,
 )
+
+# Hedging of slow requests, configured by `EVALS_HEDGE_PERCENTILE` (off by default).
+hedging_policy = HedgingPolicy.from_env()
+
+_request_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=EVALS_REQUEST_WORKERS, thread_name_prefix="evals-request"
+)
+
+
+def _acquire_rate_limit(kwargs):
+    """Wait for rate-limit budget for the request described by `kwargs`, if limited."""
+    limiter = get_rate_limiter(kwargs.get("model"))
+    if limiter is None:
+        return None, 0
+    estimated_tokens = estimate_request_tokens(kwargs)
+    limiter.acquire(estimated_tokens)
+    return limiter, estimated_tokens
+
+
+async def _aacquire_rate_limit(kwargs):
+    limiter = get_rate_limiter(kwargs.get("model"))
+    if limiter is None:
+        return None, 0
+    estimated_tokens = estimate_request_tokens(kwargs)
+    await limiter.aacquire(estimated_tokens)
+    return limiter, estimated_tokens
+
+
+def _reconcile_rate_limit(limiter, estimated_tokens, result):
+    if limiter is not None and "usage" in result:
+        limiter.reconcile(estimated_tokens, result["usage"]["total_tokens"])
+
+
+def openai_completion_create(*args, **kwargs):
+    """Makes a single attempt at `openai_completion_create_retrying`, without retrying."""
+    limiter, estimated_tokens = _acquire_rate_limit(kwargs)
+    result = request_with_timeout(openai.Completion.create, *args, **with_request_timeout(kwargs))
+    _reconcile_rate_limit(limiter, estimated_tokens, result)
+    if "error" in result:
+        logging.warning(result)
+        raise openai.error.APIError(result["error"])
+    return result
+
+
+@_retry_on_api_error
+@_retry_on_timeout
 def openai_completion_create_retrying(*args, **kwargs):
     """
     Helper function for creating a completion.
     `args` and `kwargs` match what is accepted by `openai.Completion.create`.
     """
-    result = openai.Completion.create(*args, **kwargs)
-    if "error" in result:
-        logging.warning(result)
-        raise openai.error.APIError(result["error"])
-    return result
+    return openai_completion_create(*args, **kwargs)
 
 
 def request_with_timeout(func, *args, timeout=EVALS_THREAD_TIMEOUT, **kwargs):
     """
-    Worker thread for making a single request within allotted time.
+    Make a single request on the shared request worker pool, allowing it `timeout`
+    seconds from when it was submitted (less if its sample's deadline comes first, see
+    `sample_deadline`). A request which takes longer is abandoned (its worker is freed
+    when the underlying HTTP request times out, see `with_request_timeout`, and a
+    request still queued is dropped) and `openai.error.Timeout` is raised to be retried.
+
+    If hedging is enabled (see `HedgingPolicy`), a request which runs long is sent
+    again, and the result of whichever copy finishes first is returned.
     """
-    while True:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(func, *args, **kwargs)
-            try:
-                result = future.result(timeout=timeout)
-                return result
-            except concurrent.futures.TimeoutError as e:
-                continue
+    timeout = _bound_by_sample_deadline(timeout)
+    start = time.perf_counter()
+    future = _request_executor.submit(func, *args, **kwargs)
+    if hedging_policy is None:
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError as e:
+            future.cancel()
+            raise openai.error.Timeout(f"Request timed out after {timeout}s") from e
 
+    model = kwargs.get("model")
+    futures = [future]
+    delay = hedging_policy.hedge_delay(model)
+    if delay is not None and delay < timeout:
+        done, _ = concurrent.futures.wait(futures, timeout=delay)
+        if not done and hedging_policy.try_hedge():
+            logging.debug(f"Hedging a request to {model} after {delay:.2f}s")
+            futures.append(_request_executor.submit(func, *args, **kwargs))
 
-@backoff.on_exception(
-    wait_gen=backoff.expo,
-    exception=(
-        openai.error.ServiceUnavailableError,
-        openai.error.APIError,
-        openai.error.RateLimitError,
-        openai.error.APIConnectionError,
-        openai.error.Timeout,
-    ),
-    max_value=60,
-    factor=1.5,
-)
+    # the first copy to succeed wins; the other is left to finish and discarded
+    pending, error = set(futures), None
+    while pending:
+        remaining = timeout - (time.perf_counter() - start)
+        done, pending = concurrent.futures.wait(
+            pending, timeout=max(remaining, 0), return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        if not done:
+            for f in pending:
+                f.cancel()
+            raise openai.error.Timeout(f"Request timed out after {timeout}s")
+        for f in done:
+            if f.exception() is None:
+                _on_hedged_request_done(model, start, hedged=f is not future)
+                return f.result()
+            error = f.exception()
+    raise error
+
+
+def _on_hedged_request_done(model, start, hedged):
+    hedging_policy.record_latency(model, time.perf_counter() - start)
+    if hedged:
+        hedging_policy.on_hedge_won()
+
+
+def with_request_timeout(kwargs: dict, timeout: float = EVALS_THREAD_TIMEOUT) -> dict:
+    """
+    Have the OpenAI client itself time out HTTP requests which run longer than
+    `timeout`, unless the caller set its own `request_timeout`.
+    """
+    return {"request_timeout": timeout, **kwargs}
+
+
+def openai_chat_completion_create(*args, **kwargs):
+    """Makes a single attempt at `openai_chat_completion_create_retrying`, without retrying."""
+    limiter, estimated_tokens = _acquire_rate_limit(kwargs)
+    result = request_with_timeout(
+        openai.ChatCompletion.create, *args, **with_request_timeout(kwargs)
+    )
+    _reconcile_rate_limit(limiter, estimated_tokens, result)
+    if "error" in result:
+        logging.warning(result)
+        raise openai.error.APIError(result["error"])
+    return result
+
+
+@_retry_on_api_error
+@_retry_on_timeout
 def openai_chat_completion_create_retrying(*args, **kwargs):
     """
     Helper function for creating a chat completion.
     `args` and `kwargs` match what is accepted by `openai.ChatCompletion.create`.
     """
-    result = request_with_timeout(openai.ChatCompletion.create, *args, **kwargs)
+    return openai_chat_completion_create(*args, **kwargs)
+
+
+async def openai_completion_acreate(*args, **kwargs):
+    """Makes a single attempt at `openai_completion_acreate_retrying`, without retrying."""
+    limiter, estimated_tokens = await _aacquire_rate_limit(kwargs)
+    result = await arequest_with_timeout(
+        openai.Completion.acreate, *args, **with_request_timeout(kwargs)
+    )
+    _reconcile_rate_limit(limiter, estimated_tokens, result)
+    if "error" in result:
+        logging.warning(result)
+        raise openai.error.APIError(result["error"])
+    return result
+
+
+@_retry_on_api_error
+@_retry_on_timeout
+async def openai_completion_acreate_retrying(*args, **kwargs):
+    """
+    Async counterpart of `openai_completion_create_retrying`.
+    `args` and `kwargs` match what is accepted by `openai.Completion.acreate`.
+    """
+    return await openai_completion_acreate(*args, **kwargs)
+
+
+async def arequest_with_timeout(afunc, *args, timeout=EVALS_THREAD_TIMEOUT, **kwargs):
+    """
+    Await a single request `afunc(*args, **kwargs)` within allotted time, raising
+    `openai.error.Timeout` (which is retried) if it takes longer. Like
+    `request_with_timeout`, long requests are hedged if hedging is enabled.
+    """
+    if hedging_policy is None:
+        try:
+            return await asyncio.wait_for(afunc(*args, **kwargs), timeout=timeout)
+        except asyncio.TimeoutError as e:
+            raise openai.error.Timeout(f"Request timed out after {timeout}s") from e
+
+    start = time.perf_counter()
+    model = kwargs.get("model")
+    first = asyncio.ensure_future(afunc(*args, **kwargs))
+    pending = {first}
+    try:
+        delay = hedging_policy.hedge_delay(model)
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and hedging_policy.try_hedge():
+                logging.debug(f"Hedging a request to {model} after {delay:.2f}s")
+                pending.add(asyncio.ensure_future(afunc(*args, **kwargs)))
+
+        error = None
+        while pending:
+            remaining = timeout - (time.perf_counter() - start)
+            done, pending = await asyncio.wait(
+                pending, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                raise openai.error.Timeout(f"Request timed out after {timeout}s")
+            for task in done:
+                if task.exception() is None:
+                    _on_hedged_request_done(model, start, hedged=task is not first)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # unlike threads, the losing copy can be cancelled
+        for task in pending:
+            task.cancel()
+
+
+async def openai_chat_completion_acreate(*args, **kwargs):
+    """Makes a single attempt at `openai_chat_completion_acreate_retrying`, without retrying."""
+    limiter, estimated_tokens = await _aacquire_rate_limit(kwargs)
+    result = await arequest_with_timeout(
+        openai.ChatCompletion.acreate, *args, **with_request_timeout(kwargs)
+    )
+    _reconcile_rate_limit(limiter, estimated_tokens, result)
     if "error" in result:
         logging.warning(result)
         raise openai.error.APIError(result["error"])
     return result
+
+
+@_retry_on_api_error
+@_retry_on_timeout
+async def openai_chat_completion_acreate_retrying(*args, **kwargs):
+    """
+    Async counterpart of `openai_chat_completion_create_retrying`.
+    `args` and `kwargs` match what is accepted by `openai.ChatCompletion.acreate`.
+    """
+    return await openai_chat_completion_acreate(*args, **kwargs)
+
+
+class StreamAssembler:
+    """
+    Assembles the chunks of a streamed (`stream=True`) completion or chat completion
+    into the response the API would have returned without streaming, timing the
+    chunks as they arrive.
+
+    If `abort_stream` is given, it's called with the text of each choice generated so
+    far, and the stream is abandoned once it returns True for all `n` choices.
+    """
+
+    def __init__(
+        self, start: float, n: int = 1, abort_stream: Optional[Callable[[str], bool]] = None
+    ):
+        self.start = start
+        self.n = n
+        self.abort_stream = abort_stream
+        self.response: dict[str, Any] = {}
+        self.texts: dict[int, list[str]] = {}
+        self.finish_reasons: dict[int, Optional[str]] = {}
+        self.is_chat = False
+        self.token_times: list[float] = []
+        self.aborted = False
+
+    def add(self, chunk: Any) -> bool:
+        """Add a chunk, returning whether the rest of the stream can be abandoned."""
+        now = time.perf_counter()
+        if not self.response:
+            self.response = {k: v for k, v in chunk.items() if k != "choices"}
+        has_text = False
+        for choice in chunk["choices"]:
+            index = choice["index"]
+            if "delta" in choice:
+                self.is_chat = True
+                text = choice["delta"].get("content") or ""
+            else:
+                text = choice.get("text") or ""
+            self.texts.setdefault(index, []).append(text)
+            self.finish_reasons[index] = choice.get("finish_reason")
+            has_text = has_text or bool(text)
+        if has_text:
+            self.token_times.append(now)
+        if self.abort_stream is None or len(self.texts) < self.n:
+            return False
+        self.aborted = all(self.abort_stream("".join(text)) for text in self.texts.values())
+        return self.aborted
+
+    def result(self) -> dict[str, Any]:
+        choices = []
+        for index, text in sorted(self.texts.items()):
+            finish_reason = self.finish_reasons[index]
+            if finish_reason is None and self.aborted:
+                finish_reason = "aborted"
+            if self.is_chat:
+                choice = {"message": {"role": "assistant", "content": "".join(text)}}
+            else:
+                choice = {"text": "".join(text), "logprobs": None}
+            choices.append({"index": index, **choice, "finish_reason": finish_reason})
+        gaps = [b - a for a, b in zip(self.token_times, self.token_times[1:])]
+        stream_stats = {
+            "time_to_first_token": self.token_times[0] - self.start if self.token_times else None,
+            "inter_token_latency": sum(gaps) / len(gaps) if gaps else None,
+            "aborted": self.aborted,
+        }
+        return {**self.response, "choices": choices, "stream_stats": stream_stats}
+
+
+def _create_and_assemble_stream(api_resource, abort_stream, *args, **kwargs):
+    start = time.perf_counter()
+    chunks = api_resource.create(*args, stream=True, **kwargs)
+    assembler = StreamAssembler(start, kwargs.get("n", 1), abort_stream)
+    try:
+        for chunk in chunks:
+            if assembler.add(chunk):
+                break
+    finally:
+        chunks.close()
+    return assembler.result()
+
+
+def openai_create_streaming(api_resource, *args, abort_stream=None, **kwargs):
+    """Makes a single attempt at `openai_create_streaming_retrying`, without retrying."""
+    limiter, estimated_tokens = _acquire_rate_limit(kwargs)
+    result = request_with_timeout(
+        _create_and_assemble_stream,
+        api_resource,
+        abort_stream,
+        *args,
+        **with_request_timeout(kwargs),
+    )
+    _reconcile_rate_limit(limiter, estimated_tokens, result)
+    return result
+
+
+@_retry_on_api_error
+@_retry_on_timeout
+def openai_create_streaming_retrying(api_resource, *args, abort_stream=None, **kwargs):
+    """
+    Helper function for streaming a completion from `api_resource` (`openai.Completion`
+    or `openai.ChatCompletion`), assembled with `StreamAssembler`. The timeout applies
+    to the whole stream. `args` and `kwargs` match what is accepted by its `create`.
+    """
+    return openai_create_streaming(api_resource, *args, abort_stream=abort_stream, **kwargs)
+
+
+async def _acreate_and_assemble_stream(api_resource, abort_stream, *args, **kwargs):
+    start = time.perf_counter()
+    chunks = await api_resource.acreate(*args, stream=True, **kwargs)
+    assembler = StreamAssembler(start, kwargs.get("n", 1), abort_stream)
+    try:
+        async for chunk in chunks:
+            if assembler.add(chunk):
+                break
+    finally:
+        await chunks.aclose()
+    return assembler.result()
+
+
+async def openai_acreate_streaming(api_resource, *args, abort_stream=None, **kwargs):
+    """Makes a single attempt at `openai_acreate_streaming_retrying`, without retrying."""
+    limiter, estimated_tokens = await _aacquire_rate_limit(kwargs)
+    result = await arequest_with_timeout(
+        _acreate_and_assemble_stream,
+        api_resource,
+        abort_stream,
+        *args,
+        **with_request_timeout(kwargs),
+    )
+    _reconcile_rate_limit(limiter, estimated_tokens, result)
+    return result
+
+
+@_retry_on_api_error
+@_retry_on_timeout
+async def openai_acreate_streaming_retrying(api_resource, *args, abort_stream=None, **kwargs):
+    """Async counterpart of `openai_create_streaming_retrying`."""
+    return await openai_acreate_streaming(api_resource, *args, abort_stream=abort_stream, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def openai_aiosession(limit: int):
+    """
+    Share one aiohttp session (with a connection pool of size `limit`) across all
+    async OpenAI requests made within this context, instead of opening a new
+    session per request.
+    """
+    import aiohttp
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit)) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
@@ -0,0 +1,107 @@
+import concurrent.futures
+import threading
+import time
+import types
+
+import backoff
+import openai
+import pytest
+
+from evals.api import is_match_decided
+from evals.utils import api_utils
+from evals.utils.api_utils import StreamAssembler
+
+
+def _chat_chunk(content=None, finish_reason=None, index=0):
+    delta = {} if content is None else {"content": content}
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "model": "gpt-3.5-turbo",
+        "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def test_stream_assembler_chat():
+    assembler = StreamAssembler(time.perf_counter())
+    for chunk in [
+        {**_chat_chunk(), "choices": [{"index": 0, "delta": {"role": "assistant"}}]},
+        _chat_chunk("Hello"),
+        _chat_chunk(", world"),
+        _chat_chunk(finish_reason="stop"),
+    ]:
+        assert not assembler.add(chunk)
+    result = assembler.result()
+    assert result["id"] == "chatcmpl-1"
+    assert result["choices"] == [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "Hello, world"},
+            "finish_reason": "stop",
+        }
+    ]
+    assert result["stream_stats"]["time_to_first_token"] > 0
+    assert result["stream_stats"]["inter_token_latency"] >= 0
+    assert not result["stream_stats"]["aborted"]
+
+
+def test_stream_assembler_completion_abort():
+    assembler = StreamAssembler(
+        time.perf_counter(), n=2, abort_stream=lambda text: is_match_decided(text, ["15"])
+    )
+    chunks = [
+        {"choices": [{"index": 0, "text": "1", "finish_reason": None}]},
+        {"choices": [{"index": 1, "text": "Fif", "finish_reason": None}]},
+        {"choices": [{"index": 0, "text": "5 years", "finish_reason": None}]},
+    ]
+    assert [assembler.add(chunk) for chunk in chunks] == [False, False, True]
+    result = assembler.result()
+    assert [choice["text"] for choice in result["choices"]] == ["15 years", "Fif"]
+    assert [choice["finish_reason"] for choice in result["choices"]] == ["aborted", "aborted"]
+
+
+def test_is_match_decided():
+    assert not is_match_decided("", ["15"])
+    assert not is_match_decided("1", ["15", "20"])
+    assert is_match_decided("15", ["15"])
+    assert is_match_decided("3", ["15", "20"])
+    assert is_match_decided("time", "time")
+
+
+def test_timeouts_are_retried_a_limited_number_of_times(monkeypatch):
+    calls = []
+
+    def timeout(*args, **kwargs):
+        calls.append(kwargs)
+        raise openai.error.Timeout("Request timed out")
+
+    monkeypatch.setattr(api_utils, "openai_completion_create", timeout)
+    monkeypatch.setattr(backoff._sync, "time", types.SimpleNamespace(sleep=lambda seconds: None))
+    with pytest.raises(openai.error.Timeout):
+        api_utils.openai_completion_create_retrying(model="davinci", prompt="")
+    assert len(calls) == api_utils.EVALS_MAX_TIMEOUT_RETRIES + 1
+
+
+def test_request_timeout_counts_from_submission(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(
+        api_utils,
+        "_request_executor",
+        concurrent.futures.ThreadPoolExecutor(max_workers=1),
+    )
+    # occupy the only worker, so the request stays queued
+    api_utils._request_executor.submit(release.wait, 5)
+    try:
+        start = time.perf_counter()
+        with pytest.raises(openai.error.Timeout):
+            api_utils.request_with_timeout(lambda: "response", timeout=0.1)
+        assert time.perf_counter() - start < 1
+    finally:
+        release.set()
+
+
+def test_requests_share_the_sample_deadline():
+    with api_utils.sample_deadline(0):
+        with pytest.raises(api_utils.SampleDeadlineExceeded):
+            api_utils.request_with_timeout(lambda: "response")
+    assert api_utils.request_with_timeout(lambda: "response") == "response"
@@ -0,0 +1,201 @@
+"""
+This file defines micro-batching of legacy Completion requests: concurrent calls with
+the same sampling kwargs are collected for a few milliseconds and sent as a single
+multi-prompt request, whose choices are then split back to each caller.
+"""
+import asyncio
+import concurrent.futures
+import json
+import threading
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from evals.prompt.base import OpenAICreatePrompt, num_tokens_from_prompt
+
+# The Completion API accepts at most 20 prompts per request.
+MAX_PROMPTS_PER_REQUEST = 20
+
+
+def is_batchable(prompt: OpenAICreatePrompt) -> bool:
+    """A single prompt (a string or list of tokens) can be batched with others."""
+    return isinstance(prompt, str) or (
+        isinstance(prompt, list) and bool(prompt) and all(isinstance(t, int) for t in prompt)
+    )
+
+
+def _split_tokens(total: int, weights: list[int]) -> list[int]:
+    """Split `total` tokens in proportion to `weights` into whole parts summing to `total`."""
+    if sum(weights) == 0:
+        weights = [1] * len(weights)
+    shares = [total * weight / sum(weights) for weight in weights]
+    parts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(shares)), key=lambda i: parts[i] - shares[i])
+    for i in by_remainder[: total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def _num_choice_tokens(choice: dict) -> int:
+    """The number of tokens in `choice` if its logprobs were returned, else 1 per choice."""
+    logprobs = choice.get("logprobs")
+    if logprobs and logprobs.get("tokens") is not None:
+        return len(logprobs["tokens"])
+    return 1
+
+
+def split_batch_response(
+    raw_data: Any, prompts: list[OpenAICreatePrompt], n: int = 1, model: Optional[str] = None
+) -> list[dict]:
+    """
+    Split the response to a request for `prompts` into one response per prompt. The
+    choices for prompt `i` have indices `i * n` to `(i + 1) * n - 1`. The prompt tokens
+    are attributed to each prompt by its token count, and the completion tokens by its
+    choices, so totals are unchanged.
+    """
+    num_prompts = len(prompts)
+    choices: list[list] = [[] for _ in range(num_prompts)]
+    for choice in raw_data["choices"]:
+        i, j = divmod(choice["index"], n)
+        choices[i].append({**choice, "index": j})
+
+    usage = raw_data.get("usage")
+    if usage is not None:
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", usage["total_tokens"] - prompt_tokens)
+        prompt_weights = (
+            [num_tokens_from_prompt(prompt, model) for prompt in prompts]
+            if prompt_tokens
+            else [0] * num_prompts
+        )
+        prompt_parts = _split_tokens(prompt_tokens, prompt_weights)
+        completion_parts = _split_tokens(
+            completion_tokens, [sum(map(_num_choice_tokens, c)) for c in choices]
+        )
+
+    responses = []
+    for i in range(num_prompts):
+        response = {**raw_data, "choices": choices[i]}
+        if usage is not None:
+            response["usage"] = {
+                "prompt_tokens": prompt_parts[i],
+                "completion_tokens": completion_parts[i],
+                "total_tokens": prompt_parts[i] + completion_parts[i],
+            }
+        responses.append(response)
+    return responses
+
+
+class _Batch:
+    def __init__(self):
+        self.prompts: list[OpenAICreatePrompt] = []
+        self.futures: list[Union[concurrent.futures.Future, asyncio.Future]] = []
+        self.full = threading.Event()
+        self.afull: Optional[asyncio.Event] = None
+
+
+class CompletionBatcher:
+    """
+    Batches concurrent calls to `create` (e.g. `openai_completion_create_retrying`)
+    and `acreate` into requests of up to `max_batch_size` prompts. The first call of a
+    batch waits up to `max_wait` seconds for others to join it, then sends the batch.
+    """
+
+    def __init__(
+        self,
+        create: Callable[..., Any],
+        acreate: Callable[..., Awaitable[Any]],
+        max_batch_size: int = MAX_PROMPTS_PER_REQUEST,
+        max_wait: float = 0.005,
+    ):
+        assert (
+            1 <= max_batch_size <= MAX_PROMPTS_PER_REQUEST
+        ), f"max_batch_size must be between 1 and {MAX_PROMPTS_PER_REQUEST}"
+        self.create = create
+        self.acreate = acreate
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending: dict[str, _Batch] = {}
+        self._apending: dict[str, _Batch] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _batch_key(kwargs: dict) -> str:
+        return json.dumps(kwargs, sort_keys=True, default=str)
+
+    def _join(self, pending: dict[str, _Batch], key: str, prompt, future) -> tuple[_Batch, bool]:
+        """Add `prompt` to the pending batch for `key`, returning it and whether it's new."""
+        batch = pending.get(key)
+        is_new = batch is None
+        if is_new:
+            batch = pending[key] = _Batch()
+        batch.prompts.append(prompt)
+        batch.futures.append(future)
+        if len(batch.prompts) >= self.max_batch_size:
+            del pending[key]
+            batch.full.set()
+            if batch.afull is not None:
+                batch.afull.set()
+        return batch, is_new
+
+    def _close(self, pending: dict[str, _Batch], key: str, batch: _Batch):
+        if pending.get(key) is batch:
+            del pending[key]
+
+    @staticmethod
+    def _send(batch: _Batch, create: Callable[..., Any], kwargs: dict):
+        prompts = batch.prompts[0] if len(batch.prompts) == 1 else batch.prompts
+        return create(prompt=prompts, **kwargs)
+
+    @staticmethod
+    def _resolve(batch: _Batch, raw_data: Any, kwargs: dict):
+        responses = split_batch_response(
+            raw_data, batch.prompts, kwargs.get("n", 1), model=kwargs.get("model")
+        )
+        for future, response in zip(batch.futures, responses):
+            future.set_result(response)
+
+    @staticmethod
+    def _fail(batch: _Batch, e: BaseException):
+        for future in batch.futures:
+            if not future.done():
+                future.set_exception(e)
+
+    def __call__(self, prompt: OpenAICreatePrompt, **kwargs) -> Any:
+        key = self._batch_key(kwargs)
+        future = concurrent.futures.Future()
+        with self._lock:
+            batch, is_leader = self._join(self._pending, key, prompt, future)
+        if is_leader:
+            batch.full.wait(self.max_wait)
+            with self._lock:
+                self._close(self._pending, key, batch)
+            try:
+                self._resolve(batch, self._send(batch, self.create, kwargs), kwargs)
+            except BaseException as e:
+                self._fail(batch, e)
+        return future.result()
+
+    async def acall(self, prompt: OpenAICreatePrompt, **kwargs) -> Any:
+        key = self._batch_key(kwargs)
+        future = asyncio.get_running_loop().create_future()
+        batch, is_leader = self._join(self._apending, key, prompt, future)
+        if is_leader:
+            batch.afull = asyncio.Event()
+            # collect and send the batch in its own task, so cancelling the first caller
+            # doesn't cancel the request for the others
+            task = asyncio.ensure_future(self._acollect_and_send(key, batch, kwargs))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(future)
+
+    async def _acollect_and_send(self, key: str, batch: _Batch, kwargs: dict):
+        if not batch.full.is_set():
+            try:
+                await asyncio.wait_for(batch.afull.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+        self._close(self._apending, key, batch)
+        try:
+            self._resolve(batch, await self._send(batch, self.acreate, kwargs), kwargs)
+        except BaseException as e:
+            self._fail(batch, e)
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+import pytest
+
+from evals.utils.batching import CompletionBatcher, is_batchable, split_batch_response
+
+
+def fake_response(prompt, n=1, **kwargs):
+    prompts = prompt if isinstance(prompt, list) else [prompt]
+    return {
+        "choices": [
+            {"index": i * n + j, "text": f"{p}-{j}"}
+            for i, p in enumerate(prompts)
+            for j in range(n)
+        ],
+        "usage": {"total_tokens": 10 * len(prompts) + 1},
+    }
+
+
+def test_split_batch_response():
+    responses = split_batch_response(fake_response(["a", "b", "c"], n=2), ["a", "b", "c"], n=2)
+    assert [[c["text"] for c in r["choices"]] for r in responses] == [
+        ["a-0", "a-1"],
+        ["b-0", "b-1"],
+        ["c-0", "c-1"],
+    ]
+    assert [c["index"] for c in responses[2]["choices"]] == [0, 1]
+    assert sum(r["usage"]["total_tokens"] for r in responses) == 31
+
+
+def test_split_batch_response_usage():
+    prompts = [[1, 2, 3, 4, 5, 6], [7, 8]]
+    raw_data = {
+        "choices": [
+            {"index": 0, "text": "a", "logprobs": {"tokens": ["a"]}},
+            {"index": 1, "text": "bcd", "logprobs": {"tokens": ["b", "c", "d"]}},
+        ],
+        "usage": {"prompt_tokens": 8, "completion_tokens": 4, "total_tokens": 12},
+    }
+    responses = split_batch_response(raw_data, prompts, model="davinci")
+    assert [r["usage"] for r in responses] == [
+        {"prompt_tokens": 6, "completion_tokens": 1, "total_tokens": 7},
+        {"prompt_tokens": 2, "completion_tokens": 3, "total_tokens": 5},
+    ]
+
+
+def test_is_batchable():
+    assert is_batchable("a prompt")
+    assert is_batchable([1, 2, 3])
+    assert not is_batchable(["a", "b"])
+
+
+def test_batcher_from_threads():
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return fake_response(**kwargs)
+
+    batcher = CompletionBatcher(create, None, max_batch_size=4, max_wait=1.0)
+    results = {}
+
+    def call(i):
+        results[i] = batcher(prompt=str(i), model="m", n=2)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # batches are sent as soon as they're full, without waiting for max_wait
+    assert len(requests) == 2
+    assert all(len(request["prompt"]) == 4 for request in requests)
+    assert all([c["text"] for c in results[i]["choices"]] == [f"{i}-0", f"{i}-1"] for i in range(8))
+
+
+def test_batcher_async_shares_errors():
+    async def acreate(**kwargs):
+        raise ValueError("bad request")
+
+    batcher = CompletionBatcher(None, acreate, max_wait=0.01)
+
+    async def main():
+        return await asyncio.gather(
+            *[batcher.acall(prompt=str(i), model="m") for i in range(3)], return_exceptions=True
+        )
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(main()))
+
+
+def test_batcher_async():
+    requests = []
+
+    async def acreate(**kwargs):
+        requests.append(kwargs)
+        return fake_response(**kwargs)
+
+    batcher = CompletionBatcher(None, acreate, max_wait=0.01)
+
+    async def main():
+        return await asyncio.gather(
+            batcher.acall(prompt="a", model="m"),
+            batcher.acall(prompt="b", model="m"),
+            batcher.acall(prompt="c", model="other"),
+        )
+
+    results = asyncio.run(main())
+    assert sorted(len(r["prompt"]) if isinstance(r["prompt"], list) else 1 for r in requests) == [
+        1,
+        2,
+    ]
+    assert [r["choices"][0]["text"] for r in results] == ["a-0", "b-0", "c-0"]
+
+
+def test_batcher_rejects_oversized_batches():
+    with pytest.raises(AssertionError):
+        CompletionBatcher(None, None, max_batch_size=21)
@@ -0,0 +1,141 @@
+"""
+This file defines a persistent, content-addressed on-disk cache of API completions,
+so repeated runs of the same deterministic requests don't pay for them again.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path.home() / ".evals" / "cache"
+DEFAULT_CACHE_MAX_BYTES = 2 * 2**30
+# How many inserts to wait between checks of the cache size.
+EVICTION_CHECK_INTERVAL = 100
+# Eviction removes least recently used entries until the cache is this fraction of its max size.
+EVICTION_TARGET = 0.9
+
+
+class CompletionCache:
+    """
+    A SQLite-backed map from request keys (see `make_key`) to raw API responses.
+    Safe to use from many threads, and from several processes sharing the same
+    file. Once the stored responses exceed `max_bytes`, the least recently used
+    ones are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(**request: Any) -> str:
+        """Return a key identifying a request by its model, prompt and sampling kwargs."""
+        serialized = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        serialized = json.dumps(value, ensure_ascii=False)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO completions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, serialized, len(serialized), time.time()),
+        )
+        with self._lock:
+            self._inserts += 1
+            check_size = self._inserts % EVICTION_CHECK_INTERVAL == 0
+        if check_size:
+            self.evict()
+
+    def evict(self):
+        """Evict least recently used entries if the cache is over its max size."""
+        conn = self._conn()
+        (total_bytes,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        # keep the most recently used entries which fit in the target size
+        conn.execute(
+            """
+            DELETE FROM completions WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_access DESC) AS cumulative_size
+                    FROM completions
+                ) WHERE cumulative_size > ?
+            )
+            """,
+            (int(self.max_bytes * EVICTION_TARGET),),
+        )
+        logger.info(f"Evicted completions from {self.path} ({total_bytes} bytes were cached)")
+
+
+# Off by default: a model name can be repointed at a newer snapshot, which a cached
+# completion wouldn't reflect.
+_cache_enabled = os.environ.get("EVALS_CACHE", "0") in {"1", "true", "yes"}
+_cache: Optional[CompletionCache] = None
+_cache_lock = threading.Lock()
+
+
+def set_cache_enabled(enabled: bool):
+    global _cache_enabled
+    _cache_enabled = enabled
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """
+    Return the process-wide completion cache, stored under `EVALS_CACHE_DIR`
+    (default `~/.evals/cache`), or None if caching is disabled.
+    """
+    global _cache
+    if not _cache_enabled:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            cache_dir = os.environ.get("EVALS_CACHE_DIR", str(DEFAULT_CACHE_DIR))
+            _cache = CompletionCache(
+                os.path.join(cache_dir, "completions.sqlite"),
+                max_bytes=int(os.environ.get("EVALS_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+            )
+        return _cache
+
+
+def is_cacheable(kwargs: dict) -> bool:
+    """Only deterministic (temperature 0) requests are cached."""
+    return kwargs.get("temperature") == 0
@@ -0,0 +1,48 @@
+import threading
+
+from evals.utils.completion_cache import CompletionCache, is_cacheable
+
+
+def test_cache_round_trip(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"))
+    key = cache.make_key(endpoint="prompt", model="m", prompt="hi", temperature=0)
+    assert key == cache.make_key(temperature=0, prompt="hi", model="m", endpoint="prompt")
+    assert key != cache.make_key(endpoint="prompt", model="m", prompt="hi", temperature=0, n=2)
+    assert cache.get(key) is None
+    cache.set(key, {"choices": [{"text": "hello"}]})
+    assert cache.get(key) == {"choices": [{"text": "hello"}]}
+    # a new instance sees entries persisted by the old one
+    assert CompletionCache(cache.path).get(key) == {"choices": [{"text": "hello"}]}
+
+
+def test_cache_from_threads(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"))
+
+    def work(i):
+        cache.set(str(i), {"i": i})
+        assert cache.get(str(i)) == {"i": i}
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(cache.get(str(i)) == {"i": i} for i in range(16))
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"), max_bytes=100)
+    for i in range(10):
+        cache.set(str(i), "x" * 20)
+    cache.get("0")
+    cache.evict()
+    assert cache.get("0") is not None
+    assert cache.get("9") is not None
+    assert cache.get("1") is None
+
+
+def test_is_cacheable():
+    assert is_cacheable({"temperature": 0})
+    assert is_cacheable({"temperature": 0.0})
+    assert not is_cacheable({})
+    assert not is_cacheable({"temperature": 0.7})
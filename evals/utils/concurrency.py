@@ -0,0 +1,152 @@
+"""
+This file defines an adaptive concurrency controller which limits how many samples
+are evaluated at once, based on rate-limit feedback from the API helpers.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_active_controller: ContextVar[Optional["AIMDConcurrencyController"]] = ContextVar(
+    "active_concurrency_controller", default=None
+)
+
+
+def active_concurrency_controller() -> Optional["AIMDConcurrencyController"]:
+    return _active_controller.get()
+
+
+class AIMDConcurrencyController:
+    """
+    Additive-increase / multiplicative-decrease limit on the number of in-flight
+    samples. Every `limit` successful API calls raise the limit by `increase`;
+    a rate-limit or timeout error multiplies it by `decrease_factor`. Congestion
+    signals within `cooldown` seconds of the last decrease are treated as part of
+    the same event, since in-flight requests tend to fail together.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        initial_limit: Optional[int] = None,
+        min_limit: int = 1,
+        increase: int = 1,
+        decrease_factor: float = 0.5,
+        cooldown: float = 5.0,
+    ):
+        assert 1 <= min_limit <= max_limit, f"Invalid limits: min={min_limit}, max={max_limit}"
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        if initial_limit is None:
+            initial_limit = max(min_limit, max_limit // 4)
+        self._limit = min(max(initial_limit, min_limit), max_limit)
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._num_increases = 0
+        self._num_decreases = 0
+        self._cond = threading.Condition()
+        self._acond: Optional[asyncio.Condition] = None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self._in_flight >= self._limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def acquire(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one in-flight slot and route API feedback to this controller."""
+        self.acquire()
+        token = _active_controller.set(self)
+        try:
+            yield
+        finally:
+            _active_controller.reset(token)
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        """Async counterpart of `slot`, for use on a single event loop."""
+        if self._acond is None:
+            self._acond = asyncio.Condition()
+        async with self._acond:
+            await self._acond.wait_for(self.try_acquire)
+        token = _active_controller.set(self)
+        try:
+            yield
+        finally:
+            _active_controller.reset(token)
+            self.release()
+            async with self._acond:
+                self._acond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes < self._limit or self._limit >= self.max_limit:
+                return
+            self._successes = 0
+            old_limit = self._limit
+            self._limit = min(self.max_limit, self._limit + self.increase)
+            self._num_increases += 1
+            self._cond.notify_all()
+        logger.info(f"Adaptive concurrency: increased limit {old_limit} -> {self._limit}")
+
+    def on_congestion(self, reason: str):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._successes = 0
+            old_limit = self._limit
+            self._limit = max(self.min_limit, int(self._limit * self.decrease_factor))
+            self._num_decreases += 1
+        logger.warning(
+            f"Adaptive concurrency: decreased limit {old_limit} -> {self._limit} after {reason}"
+        )
+
+    def log_summary(self):
+        logger.info(
+            f"Adaptive concurrency: final limit {self._limit} "
+            f"({self._num_increases} increases, {self._num_decreases} decreases)"
+        )
+
+
+def make_concurrency_controller(max_limit: int) -> Optional[AIMDConcurrencyController]:
+    """
+    Return an `AIMDConcurrencyController` capped at `max_limit` if enabled with
+    `EVALS_ADAPTIVE_CONCURRENCY`, else None.
+    """
+    if os.environ.get("EVALS_ADAPTIVE_CONCURRENCY", "0") not in {"1", "true", "yes"}:
+        return None
+    initial_limit = os.environ.get("EVALS_ADAPTIVE_INITIAL_CONCURRENCY")
+    return AIMDConcurrencyController(
+        max_limit=max_limit,
+        initial_limit=int(initial_limit) if initial_limit else None,
+    )
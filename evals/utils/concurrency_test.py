@@ -0,0 +1,27 @@
+from evals.utils.concurrency import AIMDConcurrencyController
+
+
+def test_additive_increase():
+    controller = AIMDConcurrencyController(max_limit=4, initial_limit=2)
+    for _ in range(2):
+        controller.on_success()
+    assert controller.limit == 3
+    for _ in range(10):
+        controller.on_success()
+    assert controller.limit == 4
+
+
+def test_multiplicative_decrease_with_cooldown():
+    controller = AIMDConcurrencyController(max_limit=16, initial_limit=16, cooldown=60)
+    controller.on_congestion("RateLimitError")
+    assert controller.limit == 8
+    # further errors from the same burst are ignored
+    controller.on_congestion("RateLimitError")
+    assert controller.limit == 8
+
+
+def test_slot_respects_limit():
+    controller = AIMDConcurrencyController(max_limit=2, initial_limit=1)
+    with controller.slot():
+        assert not controller.try_acquire()
+    assert controller.try_acquire()
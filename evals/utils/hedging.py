@@ -0,0 +1,95 @@
+"""
+This file defines the policy for hedging API requests: a request which is still running
+after a high percentile of recent request latencies is sent again, and whichever copy
+finishes first is used.
+"""
+import collections
+import logging
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class HedgingPolicy:
+    """
+    Decides when to hedge a request to `model`: once it has run longer than the
+    `percentile` of the latencies of the last `window` requests to that model (after
+    `min_samples` of them). Hedges are capped at `max_hedge_ratio` of all requests.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        max_hedge_ratio: float = 0.05,
+        min_samples: int = 20,
+        window: int = 1000,
+    ):
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies: dict[Optional[str], collections.deque] = {}
+        self.num_requests = 0
+        self.num_hedges = 0
+        self.num_hedges_won = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["HedgingPolicy"]:
+        """Return the policy configured by `EVALS_HEDGE_*`, or None if hedging is off."""
+        percentile = os.environ.get("EVALS_HEDGE_PERCENTILE")
+        if not percentile:
+            return None
+        return cls(
+            percentile=float(percentile),
+            max_hedge_ratio=float(os.environ.get("EVALS_HEDGE_MAX_RATIO", "0.05")),
+            min_samples=int(os.environ.get("EVALS_HEDGE_MIN_SAMPLES", "20")),
+        )
+
+    def hedge_delay(self, model: Optional[str]) -> Optional[float]:
+        """Return how long to wait before hedging a new request, or None not to hedge."""
+        with self._lock:
+            self.num_requests += 1
+            latencies = self._latencies.get(model)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            return float(np.percentile(latencies, self.percentile))
+
+    def record_latency(self, model: Optional[str], latency: float):
+        with self._lock:
+            latencies = self._latencies.get(model)
+            if latencies is None:
+                latencies = self._latencies[model] = collections.deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def try_hedge(self) -> bool:
+        """Return whether a hedge may be sent within the cap, counting it if so."""
+        with self._lock:
+            if self.num_hedges + 1 > self.max_hedge_ratio * self.num_requests:
+                return False
+            self.num_hedges += 1
+            return True
+
+    def on_hedge_won(self):
+        with self._lock:
+            self.num_hedges_won += 1
+
+    def summary(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hedging/requests": self.num_requests,
+                "hedging/hedges_sent": self.num_hedges,
+                "hedging/hedges_won": self.num_hedges_won,
+            }
+
+    def log_summary(self):
+        summary = self.summary()
+        logger.info(
+            f"Hedging: sent {summary['hedging/hedges_sent']} hedges for "
+            f"{summary['hedging/requests']} requests, of which "
+            f"{summary['hedging/hedges_won']} finished first"
+        )
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import pytest
+
+from evals.utils import api_utils
+from evals.utils.hedging import HedgingPolicy
+
+
+def test_hedge_delay_needs_min_samples():
+    policy = HedgingPolicy(percentile=50, min_samples=3)
+    policy.record_latency("m", 1.0)
+    policy.record_latency("m", 2.0)
+    assert policy.hedge_delay("m") is None
+    policy.record_latency("m", 3.0)
+    assert policy.hedge_delay("m") == 2.0
+    assert policy.hedge_delay("other") is None
+
+
+def test_hedges_are_capped():
+    policy = HedgingPolicy(max_hedge_ratio=0.1)
+    for _ in range(20):
+        policy.hedge_delay("m")
+    assert [policy.try_hedge() for _ in range(3)] == [True, True, False]
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    policy = HedgingPolicy(percentile=50, max_hedge_ratio=1.0, min_samples=1)
+    policy.record_latency("m", 0.01)
+    monkeypatch.setattr(api_utils, "hedging_policy", policy)
+    return policy
+
+
+def test_request_with_timeout_hedges_slow_request(policy):
+    delays = [1.0, 0.0]
+
+    def request(model):
+        delay = delays.pop(0)
+        time.sleep(delay)
+        return delay
+
+    assert api_utils.request_with_timeout(request, model="m", timeout=5) == 0.0
+    assert policy.summary() == {
+        "hedging/requests": 1,
+        "hedging/hedges_sent": 1,
+        "hedging/hedges_won": 1,
+    }
+
+
+def test_arequest_with_timeout_hedges_slow_request(policy):
+    delays = [1.0, 0.0]
+
+    async def request(model):
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    assert asyncio.run(api_utils.arequest_with_timeout(request, model="m", timeout=5)) == 0.0
+    assert policy.num_hedges_won == 1
+
+
+def test_hedged_request_times_out(policy):
+    def request(model):
+        time.sleep(0.5)
+
+    with pytest.raises(api_utils.openai.error.Timeout):
+        api_utils.request_with_timeout(request, model="m", timeout=0.1)
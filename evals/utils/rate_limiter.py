@@ -0,0 +1,162 @@
+"""
+This file defines a process-wide, per-model rate limiter with requests-per-minute
+and tokens-per-minute budgets, which callers wait on before sending a request.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from evals.prompt.base import num_tokens_from_prompt
+
+logger = logging.getLogger(__name__)
+
+# `max_tokens` assumed when a request doesn't set one, if the API has no default.
+DEFAULT_COMPLETION_TOKENS = {
+    "prompt": 16,  # openai.Completion.create default
+    "messages": 256,
+}
+
+
+class TokenBucket:
+    """
+    A bucket holding up to `per_minute` units which refills continuously. A request
+    larger than the whole bucket is let through once the bucket is full, so it
+    can't wait forever.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self.level -= amount
+
+
+class ModelRateLimiter:
+    """
+    Shared requests-per-minute and tokens-per-minute budgets for a single model.
+    Either budget may be None (unlimited).
+    """
+
+    def __init__(
+        self,
+        model: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, num_tokens: int) -> float:
+        """Take budget for one request of `num_tokens`, or return how long to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests is not None:
+                wait = max(wait, self._requests.wait_time(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.wait_time(num_tokens, now))
+            if wait > 0:
+                return wait
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(num_tokens)
+            return 0.0
+
+    def acquire(self, num_tokens: int):
+        while (wait := self._try_acquire(num_tokens)) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, num_tokens: int):
+        while (wait := self._try_acquire(num_tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token budget once the actual usage of a request is known."""
+        if self._tokens is None:
+            return
+        with self._lock:
+            self._tokens.consume(actual_tokens - estimated_tokens)
+
+
+_rate_limiters: dict[str, ModelRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def configure_rate_limit(
+    model: str,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+):
+    """
+    Set the process-wide budgets for `model`. If they are unchanged, the existing
+    limiter is kept, so budget already used by other completion fns still counts.
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model)
+        if limiter is not None and (limiter.requests_per_minute, limiter.tokens_per_minute) == (
+            requests_per_minute,
+            tokens_per_minute,
+        ):
+            return
+        _rate_limiters[model] = ModelRateLimiter(model, requests_per_minute, tokens_per_minute)
+
+
+def get_rate_limiter(model: Optional[str]) -> Optional[ModelRateLimiter]:
+    """
+    Return the rate limiter for `model`. Models without explicitly configured budgets
+    use `EVALS_RPM_LIMIT` and `EVALS_TPM_LIMIT`; returns None if neither is set.
+    """
+    if model is None:
+        return None
+    with _rate_limiters_lock:
+        if model not in _rate_limiters:
+            rpm = os.environ.get("EVALS_RPM_LIMIT")
+            tpm = os.environ.get("EVALS_TPM_LIMIT")
+            if not (rpm or tpm):
+                return None
+            _rate_limiters[model] = ModelRateLimiter(
+                model,
+                requests_per_minute=float(rpm) if rpm else None,
+                tokens_per_minute=float(tpm) if tpm else None,
+            )
+        return _rate_limiters[model]
+
+
+def estimate_request_tokens(kwargs: dict[str, Any]) -> int:
+    """
+    Estimate the tokens a request will count against the TPM budget: the prompt
+    plus `max_tokens` for each of the `n` completions of each prompt.
+    """
+    model = kwargs.get("model")
+    prompt_key = "messages" if "messages" in kwargs else "prompt"
+    prompt = kwargs.get(prompt_key, "")
+    num_tokens = num_tokens_from_prompt(prompt, model)
+    max_tokens = kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS[prompt_key]
+    num_prompts = 1
+    if prompt_key == "prompt" and isinstance(prompt, list) and prompt:
+        # a list of strings or of token lists is a batch of prompts
+        num_prompts = 1 if all(isinstance(token, int) for token in prompt) else len(prompt)
+    return num_tokens + max_tokens * kwargs.get("n", 1) * num_prompts
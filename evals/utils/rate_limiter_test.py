@@ -0,0 +1,37 @@
+from evals.utils.rate_limiter import ModelRateLimiter, configure_rate_limit, get_rate_limiter
+
+
+def test_tokens_per_minute_budget():
+    limiter = ModelRateLimiter("model", tokens_per_minute=100)
+    assert limiter._try_acquire(80) == 0
+    assert limiter._try_acquire(80) > 0
+
+
+def test_reconcile_refunds_overestimate():
+    limiter = ModelRateLimiter("model", tokens_per_minute=100)
+    limiter.acquire(80)
+    limiter.reconcile(estimated_tokens=80, actual_tokens=20)
+    assert limiter._try_acquire(80) == 0
+
+
+def test_requests_per_minute_budget():
+    limiter = ModelRateLimiter("model", requests_per_minute=2)
+    assert limiter._try_acquire(1000) == 0
+    assert limiter._try_acquire(1000) == 0
+    assert limiter._try_acquire(1000) > 0
+
+
+def test_oversized_request_waits_for_full_bucket():
+    limiter = ModelRateLimiter("model", tokens_per_minute=100)
+    assert limiter._try_acquire(500) == 0
+    assert limiter._try_acquire(1) > 0
+
+
+def test_configure_rate_limit_keeps_budget_used_so_far():
+    configure_rate_limit("configured-model", tokens_per_minute=100)
+    get_rate_limiter("configured-model").acquire(80)
+    configure_rate_limit("configured-model", tokens_per_minute=100)
+    assert get_rate_limiter("configured-model")._try_acquire(80) > 0
+
+    configure_rate_limit("configured-model", tokens_per_minute=200)
+    assert get_rate_limiter("configured-model")._try_acquire(80) == 0
@@ -0,0 +1,57 @@
+"""
+This file defines single-flight deduplication of concurrent identical calls: while a
+call for a key is in flight, other callers with the same key wait for its result
+instead of making their own.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Callable, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, concurrent.futures.Future] = {}
+        self._acalls: dict[Tuple[int, str], asyncio.Task] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Return the result of `fn()`, or of the in-flight call for `key` if there is one,
+        and whether the result was shared with another caller. Exceptions are shared too.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            shared = future is not None
+            if not shared:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+        if shared:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Like `do`, for coroutines on the running event loop. The call runs in its own
+        task, so it carries on for the callers waiting on it if the first caller is
+        cancelled.
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        task = self._acalls.get(loop_key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(fn())
+            self._acalls[loop_key] = task
+            task.add_done_callback(lambda _: self._acalls.pop(loop_key, None))
+        return await asyncio.shield(task), shared
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+
+from evals.utils.single_flight import SingleFlight
+
+
+def test_do_shares_in_flight_call():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "result"
+
+    leader = threading.Thread(target=lambda: results.append(single_flight.do("key", fn)))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(single_flight.do("key", fn)))
+        for _ in range(3)
+    ]
+    for follower in followers:
+        follower.start()
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+    # followers which arrive after the call finishes make their own call
+    assert len(calls) + sum(shared for _, shared in results) == 4
+    assert all(result == "result" for result, _ in results)
+    assert single_flight.do("key", lambda: "again") == ("again", False)
+
+
+class CountingLock:
+    """A lock which counts how many times it has been released."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.num_released = 0
+        self.released = threading.Condition()
+
+    def __enter__(self):
+        self._lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+        with self.released:
+            self.num_released += 1
+            self.released.notify_all()
+
+
+def test_do_shares_exceptions():
+    single_flight = SingleFlight()
+    lock = single_flight._lock = CountingLock()
+    started, release = threading.Event(), threading.Event()
+    calls, errors = [], []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait()
+        raise ValueError("failed")
+
+    def call():
+        try:
+            single_flight.do("key", fn)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    # once the follower has looked up the in-flight call, let the leader fail
+    with lock.released:
+        lock.released.wait_for(lambda: lock.num_released >= 2)
+    release.set()
+    for thread in [leader, follower]:
+        thread.join()
+    assert len(calls) == 1
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert single_flight.do("key", lambda: 1) == (1, False)
+
+
+def test_ado_shares_in_flight_call():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*[single_flight.ado("key", fn) for _ in range(4)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["result"] * 4
+    assert [shared for _, shared in results] == [False, True, True, True]
@@ -4,9 +4,12 @@ Familiarity with this file should not be needed even if working with Snowflake.
 """
 import logging
 import os
+import queue
+import random
+import threading
 import time
 from contextlib import contextmanager
-from typing import Optional
+from typing import Callable, Mapping, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,11 @@ def _first_not_none(*args):
     return None
 
 
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Return a jittered exponential backoff delay for the `attempt`th retry (from 0)."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
 class SnowflakeError(Exception):
     pass
 
@@ -122,6 +130,118 @@ class SnowflakeConnection:
             except (OperationalError, ProgrammingError) as e:
                 if max_trials is not None and ntrials >= max_trials:
                     raise
-                logger.info(f"Snowflake insert failed, will retry in 5s {e}")
+                delay = backoff_delay(ntrials)
+                logger.info(f"Snowflake insert failed, will retry in {delay:.1f}s {e}")
                 ntrials += 1
-                time.sleep(5)
+                time.sleep(delay)
+
+
+def bulk_load_json(
+    conn: SnowflakeConnection,
+    table: str,
+    columns: Mapping[str, str],
+    path: str,
+    stage_dir: Optional[str] = None,
+):
+    """
+    Load a gzipped JSONL file into `table` with a single COPY, instead of inserting its
+    rows with a query. Each line is an object with a key per column in `columns`, which
+    maps column names to their Snowflake types. The file is uploaded to the table's
+    stage, under `stage_dir` if given (e.g. a run ID, so that concurrent loads of files
+    with the same name don't collide), and removed from it once loaded.
+    """
+    name = os.path.basename(path)
+    stage = f"@%{table}/{stage_dir}/" if stage_dir else f"@%{table}"
+    conn.robust_query(command=f"PUT 'file://{path}' {stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+    select = ", ".join(f"$1:{column}::{type}" for column, type in columns.items())
+    conn.robust_query(
+        command=f"""
+            COPY INTO {table} ({", ".join(columns)})
+            FROM (SELECT {select} FROM {stage})
+            FILES = ('{name}')
+            FILE_FORMAT = (TYPE = JSON COMPRESSION = GZIP)
+            PURGE = TRUE
+        """
+    )
+
+
+class SnowflakeUploader:
+    """
+    Uploads files to Snowflake from a background thread, so that a slow or unavailable
+    Snowflake doesn't hold up the caller. Each submitted batch is first written to a
+    file in `spool_dir`, and then passed to `load`, which is retried with jittered
+    exponential backoff until it succeeds. At most `max_pending` files wait to be
+    uploaded: later batches are dropped (and counted), so callers should also keep
+    their data elsewhere.
+    """
+
+    def __init__(self, load: Callable[[str], None], spool_dir: str, max_pending: int = 100):
+        self.load = load
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        self.max_pending = max_pending
+        self._queue: queue.Queue[str] = queue.Queue()
+        self._lock = threading.Lock()
+        self._num_files = 0
+        self.num_uploaded = 0
+        self.num_dropped = 0
+        self.num_failures = 0
+        self._worker = threading.Thread(target=self._upload, daemon=True)
+        self._worker.start()
+
+    def submit(self, data: bytes, suffix: str = "") -> bool:
+        """Queue `data` to be uploaded, returning False if it was dropped."""
+        with self._lock:
+            # the file being uploaded counts as pending too
+            if self.num_pending >= self.max_pending:
+                self.num_dropped += 1
+                return False
+            path = os.path.join(self.spool_dir, f"{self._num_files:08d}{suffix}")
+            self._num_files += 1
+            with open(path, "wb") as f:
+                f.write(data)
+            self._queue.put(path)
+        return True
+
+    def _upload(self):
+        while True:
+            path = self._queue.get()
+            attempt = 0
+            while True:
+                try:
+                    self.load(path)
+                    break
+                except Exception as e:
+                    delay = backoff_delay(attempt)
+                    logger.warning(
+                        f"Snowflake upload of {path} failed, will retry in {delay:.1f}s {e}"
+                    )
+                    with self._lock:
+                        self.num_failures += 1
+                    attempt += 1
+                    time.sleep(delay)
+            os.remove(path)
+            with self._lock:
+                self.num_uploaded += 1
+            self._queue.task_done()
+
+    @property
+    def num_pending(self) -> int:
+        return self._queue.unfinished_tasks
+
+    def drain(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the queued files to be uploaded."""
+        deadline = time.time() + timeout
+        while self.num_pending and time.time() < deadline:
+            time.sleep(min(0.1, max(0.0, deadline - time.time())))
+        return not self.num_pending
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "snowflake/ingest_complete": self.num_pending == 0 and self.num_dropped == 0,
+                "snowflake/uploaded_batches": self.num_uploaded,
+                "snowflake/pending_batches": self.num_pending,
+                "snowflake/dropped_batches": self.num_dropped,
+                "snowflake/upload_failures": self.num_failures,
+            }